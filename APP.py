@@ -1,177 +1,51 @@
 
-import os
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime
-from datetime import timedelta 
 
-TABLE_DIR = "tables_csv"
-
-def read_table(name):
-    path = f"{TABLE_DIR}/{name}.csv"
-    return pd.read_csv(path) if os.path.exists(path) else pd.DataFrame()
-
-def write_table(name, df):
-    df.to_csv(f"{TABLE_DIR}/{name}.csv", index=False)
-
-def append_table(name, df_new):
-    df_old = read_table(name)
-    if df_old.empty:
-        write_table(name, df_new)
-    else:
-        write_table(name, pd.concat([df_old, df_new], ignore_index=True))
-
-def next_id(name, id_col, start=1):
-    df = read_table(name)
-    if df.empty or id_col not in df.columns:
-        return start
-    mx = pd.to_numeric(df[id_col], errors="coerce").max()
-    return start if pd.isna(mx) else int(mx) + 1
-
-
-# ====== ERP ======
-def erp_record_sale(order_id):
-    orders = read_table("orders")
-    items = read_table("order_items")
-    prod  = read_table("products")
-
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    row = orders[orders["order_id"] == int(order_id)]
-    total = float(row["total_amount"].iloc[0])
-
-    now = datetime.utcnow().isoformat()
-    entry_id = next_id("ledger_entries", "entry_id", 1)
-    append_table("ledger_entries", pd.DataFrame([{
-        "entry_id": entry_id, "entry_ts": now, "order_id": order_id,
-        "entry_type": "REVENUE", "amount": total, "note": "Ingreso por venta"
-    }]))
-
-    items["order_id"] = pd.to_numeric(items["order_id"], errors="coerce")
-    oi = items[items["order_id"] == int(order_id)].merge(prod, on="product_id", how="left")
-    oi["quantity"] = pd.to_numeric(oi["quantity"], errors="coerce").fillna(0)
-    oi["unit_cost"] = pd.to_numeric(oi["unit_cost"], errors="coerce").fillna(0)
-    cogs = float((oi["quantity"] * oi["unit_cost"]).sum())
-
-    entry_id2 = next_id("ledger_entries", "entry_id", 1)
-    append_table("ledger_entries", pd.DataFrame([{
-        "entry_id": entry_id2, "entry_ts": now, "order_id": order_id,
-        "entry_type": "COGS", "amount": cogs, "note": "Costo estimado"
-    }]))
+from src.storage import read_table, write_table, append_table, next_id, get_rows, rows_below_min
+from src.customer_index import lookup_customer
+from src.config import ASYNC_POSTING
+from src import tps, posting, rollups, inventory_history, kpi_cube, order_index
+from src import rfm as rfm_mod
+from src.charts import KPI_CHARTS, RFM_CHARTS, kpi_series, fig_pnl
+from src.chart_cache import cached_png, chart_cache_info
+from src.replenishment import plan_replenishment, run_replenishment
+from src.forecast import update_inventory_params
+from src.scm import receive_pos, set_stock
 
 
 # ====== SCM ======
-def scm_apply_sale(order_id):
-    orders = read_table("orders")
-    items  = read_table("order_items")
-    inv    = read_table("inventory")
-
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    orow = orders[orders["order_id"] == int(order_id)]
-    branch_id = int(orow["branch_id"].iloc[0])
-
-    items["order_id"] = pd.to_numeric(items["order_id"], errors="coerce")
-    oitems = items[items["order_id"] == int(order_id)]
-    if oitems.empty:
-        return []
-
-    # normalizar inventario
-    inv["branch_id"] = pd.to_numeric(inv["branch_id"], errors="coerce").fillna(0).astype(int)
-    inv["product_id"] = pd.to_numeric(inv["product_id"], errors="coerce").fillna(0).astype(int)
-    inv["stock_on_hand"] = pd.to_numeric(inv["stock_on_hand"], errors="coerce").fillna(0).astype(int)
-    inv["stock_min"] = pd.to_numeric(inv["stock_min"], errors="coerce").fillna(0).astype(int)
-    inv["reorder_qty"] = pd.to_numeric(inv["reorder_qty"], errors="coerce").fillna(0).astype(int)
-
-    alertas = []
-
-    for _, it in oitems.iterrows():
-        pid = int(it["product_id"])
-        qty = int(it["quantity"])
-
-        mask = (inv["branch_id"] == branch_id) & (inv["product_id"] == pid)
-        if not mask.any():
-            continue
-
-        inv.loc[mask, "stock_on_hand"] -= qty
-
-        stock = int(inv.loc[mask, "stock_on_hand"].iloc[0])
-        smin  = int(inv.loc[mask, "stock_min"].iloc[0])
-        rq    = int(inv.loc[mask, "reorder_qty"].iloc[0])
-
-        if stock < smin:
-            alertas.append({
-                "branch_id": branch_id,
-                "product_id": pid,
-                "stock_on_hand": stock,
-                "stock_min": smin,
-                "reorder_qty": rq
-            })
-
-    write_table("inventory", inv)
-    return alertas
+def alertas_pedido(order):
+    # líneas del pedido que quedaron bajo mínimo en su sucursal
+    bajo = rows_below_min()
+    prods = get_rows("order_items", order_id=int(order["order_id"]))["product_id"]
+    bajo = bajo[(bajo["branch_id"] == int(order["branch_id"])) & bajo["product_id"].isin(prods)]
+    return bajo[["branch_id", "product_id", "stock_on_hand", "stock_min", "reorder_qty"]].astype(int).to_dict("records")
 
 
 
 def scm_receive_po(po_id: int):
-    po  = read_table("purchase_orders")
-    poi = read_table("purchase_order_items")
-    inv = read_table("inventory")
-
-    # normalizar ids
-    po["po_id"] = pd.to_numeric(po["po_id"], errors="coerce").fillna(0).astype(int)
-    poi["po_id"] = pd.to_numeric(poi["po_id"], errors="coerce").fillna(0).astype(int)
-    poi["product_id"] = pd.to_numeric(poi["product_id"], errors="coerce").fillna(0).astype(int)
-    poi["qty_ordered"] = pd.to_numeric(poi["qty_ordered"], errors="coerce").fillna(0).astype(int)
+    return scm_receive_pos([po_id])
 
-    inv["branch_id"] = pd.to_numeric(inv["branch_id"], errors="coerce").fillna(0).astype(int)
-    inv["product_id"] = pd.to_numeric(inv["product_id"], errors="coerce").fillna(0).astype(int)
-    inv["stock_on_hand"] = pd.to_numeric(inv["stock_on_hand"], errors="coerce").fillna(0).astype(int)
-
-    row_po = po[po["po_id"] == int(po_id)]
-    if row_po.empty:
+def scm_receive_pos(po_ids):
+    po_ids = [int(p) for p in po_ids]
+    if not po_ids:
+        return False, "No hay OCs seleccionadas."
+    po = read_table("purchase_orders")
+    sel = po[po["po_id"].isin(po_ids)]
+    if len(sel) < len(set(po_ids)):
         return False, "PO no existe."
+    if (sel["status"] == "RECEIVED").all():
+        return False, "PO ya fue recibida." if len(po_ids) == 1 else "Las OCs ya fueron recibidas."
 
-    status = str(row_po["status"].iloc[0])
-    if status == "RECEIVED":
-        return False, "PO ya fue recibida."
-
-    branch_id = int(row_po["branch_id"].iloc[0])
-
-    items = poi[poi["po_id"] == int(po_id)]
-    if items.empty:
-        return False, "PO no tiene items."
-
-    # aplicar recepción: sumar stock
-    for _, it in items.iterrows():
-        pid = int(it["product_id"])
-        qty = int(it["qty_ordered"])
-
-        mask = (inv["branch_id"] == branch_id) & (inv["product_id"] == pid)
-        if mask.any():
-            inv.loc[mask, "stock_on_hand"] = inv.loc[mask, "stock_on_hand"] + qty
-        else:
-            # si no existe la fila, la creamos con mínimos por defecto
-            inv = pd.concat([inv, pd.DataFrame([{
-                "branch_id": branch_id,
-                "product_id": pid,
-                "stock_on_hand": qty,
-                "stock_min": 10,
-                "reorder_qty": 20,
-            }])], ignore_index=True)
-
-    # marcar PO como recibida
-    po.loc[po["po_id"] == int(po_id), "status"] = "RECEIVED"
-    po.loc[po["po_id"] == int(po_id), "received_ts"] = datetime.utcnow().isoformat()
-
-    write_table("inventory", inv)
-    write_table("purchase_orders", po)
-
-    return True, "OK"
+    loaded = receive_pos(po_ids)
+    if loaded.empty:
+        return False, "PO no tiene items." if len(po_ids) == 1 else "Las OCs no tienen items."
+    return True, f"{int(loaded['received'].sum())} unidades en {len(loaded)} producto(s)."
 
 def scm_create_po_manual(branch_id: int, product_id: int, qty: int, expected_date: str):
     prod = read_table("products")
-
-    prod["product_id"] = pd.to_numeric(prod["product_id"], errors="coerce").fillna(0).astype(int)
     prow = prod[prod["product_id"] == int(product_id)]
     if prow.empty:
         return False, "Producto no existe en products."
@@ -226,57 +100,51 @@ def tps_create_order(customer_id, branch_id, payment_method):
 
 
 def tps_checkout(order_id):
-    orders = read_table("orders")
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    orders.loc[orders["order_id"] == int(order_id), "status"] = "PAID"
-    write_table("orders", orders)
+    # pedido + ERP + SCM en una sola sesión (tps.checkout); lanza ValueError si el pedido no existe
+    order = tps.checkout(int(order_id), async_post=ASYNC_POSTING)
+    if ASYNC_POSTING:
+        # modo asíncrono: ERP/SCM los postea el worker; no hay alertas inmediatas
+        posting_worker().notify()
+        return None
+    return alertas_pedido(order)
 
-    erp_record_sale(order_id)
 
-    # 👇 ahora SCM devuelve alertas (no crea compras)
-    alertas = scm_apply_sale(order_id)
-    return alertas
+@st.cache_resource
+def posting_worker():
+    # el worker postea con posting.post_sales (las mismas reglas que la API)
+    return posting.start_worker()
 
 
 
 def tps_add_item(order_id, product_id, qty):
-    # 1) saber sucursal del pedido
-    orders = read_table("orders")
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    orow = orders[orders["order_id"] == int(order_id)]
-    branch_id = int(orow["branch_id"].iloc[0])
-
-    # 2) validar stock
-    inv = read_table("inventory")
-    inv["branch_id"] = pd.to_numeric(inv["branch_id"], errors="coerce").fillna(0).astype(int)
-    inv["product_id"] = pd.to_numeric(inv["product_id"], errors="coerce").fillna(0).astype(int)
-    inv["stock_on_hand"] = pd.to_numeric(inv["stock_on_hand"], errors="coerce").fillna(0).astype(int)
-
-    mask = (inv["branch_id"] == branch_id) & (inv["product_id"] == int(product_id))
-    if not mask.any():
-        raise ValueError("No existe inventario para ese producto en esa sucursal.")
-
-    stock = int(inv.loc[mask, "stock_on_hand"].iloc[0])
-    if stock < int(qty):
-        raise ValueError(f"No se pudo realizar la venta: stock insuficiente (quedan {stock}).")
-
-    # 3) agregar item (si hay stock)
-    prod = read_table("products")
-    p = prod[prod["product_id"] == int(product_id)].iloc[0]
-    price = float(p["sale_price"])
-    lt = price * int(qty)
-
-    item_id = next_id("order_items", "order_item_id", 1)
-    append_table("order_items", pd.DataFrame([{
-        "order_item_id": item_id, "order_id": int(order_id), "product_id": int(product_id),
-        "quantity": int(qty), "unit_price": price, "line_total": lt
-    }]))
-
-    # 4) actualizar total del pedido
-    items = read_table("order_items")
-    total = items[items["order_id"] == int(order_id)]["line_total"].sum()
-    orders.loc[orders["order_id"] == int(order_id), "total_amount"] = total
-    write_table("orders", orders)
+    tps_add_items(order_id, [(product_id, qty)])
+
+def tps_add_items(order_id, lines):
+    # misma validación que la API (src/tps.py): stock de la sucursal menos lo que
+    # ya tiene el pedido, un append y el total actualizado en una sesión
+    try:
+        tps.add_items(int(order_id), [(int(p), int(q)) for p, q in lines])
+    except ValueError as e:
+        raise ValueError(f"No se pudo realizar la venta: {e}") from e
+
+
+# ====== FILTROS (KPIs / RFM) ======
+def filtros_ventana(key):
+    # (since, until, branch_ids); None = sin filtro. Las fechas se resuelven con
+    # el índice ordenado de order_ts (src/order_index.py), no recorriendo orders
+    lo, hi = order_index.bounds()
+    c1, c2, c3 = st.columns([1, 2, 2])
+    periodo = c1.selectbox("Periodo", ["Todo", "Últimos 7 días", "Últimos 30 días", "Rango"], key=f"{key}_periodo")
+    since = until = None
+    if periodo.startswith("Últimos"):
+        since = pd.Timestamp.now().normalize() - pd.Timedelta(days=int(periodo.split()[1]) - 1)
+    elif periodo == "Rango" and lo is not None:
+        rango = c2.date_input("Desde / hasta", value=(lo.date(), hi.date()), key=f"{key}_rango")
+        if len(rango) == 2:
+            since, until = pd.Timestamp(rango[0]), pd.Timestamp(rango[1])
+    opts = {f"{r.branch_id} - {r.branch_name}": int(r.branch_id) for r in branches.itertuples()}
+    sel = c3.multiselect("Sucursales (vacío = todas)", list(opts), key=f"{key}_sucursales")
+    return since, until, ([opts[k] for k in sel] or None)
 
 
 # ====== UI (AQUÍ VA PRIMERO EL TITLE + TABS) ======
@@ -286,8 +154,7 @@ tab_kpis, tab_rfm, tab_ops,tab_tps = st.tabs([" KPIs", " RFM", "ERP / SCM","TPS"
 
 customers = read_table("customers")
 products  = read_table("products")
-if "is_active" in products.columns:
-    products["is_active"] = pd.to_numeric(products["is_active"], errors="coerce").fillna(1).astype(int)
+if not products.empty:
     products = products[products["is_active"] == 1]
 
 
@@ -304,122 +171,57 @@ if customers.empty:
 with tab_kpis:
     st.subheader("📊 KPIs de Demanda, Menú y Pagos")
 
-    orders = read_table("orders")
-    items  = read_table("order_items")
-    prod   = read_table("products")
-
-    if orders.empty:
-        st.warning("No hay órdenes. Crea una venta en TPS primero.")
-        st.stop()
-
-    # --- preparar datos ---
-    orders["order_ts"] = pd.to_datetime(orders["order_ts"], errors="coerce")
-    orders["total_amount"] = pd.to_numeric(orders["total_amount"], errors="coerce").fillna(0)
-    orders["status"] = orders["status"].astype(str)
+    # los gráficos leen solo el cubo (fecha × hora × sucursal × producto × pago)
+    cube = kpi_cube.read_cube()
+    prod = read_table("products")
 
-    paid = orders[orders["status"] == "PAID"].copy()
-    if paid.empty:
+    if cube.empty:
         st.warning("No hay órdenes pagadas todavía. Haz Checkout en TPS.")
         st.stop()
 
-    paid["order_hour"] = paid["order_ts"].dt.hour
-    paid["order_date"] = paid["order_ts"].dt.date.astype(str)
+    since, until, branch_ids = filtros_ventana("kpi")
+    cube = kpi_cube.filter_cube(cube, since, until, branch_ids)
+    filtros = {"since": since, "until": until, "branches": branch_ids}
+    if cube.empty:
+        st.info("No hay órdenes pagadas en el periodo/sucursales elegidos.")
+
+    resumen = kpi_cube.summary(cube)
 
     # --- tarjetas (indicadores rápidos) ---
     col1, col2, col3, col4, col5 = st.columns(5)
-    col1.metric("Órdenes pagadas", int(paid["order_id"].nunique()))
-    col2.metric("Ventas totales", f"${paid['total_amount'].sum():,.2f}")
-    col3.metric("Ticket promedio", f"${paid['total_amount'].mean():,.2f}")
-    col4.metric("Clientes únicos", int(paid["customer_id"].nunique()))
-    col5.metric("Sucursales activas", int(paid["branch_id"].nunique()))
+    col1.metric("Órdenes pagadas", resumen["orders"])
+    col2.metric("Ventas totales", f"${resumen['revenue']:,.2f}")
+    col3.metric("Ticket promedio", f"${resumen['avg_ticket']:,.2f}")
+    # clientes únicos no es aditivo: sale de orders (una columna)
+    orders = order_index.orders_in_window(read_table("orders"), since, until, branch_ids)
+    col4.metric("Clientes únicos", int(orders.loc[orders["status"] == "PAID", "customer_id"].nunique()))
+    col5.metric("Sucursales activas", resumen["branches"])
 
     st.divider()
-    # ================== KPIs (CREAR FIGURAS, NO MOSTRAR AÚN) ==================
-
-    # --- KPI 1: pedidos por hora ---
-    h = paid.groupby("order_hour")["order_id"].nunique().reindex(range(24), fill_value=0)
-    fig1, ax1 = plt.subplots(figsize=(4.5, 3.2))
-    ax1.bar(h.index, h.values)
-    ax1.set_xticks(range(0, 24, 2))
-    ax1.set_xlabel("Hora")
-    ax1.set_ylabel("# Pedidos")
-    ax1.set_title("Pedidos por hora")
-
-    # --- KPI 2: ingresos por hora ---
-    hr = paid.groupby("order_hour")["total_amount"].sum().reindex(range(24), fill_value=0)
-    fig2, ax2 = plt.subplots(figsize=(4.5, 3.2))
-    ax2.plot(hr.index, hr.values, marker="o")
-    ax2.set_xticks(range(0, 24, 2))
-    ax2.set_xlabel("Hora")
-    ax2.set_ylabel("$ Ingresos")
-    ax2.set_title("Ingresos por hora")
-
-    # --- KPI 3 y 4: top productos ---
-    items["line_total"] = pd.to_numeric(items["line_total"], errors="coerce").fillna(0)
-    items["quantity"]   = pd.to_numeric(items["quantity"], errors="coerce").fillna(0)
-
-    mix = items.merge(prod[["product_id","food_item","category"]], on="product_id", how="left")
-
-    top_qty = mix.groupby("food_item")["quantity"].sum().sort_values(ascending=False).head(10)
-    fig3, ax3 = plt.subplots(figsize=(4.5, 3.2))
-    ax3.barh(top_qty.index[::-1], top_qty.values[::-1])
-    ax3.set_xlabel("Cantidad")
-    ax3.set_title("Top 10 por cantidad")
-
-    top_rev = mix.groupby("food_item")["line_total"].sum().sort_values(ascending=False).head(10)
-    fig4, ax4 = plt.subplots(figsize=(4.5, 3.2))
-    ax4.barh(top_rev.index[::-1], top_rev.values[::-1])
-    ax4.set_xlabel("Ingresos ($)")
-    ax4.set_title("Top 10 por ingresos")
-
-    # --- KPI 5: por categoría ---
-    cat_rev = mix.groupby("category")["line_total"].sum().sort_values(ascending=False)
-    fig5, ax5 = plt.subplots(figsize=(4.5, 3.2))
-    ax5.bar(cat_rev.index, cat_rev.values)
-    ax5.tick_params(axis="x", rotation=30)
-    ax5.set_ylabel("Ingresos ($)")
-    ax5.set_title("Ingresos por categoría")
-
-    # --- KPI 6: método de pago ---
-    if "payment_method" not in paid.columns:
-        paid["payment_method"] = "Desconocido"
-    paid["payment_method"] = paid["payment_method"].fillna("Desconocido").astype(str)
-
-    pm = paid["payment_method"].value_counts()
-    fig6, ax6 = plt.subplots(figsize=(4.5, 3.2))
-    ax6.bar(pm.index, pm.values)
-    ax6.tick_params(axis="x", rotation=20)
-    ax6.set_ylabel("# Órdenes")
-    ax6.set_title("Órdenes por método de pago")
-
-    # ================== DASHBOARD 3x2 (MOSTRAR AQUÍ) ==================
+    # ================== DASHBOARD 3x2 ==================
+    # PNG cacheados por (gráfico, filtros, versión de kpi_cube/products): si no
+    # hubo checkout ni cambio de filtros desde el último rerun no se dibuja nada
     st.subheader(" Dashboard de KPIs")
 
-    r1c1, r1c2, r1c3 = st.columns(3)
-    with r1c1:
-        st.caption("Pedidos por hora")
-        st.pyplot(fig1, use_container_width=True)
-    with r1c2:
-        st.caption("Ingresos por hora")
-        st.pyplot(fig2, use_container_width=True)
-    with r1c3:
-        st.caption("Método de pago")
-        st.pyplot(fig6, use_container_width=True)
-
-    r2c1, r2c2, r2c3 = st.columns(3)
-    with r2c1:
-        st.caption("Top productos (cantidad)")
-        st.pyplot(fig3, use_container_width=True)
-    with r2c2:
-        st.caption("Top productos (ingresos)")
-        st.pyplot(fig4, use_container_width=True)
-    with r2c3:
-        st.caption("Ingresos por categoría")
-        st.pyplot(fig5, use_container_width=True)
-
-    # (opcional) liberar memoria matplotlib
-    plt.close(fig1); plt.close(fig2); plt.close(fig3)
-    plt.close(fig4); plt.close(fig5); plt.close(fig6)
+    series = {}  # agregaciones del cubo, solo si algún gráfico falta en la caché
+
+    def kpi_data(chart_id):
+        if not series:
+            series.update(kpi_series(cube, prod))
+        return series[chart_id]
+
+    kpi_ids = list(KPI_CHARTS)
+    for row in (kpi_ids[:3], kpi_ids[3:]):
+        for col, chart_id in zip(st.columns(3), row):
+            title, build = KPI_CHARTS[chart_id]
+            with col:
+                st.caption(title)
+                png = cached_png(chart_id, lambda build=build, chart_id=chart_id: build(kpi_data(chart_id)),
+                                 tables=("kpi_cube", "products"), filters=filtros)
+                st.image(png, use_container_width=True)
+
+    info = chart_cache_info()
+    st.caption(f"Caché de gráficos: {info['hits']} hits · {info['misses']} misses · {info['charts']} en memoria ({info['bytes'] / 1024:,.0f} KB)")
 
 
 
@@ -467,97 +269,17 @@ with tab_rfm:
     
     
     
-    # Solo ventas pagadas
-    orders["order_ts"] = pd.to_datetime(orders.get("order_ts"), errors="coerce")
-    orders["total_amount"] = pd.to_numeric(orders.get("total_amount"), errors="coerce").fillna(0)
-    orders["customer_id"] = pd.to_numeric(orders.get("customer_id"), errors="coerce").fillna(0).astype(int)
-    orders["order_id"] = pd.to_numeric(orders.get("order_id"), errors="coerce").fillna(0).astype(int)
-    orders["status"] = orders.get("status").astype(str)
-
-    paid = orders[(orders["status"] == "PAID") & orders["order_ts"].notna()].copy()
+    # Solo ventas pagadas, dentro del periodo/sucursales elegidos
+    since, until, branch_ids = filtros_ventana("rfm")
+    paid = rfm_mod.paid_orders(order_index.orders_in_window(orders, since, until, branch_ids))
     if paid.empty:
-        st.warning("Aún no hay órdenes pagadas. Haz Checkout en TPS.")
+        st.warning("No hay órdenes pagadas en el periodo/sucursales elegidos. Haz Checkout en TPS o amplía el filtro.")
         st.stop()
 
-    # Fecha de referencia (snapshot) -> para recency
-    snapshot = paid["order_ts"].max() + pd.Timedelta(days=1)
-
-    rfm = (
-        paid.groupby("customer_id")
-        .agg(
-            recency_days=("order_ts", lambda x: int((snapshot - x.max()).days)),
-            frequency=("order_id", "nunique"),
-            monetary=("total_amount", "sum"),
-        )
-        .reset_index()
-    )
-
-    # Join con nombres de clientes (si existe)
-    if not customers.empty and "customer_id" in customers.columns:
-        customers["customer_id"] = pd.to_numeric(customers["customer_id"], errors="coerce").fillna(0).astype(int)
-        if "customer_name" in customers.columns:
-            rfm = rfm.merge(customers[["customer_id", "customer_name"]], on="customer_id", how="left")
-        else:
-            rfm["customer_name"] = None
-    else:
-        rfm["customer_name"] = None
-
-    # --- Scoring robusto (qcut a veces falla con pocos datos) ---
-    def qscore(series: pd.Series, bins: int = 5, reverse: bool = False) -> pd.Series:
-        s = pd.to_numeric(series, errors="coerce").fillna(0)
-        # rank para evitar empates exactos en qcut
-        r = s.rank(method="first")
+    # scores R/F/M de 1 a 5 y segmentos (src/rfm.py)
+    rfm = rfm_mod.compute_rfm(paid, customers)
 
-        b = min(bins, int(r.nunique())) if int(r.nunique()) > 0 else 1
-        if b == 1:
-            score = pd.Series([1] * len(r), index=r.index)
-        else:
-            try:
-                score = pd.qcut(r, q=b, labels=list(range(1, b + 1)))
-                score = score.astype(int)
-            except Exception:
-                # fallback simple si qcut se pone pesado
-                score = pd.Series(pd.cut(r, bins=b, labels=list(range(1, b + 1)), include_lowest=True)).astype(int)
-
-        if reverse:
-            score = (b + 1) - score  # recency: menor recency => mejor score
-        return score
-
-    r_bins = 5
-    f_bins = 5
-    m_bins = 5
-
-    rfm["R"] = qscore(rfm["recency_days"], bins=r_bins, reverse=True)
-    rfm["F"] = qscore(rfm["frequency"], bins=f_bins, reverse=False)
-    rfm["M"] = qscore(rfm["monetary"], bins=m_bins, reverse=False)
-
-    rfm["RFM"] = rfm["R"].astype(str) + rfm["F"].astype(str) + rfm["M"].astype(str)
-    rfm["rfm_score_total"] = rfm["R"] + rfm["F"] + rfm["M"]
-
-    # Segmentos simples (claros para el profe)
-    def segment(row):
-        R, F, M = int(row["R"]), int(row["F"]), int(row["M"])
-        if R >= 4 and F >= 4 and M >= 4:
-            return "Campeones"
-        if R >= 4 and F >= 3:
-            return "Leales"
-        if R >= 4 and F <= 2:
-            return "Nuevos"
-        if R <= 2 and F >= 3:
-            return "En riesgo"
-        if R <= 2 and F <= 2:
-            return "Dormidos"
-        if M >= 4 and R >= 3:
-            return "Alto gasto"
-        return "Otros"
-
-    rfm["segmento"] = rfm.apply(segment, axis=1)
-
-    # Orden bonito
-    cols = ["customer_id", "customer_name", "recency_days", "frequency", "monetary", "segmento", "R", "F", "M", "RFM", "rfm_score_total"]
-    rfm = rfm[cols].sort_values(["segmento", "rfm_score_total"], ascending=[True, False]).reset_index(drop=True)
-
-    # Guardar CSV en tables_csv
+    # Guardar en la tabla rfm_customers (backend configurado)
     write_table("rfm_customers", rfm)
 
     # ====== UI ======
@@ -567,7 +289,7 @@ with tab_rfm:
     c3.metric("Ingreso total", f"${paid['total_amount'].sum():,.2f}")
     c4.metric("Ticket promedio", f"${paid['total_amount'].mean():,.2f}")
 
-    st.write("### 📋 Tabla RFM (se guarda en tables_csv/rfm_customers.csv)")
+    st.write("### 📋 Tabla RFM (se guarda en la tabla rfm_customers)")
     st.dataframe(rfm, use_container_width=True)
 
     st.download_button(
@@ -582,45 +304,13 @@ with tab_rfm:
     # ====== Gráficas (DASHBOARD en 3 columnas) ======
     st.write("###  Dashboard RFM")
 
-    colA, colB, colC = st.columns(3)
-
-    # 1) Clientes por segmento
-    with colA:
-        st.caption("Clientes por segmento")
-        seg_counts = rfm["segmento"].value_counts()
-        fig1, ax1 = plt.subplots()
-        ax1.bar(seg_counts.index, seg_counts.values)
-        ax1.set_ylabel("# Clientes")
-        ax1.tick_params(axis="x", rotation=30)
-        ax1.set_title("Segmentos")
-        st.pyplot(fig1, use_container_width=True)
-        plt.close(fig1)
-
-    # 2) Histograma de Recency
-    with colB:
-        st.caption("Recency (días desde última compra)")
-        fig2, ax2 = plt.subplots()
-        ax2.hist(rfm["recency_days"], bins=10)
-        ax2.set_xlabel("Días")
-        ax2.set_ylabel("# Clientes")
-        ax2.set_title("Recency")
-        st.pyplot(fig2, use_container_width=True)
-        plt.close(fig2)
-
-    # 3) Scatter Frequency vs Monetary
-    with colC:
-        st.caption("Frequency vs Monetary")
-        fig3, ax3 = plt.subplots()
-        ax3.scatter(rfm["frequency"], rfm["monetary"])
-        ax3.set_xlabel("Frequency (# órdenes)")
-        ax3.set_ylabel("Monetary ($)")
-        ax3.set_title("F vs M")
-        st.pyplot(fig3, use_container_width=True)
-        plt.close(fig3)
-
-
-
-
+    # PNG cacheados por la huella de los datos RFM (cambian solo con ventas pagadas)
+    rfm_data = rfm[["segmento", "recency_days", "frequency", "monetary"]]
+    for col, (chart_id, (title, build)) in zip(st.columns(3), RFM_CHARTS.items()):
+        with col:
+            st.caption(title)
+            png = cached_png(chart_id, lambda build=build: build(rfm_data), data=rfm_data)
+            st.image(png, use_container_width=True)
 
     st.divider()
     st.write("###  Top 10 clientes por Monetary")
@@ -642,23 +332,57 @@ with tab_rfm:
 with tab_ops:
     st.subheader("⚙️ Evidencia (ERP / SCM)")
 
-    ledger = read_table("ledger_entries")
+    tb     = rollups.trial_balance()  # conteo y saldos desde ledger_daily, no el libro
     po     = read_table("purchase_orders")
     inv    = read_table("inventory")
     prod   = read_table("products")
     br     = read_table("branches")
 
     c1, c2, c3 = st.columns(3)
-    c1.metric("Asientos ERP", 0 if ledger.empty else len(ledger))
+    c1.metric("Asientos ERP", int(tb["entries"].sum()))
     c2.metric("Órdenes de compra", 0 if po.empty else po["po_id"].nunique())
-    if not inv.empty:
-        inv["stock_on_hand"] = pd.to_numeric(inv["stock_on_hand"], errors="coerce").fillna(0)
-        c3.metric("Items con stock < mínimo", int((inv["stock_on_hand"] < inv["stock_min"]).sum()))
-    else:
-        c3.metric("Items con stock < mínimo", 0)
+    c3.metric("Items con stock < mínimo", len(rows_below_min()))
+
+    if ASYNC_POSTING:
+        posting_worker()
+        lag = posting.queue_lag()
+        q1, q2 = st.columns(2)
+        q1.metric("Pedidos en cola ERP/SCM", lag["pending"])
+        q2.metric("Retraso de la cola (s)", f'{lag["lag_seconds"]:.0f}')
 
     st.write("### ERP: últimos asientos")
-    st.dataframe(ledger.tail(10))
+    st.dataframe(rollups.last_entries(10))
+
+    # --- resumen P&L: lee el rollup día × sucursal × tipo (no el libro completo) ---
+    st.write("### 📈 ERP: resumen P&L")
+    g1, g2 = st.columns(2)
+    with g1:
+        gran = st.radio("Periodo", ["Día", "Semana", "Mes"], index=2, horizontal=True)
+    with g2:
+        br_pnl = st.selectbox("Sucursal (P&L)", ["Todas"] + br["branch_name"].tolist())
+
+    freq = {"Día": "D", "Semana": "W", "Mes": "M"}[gran]
+    if br_pnl == "Todas":
+        pnl = rollups.pnl(freq)
+    else:
+        bid = int(br.loc[br["branch_name"] == br_pnl, "branch_id"].iloc[0])
+        pnl = rollups.pnl(freq, by_branch=True)
+        pnl = pnl[pnl["branch_id"] == bid].drop(columns="branch_id")
+
+    if pnl.empty:
+        st.info("No hay asientos contables todavía.")
+    else:
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Ingresos", f"${pnl['revenue'].sum():,.2f}")
+        m2.metric("Costo de ventas", f"${pnl['cogs'].sum():,.2f}")
+        m3.metric("Margen bruto", f"${pnl['gross_margin'].sum():,.2f}")
+
+        png = cached_png("erp_pnl", lambda: fig_pnl(pnl, f"P&L por {gran.lower()}"),
+                         tables=("ledger_daily",), filters={"freq": freq, "branch": br_pnl})
+        st.image(png, use_container_width=True)
+
+        st.write("Balance de comprobación (por tipo de asiento)")
+        st.dataframe(tb, use_container_width=True)
 
     st.write("### SCM: últimas órdenes de compra")
     st.dataframe(po.tail(10))
@@ -671,9 +395,6 @@ with tab_ops:
     if po.empty:
         st.info("No hay órdenes de compra todavía.")
     else:
-        po["po_id"] = pd.to_numeric(po["po_id"], errors="coerce").fillna(0).astype(int)
-        po["status"] = po["status"].astype(str)
-
         pendientes = po[po["status"] != "RECEIVED"].copy()
 
         if pendientes.empty:
@@ -689,14 +410,10 @@ with tab_ops:
             po_id = int(pendientes[pendientes["label"] == sel]["po_id"].iloc[0])
 
             # preview items de la OC
-            poi["po_id"] = pd.to_numeric(poi["po_id"], errors="coerce").fillna(0).astype(int)
             items_po = poi[poi["po_id"] == po_id].copy()
 
             if not items_po.empty:
                 prod = read_table("products")
-                prod["product_id"] = pd.to_numeric(prod["product_id"], errors="coerce").fillna(0).astype(int)
-                items_po["product_id"] = pd.to_numeric(items_po["product_id"], errors="coerce").fillna(0).astype(int)
-
                 items_po = items_po.merge(prod[["product_id","food_item","category"]], on="product_id", how="left")
                 st.dataframe(items_po[["product_id","food_item","category","qty_ordered","unit_cost_est"]])
 
@@ -708,6 +425,17 @@ with tab_ops:
                 else:
                     st.warning(msg)
 
+            st.write("#### 🚚 Recibir varias OCs (entrega de camión)")
+            multi = st.multiselect("OCs a recibir", pendientes["label"].tolist())
+            if st.button("✅ Recibir todas las seleccionadas"):
+                ids = pendientes[pendientes["label"].isin(multi)]["po_id"].astype(int).tolist()
+                ok, msg = scm_receive_pos(ids)
+                if ok:
+                    st.success("📦 Mercancía recibida: " + msg)
+                    st.rerun()
+                else:
+                    st.warning(msg)
+
     
     
 
@@ -760,22 +488,33 @@ with tab_ops:
         new_rq    = st.number_input("Reorder qty", min_value=0, max_value=100000, value=cur_rq)
 
         if st.button("💾 Guardar ajuste de inventario"):
-            if mask.any():
-                inv.loc[mask, "stock_on_hand"] = int(new_stock)
-                inv.loc[mask, "stock_min"] = int(new_min)
-                inv.loc[mask, "reorder_qty"] = int(new_rq)
-            else:
-                inv = pd.concat([inv, pd.DataFrame([{
-                    "branch_id": int(branch_id),
-                    "product_id": int(product_id),
-                    "stock_on_hand": int(new_stock),
-                    "stock_min": int(new_min),
-                    "reorder_qty": int(new_rq),
-                }])], ignore_index=True)
-
-            write_table("inventory", inv)
+            # la diferencia queda registrada como movimiento ADJUST
+            set_stock(pd.DataFrame([{
+                "branch_id": int(branch_id),
+                "product_id": int(product_id),
+                "stock_on_hand": int(new_stock),
+                "stock_min": int(new_min),
+                "reorder_qty": int(new_rq),
+            }]))
             st.success("✅ Inventario actualizado.")
             st.rerun()
+
+    with st.expander("🕰️ Stock a una fecha (auditoría)"):
+        # checkpoint más cercano + movimientos de stock_movements hasta esa fecha
+        hb = st.selectbox("Sucursal (histórico)", ["Todas"] + list(branch_opt.keys()))
+        hp = st.selectbox("Producto (histórico)", ["Todos"] + list(prod_opt2.keys()))
+        hd = st.date_input("Fecha (histórico)")
+        hh = st.time_input("Hora (histórico)", value=datetime.strptime("23:59", "%H:%M").time())
+        # se reconstruye solo al pedirlo (lee stock_movements); el resultado queda en la sesión
+        if st.button("🔎 Consultar stock"):
+            hist = inventory_history.stock_at(
+                datetime.combine(hd, hh),
+                branch_id=None if hb == "Todas" else branch_opt[hb],
+                product_id=None if hp == "Todos" else prod_opt2[hp],
+            )
+            st.session_state["stock_historico"] = hist.merge(prod[["product_id", "food_item"]], on="product_id", how="left")
+        if "stock_historico" in st.session_state:
+            st.dataframe(st.session_state["stock_historico"])
             
     st.subheader("🧾 Reabastecimiento manual (SCM)")
 
@@ -784,10 +523,7 @@ with tab_ops:
     br   = read_table("branches")
 
     if not inv.empty:
-        inv["stock_on_hand"] = pd.to_numeric(inv["stock_on_hand"], errors="coerce").fillna(0).astype(int)
-        inv["stock_min"] = pd.to_numeric(inv["stock_min"], errors="coerce").fillna(0).astype(int)
-
-        crit = inv[inv["stock_on_hand"] < inv["stock_min"]].copy()
+        crit = rows_below_min()
 
         if not crit.empty:
             crit_view = crit.merge(prod[["product_id","food_item","category","supplier_id"]], on="product_id", how="left")
@@ -797,6 +533,25 @@ with tab_ops:
         else:
             st.success("✅ No hay items bajo mínimo.")
 
+        with st.expander("📈 Mínimos por pronóstico de demanda"):
+            st.caption("Recalcula stock_min y reorder_qty con la demanda pronosticada por sucursal × producto × hora de la semana.")
+            if st.button("📈 Recalcular mínimos"):
+                params = update_inventory_params()
+                st.success(f"✅ {len(params)} fila(s) de inventario actualizadas.")
+                st.dataframe(params)
+
+        with st.expander("🗓️ Planificador de reabastecimiento (lote)"):
+            plan = plan_replenishment()
+            if plan.empty:
+                st.info("Nada que pedir: el stock y las OCs abiertas cubren los mínimos.")
+            else:
+                st.caption(f"{len(plan)} línea(s) en {plan.groupby(['supplier_id','branch_id']).ngroups} OC(s), descontando OCs CREATED abiertas.")
+                st.dataframe(plan)
+                if st.button("🗓️ Generar OCs consolidadas"):
+                    creadas = run_replenishment()
+                    st.success(f"✅ {creadas['po_id'].nunique() if not creadas.empty else 0} OC(s) creadas.")
+                    st.rerun()
+
         with st.expander("➕ Crear Orden de Compra (manual)"):
             # opciones solo desde críticos (si hay)
             base_df = crit if not crit.empty else inv
@@ -836,17 +591,6 @@ with tab_ops:
     branches = read_table("branches")
     inv = read_table("inventory")
 
-    # Asegurar columna is_active
-    if not products.empty and "is_active" not in products.columns:
-        products["is_active"] = 1
-        write_table("products", products)
-
-    # Normalizar por si acaso
-    if not products.empty:
-        products["product_id"] = pd.to_numeric(products["product_id"], errors="coerce").fillna(0).astype(int)
-        if "is_active" in products.columns:
-            products["is_active"] = pd.to_numeric(products["is_active"], errors="coerce").fillna(1).astype(int)
-
     # ====== ALTA PRODUCTO ======
     with st.expander("➕ Añadir producto"):
         with st.form("form_add_product", clear_on_submit=True):
@@ -868,7 +612,6 @@ with tab_ops:
                 st.info("No hay suppliers.csv (proveedores). Puedes agregarlo luego o dejar supplier_id=1.")
                 supplier_id = st.number_input("supplier_id", min_value=1, value=1, step=1)
             else:
-                suppliers["supplier_id"] = pd.to_numeric(suppliers["supplier_id"], errors="coerce").fillna(0).astype(int)
                 sup_opt = {f'{r.supplier_id} - {r.supplier_name}': int(r.supplier_id) for _, r in suppliers.iterrows()}
                 sup_key = st.selectbox("Proveedor", list(sup_opt.keys()))
                 supplier_id = sup_opt[sup_key]
@@ -892,7 +635,7 @@ with tab_ops:
                     dup = products[
                         (products["food_item"].astype(str).str.lower() == food_item.lower()) &
                         (products["category"].astype(str).str.lower() == category.lower()) &
-                        (products.get("is_active", 1).fillna(1).astype(int) == 1)
+                        (products["is_active"] == 1)
                     ]
                     if not dup.empty:
                         st.error("Ese producto ya existe (mismo nombre y categoría).")
@@ -916,11 +659,7 @@ with tab_ops:
                         if inv.empty:
                             inv = pd.DataFrame(columns=["branch_id","product_id","stock_on_hand","stock_min","reorder_qty"])
 
-                        inv["branch_id"] = pd.to_numeric(inv["branch_id"], errors="coerce").fillna(0).astype(int)
-                        inv["product_id"] = pd.to_numeric(inv["product_id"], errors="coerce").fillna(0).astype(int)
-
                         if not branches.empty:
-                            branches["branch_id"] = pd.to_numeric(branches["branch_id"], errors="coerce").fillna(0).astype(int)
                             new_inv_rows = []
                             for b in branches["branch_id"].tolist():
                                 mask = (inv["branch_id"] == int(b)) & (inv["product_id"] == int(new_id))
@@ -933,8 +672,8 @@ with tab_ops:
                                         "reorder_qty": int(reorder_q),
                                     })
                             if new_inv_rows:
-                                inv = pd.concat([inv, pd.DataFrame(new_inv_rows)], ignore_index=True)
-                                write_table("inventory", inv)
+                                # stock inicial como movimiento ADJUST
+                                set_stock(pd.DataFrame(new_inv_rows))
 
                         st.success(f"✅ Producto creado con ID {new_id}.")
                         st.rerun()
@@ -945,13 +684,6 @@ with tab_ops:
         if products.empty:
             st.info("No hay productos todavía.")
         else:
-            if "is_active" not in products.columns:
-                products["is_active"] = 1
-                write_table("products", products)
-
-            products["product_id"] = pd.to_numeric(products["product_id"], errors="coerce").fillna(0).astype(int)
-            products["is_active"] = pd.to_numeric(products["is_active"], errors="coerce").fillna(1).astype(int)
-
             active = products[products["is_active"] == 1].copy()
             if active.empty:
                 st.info("No hay productos activos para desactivar.")
@@ -971,13 +703,6 @@ with tab_ops:
         if products.empty:
             st.info("No hay productos.")
         else:
-            if "is_active" not in products.columns:
-                products["is_active"] = 1
-                write_table("products", products)
-
-            products["product_id"] = pd.to_numeric(products["product_id"], errors="coerce").fillna(0).astype(int)
-            products["is_active"] = pd.to_numeric(products["is_active"], errors="coerce").fillna(1).astype(int)
-
             inactive = products[products["is_active"] == 0].copy()
             if inactive.empty:
                 st.info("No hay productos desactivados.")
@@ -1006,8 +731,8 @@ with tab_tps:
         if len(new_name) < 3:
             st.warning("Escribe un nombre válido (mínimo 3 caracteres).")
         else:
-            customers2 = read_table("customers")
-            if (customers2["customer_name"].astype(str).str.lower() == new_name.lower()).any():
+            # índice nombre normalizado -> id: "José Pérez" == "jose perez"
+            if lookup_customer(new_name) is not None:
                 st.warning("Ese cliente ya existe.")
             else:
                 new_id = next_id("customers", "customer_id", 1)
@@ -1023,8 +748,7 @@ with tab_tps:
     
     customers = read_table("customers")
     products  = read_table("products")
-    if "is_active" in products.columns:
-        products["is_active"] = pd.to_numeric(products["is_active"], errors="coerce").fillna(1).astype(int)
+    if not products.empty:
         products = products[products["is_active"] == 1]
     branches  = read_table("branches")
 
@@ -1072,8 +796,16 @@ with tab_tps:
         st.dataframe(cart[["food_item","category","quantity","unit_price","line_total"]])
 
         if st.button("💳 Checkout (pagar)"):
-            alertas = tps_checkout(st.session_state.order_id)
-            st.success("✅ Checkout completado. ERP actualizado y stock descontado.")
+            try:
+                alertas = tps_checkout(st.session_state.order_id)
+            except ValueError as e:
+                st.error(str(e))
+                st.stop()
+            if alertas is None:
+                st.success("✅ Checkout completado. ERP/SCM en cola (se registran en segundo plano).")
+                alertas = []
+            else:
+                st.success("✅ Checkout completado. ERP actualizado y stock descontado.")
 
             if alertas:
                 st.session_state["alertas_reabastecer"] = alertas
@@ -0,0 +1,724 @@
+from __future__ import annotations
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from .schema import PRIMARY_KEYS, INDEXES, csv_dtypes, apply_schema
+from .inventory_store import InventoryMatrix, COLUMNS as INVENTORY_COLUMNS, LAYERS as INVENTORY_LAYERS
+
+# Backends de almacenamiento detrás de storage.read_table / write_table / append_table.
+# Todos exponen la misma interfaz: exists, stamp, columns, read, write, append,
+# stage/commit.
+
+# ====== Commit en dos fases ======
+# commit() = stage() + publish(). stage() hace todo lo que puede fallar
+# (serializar, validar, escribir temporales, abrir la transacción SQLite) sin
+# tocar lo que ven los lectores; publish() solo renombra temporales, agrega
+# bytes ya serializados y confirma la transacción. RoutedBackend prepara todos
+# sus backends antes de publicar, así que un error en cualquier tabla no deja
+# la sesión escrita a medias. Lo que no cubre: un corte del proceso durante
+# publish() puede dejar hechos solo parte de los rename (no hay journal entre
+# archivos).
+
+class Staging:
+    def __init__(self):
+        self.tmps: list[Path] = []
+        self.steps: list = []
+        self.undo: list = []
+
+    def tmp(self, p: Path) -> Path:
+        # único por hilo/proceso: dos commits a la vez no comparten temporales
+        t = p.with_name(f"{p.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        self.tmps.append(t)
+        return t
+
+    def replace(self, tmp: Path, p: Path) -> None:
+        self.steps.append(lambda: os.replace(tmp, p))
+
+    def then(self, fn, undo=None, first: bool = False) -> None:
+        # first: va antes que los rename (p.ej. el COMMIT de SQLite, que puede fallar)
+        self.steps.insert(0, fn) if first else self.steps.append(fn)
+        if undo is not None:
+            self.undo.append(undo)
+
+    def discard(self) -> None:
+        for fn in self.undo:
+            try:
+                fn()
+            except Exception:
+                pass
+        for t in self.tmps:
+            t.unlink(missing_ok=True)
+
+    def publish(self) -> None:
+        try:
+            for fn in self.steps:
+                fn()
+        finally:
+            self.discard()
+
+
+def commit_staged(be, frames: dict, appends: dict, updates: dict, keyed: dict | None = None) -> None:
+    # keyed (sumas/asignaciones por clave) solo llega a backends con keyable()
+    plan = Staging()
+    try:
+        if keyed:
+            be.stage(plan, frames, appends, updates, keyed)
+        else:
+            be.stage(plan, frames, appends, updates)
+    except BaseException:
+        plan.discard()
+        raise
+    plan.publish()
+
+
+def _append_bytes(p: Path, data: bytes) -> None:
+    with open(p, "ab") as fh:
+        fh.write(data)
+
+
+class CsvBackend:
+    name = "csv"
+
+    def __init__(self, table_dir: Path):
+        self.table_dir = Path(table_dir)
+
+    def path(self, name: str) -> Path:
+        return self.table_dir / f"{name}.csv"
+
+    def exists(self, name: str) -> bool:
+        return self.path(name).exists()
+
+    def list_tables(self) -> list[str]:
+        return sorted(p.stem for p in self.table_dir.glob("*.csv"))
+
+    def stamp(self, name: str) -> tuple | None:
+        try:
+            st = self.path(name).stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def columns(self, name: str) -> list[str]:
+        p = self.path(name)
+        if not p.exists() or p.stat().st_size == 0:
+            return []
+        return list(pd.read_csv(p, nrows=0).columns)
+
+    def read(self, name: str) -> pd.DataFrame:
+        return pd.read_csv(self.path(name), dtype=csv_dtypes(name))
+
+    def write(self, name: str, df: pd.DataFrame) -> None:
+        p = self.path(name)
+        tmp = p.with_name(p.name + ".tmp")
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, p)
+
+    def append(self, name: str, df_new: pd.DataFrame) -> None:
+        df_new.to_csv(self.path(name), mode="a", header=False, index=False)
+
+    def stage(self, plan: Staging, frames: dict, appends: dict, updates: dict) -> None:
+        # reescrituras a temporales; los appends quedan serializados en memoria
+        for name, df in frames.items():
+            p = self.path(name)
+            tmp = plan.tmp(p)
+            df.to_csv(tmp, index=False)
+            plan.replace(tmp, p)
+        for name, df in appends.items():
+            data = df.to_csv(index=False, header=False).encode("utf-8")
+            plan.then(lambda p=self.path(name), data=data: _append_bytes(p, data))
+
+    def commit(self, frames: dict, appends: dict, updates: dict) -> None:
+        commit_staged(self, frames, appends, updates)
+
+
+class ColumnarBackend(CsvBackend):
+    """Parquet/Feather con tipos preservados.
+
+    Cada tabla es un directorio de partes (`part-000000.<ext>`): write_table deja
+    una sola parte y append_table agrega una parte nueva sin tocar las anteriores.
+    El commit nunca compacta: compact() junta las partes en una sola y se corre
+    aparte (`python -m src.migrate --compact`), fuera de la ruta de los commits.
+    Si una tabla todavía no fue migrada se lee el CSV legado de TABLE_DIR.
+    """
+
+    def __init__(self, table_dir: Path, fmt: str = "parquet"):
+        super().__init__(table_dir)
+        import pyarrow  # noqa: F401  (falla temprano si no está instalado)
+        self.name = fmt
+        self.ext = fmt
+        self.root = self.table_dir / "_columnar"
+
+    def tdir(self, name: str) -> Path:
+        return self.root / name
+
+    def parts(self, name: str) -> list[Path]:
+        d = self.tdir(name)
+        return sorted(d.glob(f"part-*.{self.ext}")) if d.exists() else []
+
+    def exists(self, name: str) -> bool:
+        return bool(self.parts(name)) or super().exists(name)
+
+    def list_tables(self) -> list[str]:
+        own = {p.name for p in self.root.glob("*") if p.is_dir()} if self.root.exists() else set()
+        return sorted(own | set(super().list_tables()))
+
+    def stamp(self, name: str) -> tuple | None:
+        parts = self.parts(name)
+        if not parts:
+            return super().stamp(name)
+        sts = [p.stat() for p in parts]
+        return (len(parts), max(s.st_mtime_ns for s in sts), sum(s.st_size for s in sts))
+
+    def columns(self, name: str) -> list[str]:
+        parts = self.parts(name)
+        if not parts:
+            return super().columns(name)
+        if self.ext == "parquet":
+            import pyarrow.parquet as pq
+            return list(pq.read_schema(parts[0]).names)
+        import pyarrow as pa
+        with pa.memory_map(str(parts[0])) as src:
+            return list(pa.ipc.open_file(src).schema.names)
+
+    def _read_part(self, p: Path) -> pd.DataFrame:
+        return pd.read_parquet(p) if self.ext == "parquet" else pd.read_feather(p)
+
+    def _stage_part(self, plan: Staging, p: Path, df: pd.DataFrame) -> Path:
+        tmp = plan.tmp(p)
+        df = df.reset_index(drop=True)
+        if self.ext == "parquet":
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_feather(tmp)
+        return tmp
+
+    @staticmethod
+    def _link_part(tmp: Path, d: Path, nxt: int, ext: str) -> None:
+        # otro proceso pudo tomar el mismo número: se usa el siguiente libre
+        while True:
+            try:
+                os.link(tmp, d / f"part-{nxt:06d}.{ext}")
+                break
+            except FileExistsError:
+                nxt += 1
+        tmp.unlink()
+
+    def _read_parts(self, parts: list[Path]) -> pd.DataFrame:
+        frames = [self._read_part(p) for p in parts]
+        # partes vacías (ensure_table) no deben decidir los dtypes del concat
+        frames = [f for f in frames if len(f)] or frames[:1]
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def read(self, name: str) -> pd.DataFrame:
+        parts = self.parts(name)
+        if not parts:
+            return super().read(name)
+        return self._read_parts(parts)
+
+    def write(self, name: str, df: pd.DataFrame) -> None:
+        self.commit({name: df}, {}, {})
+
+    def append(self, name: str, df_new: pd.DataFrame) -> None:
+        self.commit({}, {name: df_new}, {})
+
+    def stage(self, plan: Staging, frames: dict, appends: dict, updates: dict) -> None:
+        # updates no llegan aquí: storage.commit_tables los convierte en reescrituras
+        frames = dict(frames)
+        for name, df in appends.items():
+            parts = self.parts(name)
+            if not parts:
+                # tabla legada (CSV): se migra con el primer append
+                if self.exists(name):
+                    df = apply_schema(name, pd.concat([self.read(name), df], ignore_index=True))
+                frames[name] = df
+                continue
+            d, nxt = self.tdir(name), int(parts[-1].stem.split("-")[1]) + 1
+            tmp = self._stage_part(plan, d / f"part-{nxt:06d}.{self.ext}", df)
+            plan.then(lambda tmp=tmp, d=d, nxt=nxt: self._link_part(tmp, d, nxt, self.ext))
+        for name, df in frames.items():
+            d = self.tdir(name)
+            d.mkdir(parents=True, exist_ok=True)
+            base = d / f"part-000000.{self.ext}"
+            plan.replace(self._stage_part(plan, base, df), base)
+            # solo las partes que se leyeron; un append concurrente sobrevive
+            for p in self.parts(name):
+                if p != base:
+                    plan.then(lambda p=p: p.unlink(missing_ok=True))
+
+    def commit(self, frames: dict, appends: dict, updates: dict) -> None:
+        commit_staged(self, frames, appends, updates)
+
+    def compact(self, name: str) -> int:
+        # junta en part-000000 solo las partes leídas: un append concurrente
+        # queda como parte aparte; devuelve cuántas partes se juntaron
+        parts = self.parts(name)
+        if len(parts) < 2:
+            return 0
+        df = apply_schema(name, self._read_parts(parts))
+        base = self.tdir(name) / f"part-000000.{self.ext}"
+        plan = Staging()
+        try:
+            plan.replace(self._stage_part(plan, base, df), base)
+        except BaseException:
+            plan.discard()
+            raise
+        for p in parts:
+            if p != base:
+                plan.then(lambda p=p: p.unlink(missing_ok=True))
+        plan.publish()
+        return len(parts)
+
+    def drop(self, name: str) -> None:
+        shutil.rmtree(self.tdir(name), ignore_errors=True)
+
+
+class _HeldConnection(sqlite3.Connection):
+    # pandas.to_sql() llama commit() al terminar cada tabla; dentro de stage()
+    # eso cortaría la transacción, así que el COMMIT real lo hace finish()
+    def commit(self) -> None:
+        pass
+
+    def finish(self) -> None:
+        try:
+            super().commit()
+        finally:
+            self.close()
+
+    def abort(self) -> None:
+        try:
+            if self.in_transaction:
+                self.rollback()
+        finally:
+            self.close()
+
+
+SQL_CHUNK = 500  # parámetros por sentencia (SQLite admite como mínimo 999)
+
+
+def _py(v):
+    # sqlite3 no acepta escalares de numpy ni Timestamps
+    if isinstance(v, pd.Timestamp):
+        return None if pd.isna(v) else v.isoformat(sep=" ")
+    if v is pd.NaT or v is pd.NA or (isinstance(v, float) and v != v):
+        return None
+    return v.item() if hasattr(v, "item") else v
+
+
+class SqliteBackend(CsvBackend):
+    """Una base SQLite embebida con índices por clave primaria y foránea.
+
+    `_meta` guarda un contador por tabla que se incrementa en cada escritura;
+    es el stamp que usa la caché de storage. Las tablas que aún no existen en
+    la base se leen del CSV legado y se importan en la primera escritura.
+    """
+    name = "sqlite"
+
+    def __init__(self, table_dir: Path):
+        super().__init__(table_dir)
+        self.db_path = self.table_dir / "_verona.sqlite"
+        with self.connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE IF NOT EXISTS _meta (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    @contextmanager
+    def connect(self):
+        con = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _has(self, con, name: str) -> bool:
+        return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+    def _touch(self, con, name: str) -> None:
+        con.execute(
+            "INSERT INTO _meta(name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1", (name,))
+
+    def _index(self, con, name: str) -> None:
+        cols = {r[1] for r in con.execute(f'PRAGMA table_info("{name}")')}
+        keys = [PRIMARY_KEYS[name]] if name in PRIMARY_KEYS else []
+        for key in keys + INDEXES.get(name, []):
+            if set(key) <= cols:
+                idx = f"ix_{name}__{'_'.join(key)}"
+                collist = ", ".join(f'"{c}"' for c in key)
+                con.execute(f'CREATE INDEX IF NOT EXISTS "{idx}" ON "{name}" ({collist})')
+
+    def exists(self, name: str) -> bool:
+        with self.connect() as con:
+            return self._has(con, name) or super().exists(name)
+
+    def list_tables(self) -> list[str]:
+        with self.connect() as con:
+            own = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name <> '_meta'")}
+        return sorted(own | set(super().list_tables()))
+
+    def stamp(self, name: str) -> tuple | None:
+        with self.connect() as con:
+            row = con.execute("SELECT version FROM _meta WHERE name=?", (name,)).fetchone()
+            if row is not None and self._has(con, name):
+                return ("sqlite", row[0])
+        return super().stamp(name)
+
+    def columns(self, name: str) -> list[str]:
+        with self.connect() as con:
+            if self._has(con, name):
+                return [r[1] for r in con.execute(f'PRAGMA table_info("{name}")')]
+        return super().columns(name)
+
+    def read(self, name: str) -> pd.DataFrame:
+        with self.connect() as con:
+            if self._has(con, name):
+                return pd.read_sql_query(f'SELECT * FROM "{name}"', con)
+        return super().read(name)
+
+    def _create(self, con, name: str, df: pd.DataFrame) -> None:
+        if df.empty:
+            # sin tipo declarado: una tabla vacía no debe fijar afinidad TEXT
+            collist = ", ".join(f'"{c}"' for c in df.columns)
+            con.execute(f'CREATE TABLE "{name}" ({collist})')
+        else:
+            df.to_sql(name, con, index=False)
+        self._index(con, name)
+
+    def write(self, name: str, df: pd.DataFrame) -> None:
+        self.commit({name: df}, {}, {})
+
+    def append(self, name: str, df_new: pd.DataFrame) -> None:
+        self.commit({}, {name: df_new}, {})
+
+    # ---- búsquedas por clave (usan los índices) ----
+    def _where(self, where: dict) -> tuple[str, list]:
+        if not where:
+            return "", []
+        return " WHERE " + " AND ".join(f'"{c}" = ?' for c in where), [_py(v) for v in where.values()]
+
+    def select(self, name: str, where: dict) -> pd.DataFrame | None:
+        with self.connect() as con:
+            if not self._has(con, name):
+                return None
+            sql, params = self._where(where)
+            return pd.read_sql_query(f'SELECT * FROM "{name}"{sql}', con, params=params)
+
+    def select_in(self, name: str, col: str, values: list) -> pd.DataFrame | None:
+        # col IN (...) por lotes (límite de parámetros de SQLite)
+        with self.connect() as con:
+            if not self._has(con, name):
+                return None
+            values = [_py(v) for v in values]
+            parts = [pd.read_sql_query(f'SELECT * FROM "{name}" WHERE "{col}" IN ({", ".join("?" * len(chunk))})',
+                                       con, params=chunk)
+                     for chunk in (values[i:i + SQL_CHUNK] for i in range(0, len(values), SQL_CHUNK))]
+            if not parts:
+                return pd.read_sql_query(f'SELECT * FROM "{name}" WHERE 0', con)
+            return pd.concat(parts, ignore_index=True)
+
+    def lookup(self, name: str, keys: list[str], vals: pd.DataFrame) -> pd.DataFrame | None:
+        # (k1, k2) IN (VALUES ...) usa el índice compuesto de la tabla
+        with self.connect() as con:
+            if not self._has(con, name):
+                return None
+            rows = [[_py(v) for v in r] for r in vals[keys].itertuples(index=False)]
+            step = max(1, SQL_CHUNK // len(keys))
+            cols = ", ".join(f'"{k}"' for k in keys)
+            one = "(" + ", ".join("?" * len(keys)) + ")"
+            parts = [pd.read_sql_query(f'SELECT * FROM "{name}" WHERE ({cols}) IN (VALUES {", ".join([one] * len(chunk))})',
+                                       con, params=[v for r in chunk for v in r])
+                     for chunk in (rows[i:i + step] for i in range(0, len(rows), step))]
+            if not parts:
+                return pd.read_sql_query(f'SELECT * FROM "{name}" WHERE 0', con)
+            return pd.concat(parts, ignore_index=True)
+
+    def _update(self, con, name: str, where: dict, values: dict) -> int:
+        cols = {r[1] for r in con.execute(f'PRAGMA table_info("{name}")')}
+        for c in values:
+            if c not in cols:
+                con.execute(f'ALTER TABLE "{name}" ADD COLUMN "{c}"')
+        sets = ", ".join(f'"{c}" = ?' for c in values)
+        sql, params = self._where(where)
+        return con.execute(f'UPDATE "{name}" SET {sets}{sql}', [_py(v) for v in values.values()] + params).rowcount
+
+    def update(self, name: str, where: dict, values: dict) -> int | None:
+        with self.connect() as con:
+            if not self._has(con, name):
+                return None
+            n = self._update(con, name, where, values)
+            self._touch(con, name)
+            return n
+
+    def keyable(self, name: str) -> bool:
+        with self.connect() as con:
+            return self._has(con, name)
+
+    def _keyed(self, con, name: str, op: str, keys: list[str], vals: pd.DataFrame) -> None:
+        # una sentencia por fila con la suma/asignación hecha por SQLite sobre el valor vigente
+        cols = [c for c in vals.columns if c not in keys]
+        have = {r[1] for r in con.execute(f'PRAGMA table_info("{name}")')}
+        for c in cols:
+            if c not in have:
+                con.execute(f'ALTER TABLE "{name}" ADD COLUMN "{c}"')
+        sets = ", ".join(f'"{c}" = "{c}" + ?' if op == "add" else f'"{c}" = ?' for c in cols)
+        cond = " AND ".join(f'"{k}" = ?' for k in keys)
+        rows = [[_py(v) for v in r] for r in vals[cols + keys].itertuples(index=False)]
+        con.executemany(f'UPDATE "{name}" SET {sets} WHERE {cond}', rows)
+
+    def stage(self, plan: Staging, frames: dict, appends: dict, updates: dict, keyed: dict | None = None) -> None:
+        # todo en una transacción que se abre aquí y se confirma en publish()
+        con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, factory=_HeldConnection)
+        plan.then(con.finish, undo=con.abort, first=True)
+        con.execute("BEGIN IMMEDIATE")
+        for name, df in frames.items():
+            con.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self._create(con, name, df)
+            self._touch(con, name)
+        for name, df in appends.items():
+            if not self._has(con, name):
+                legacy = super().read(name) if super().exists(name) else df.iloc[0:0]
+                self._create(con, name, legacy)
+            df.to_sql(name, con, index=False, if_exists="append")
+            self._touch(con, name)
+        for name, ups in updates.items():
+            if not self._has(con, name):
+                if not super().exists(name):
+                    continue
+                self._create(con, name, super().read(name))
+            for where, values in ups:
+                self._update(con, name, where, values)
+            self._touch(con, name)
+        for name, ops in (keyed or {}).items():
+            for op, keys, vals in ops:
+                self._keyed(con, name, op, keys, vals)
+            self._touch(con, name)
+
+    def commit(self, frames: dict, appends: dict, updates: dict, keyed: dict | None = None) -> None:
+        commit_staged(self, frames, appends, updates, keyed)
+
+
+class MatrixInventoryBackend:
+    """`inventory` guardado como matriz densa sucursal × producto.
+
+    Lee/escribe `_inventory.bin` (ver inventory_store). get_row/update_rows por
+    (branch_id, product_id) son accesos O(1) a la celda sobre el archivo mapeado;
+    read() devuelve la forma larga de siempre. Mientras el .bin no exista se lee
+    la tabla del backend normal y la primera escritura crea el archivo.
+
+    Sumas/asignaciones por clave (Session.increment/assign), updates de celdas y
+    appends de claves dentro de los ejes se aplican en sitio sobre el memmap
+    (fancy indexing + flush); solo se reescribe el archivo si crecen los ejes.
+    """
+    name = "matrix"
+    KEYS = ["branch_id", "product_id"]
+
+    def __init__(self, table_dir: Path, legacy):
+        self.bin = Path(table_dir) / "_inventory.bin"
+        self.legacy = legacy
+
+    def exists(self, name: str) -> bool:
+        return self.bin.exists() or self.legacy.exists(name)
+
+    def list_tables(self) -> list[str]:
+        return ["inventory"] if self.exists("inventory") else []
+
+    def stamp(self, name: str) -> tuple | None:
+        try:
+            st = self.bin.stat()
+        except OSError:
+            return self.legacy.stamp(name)
+        return ("matrix", st.st_mtime_ns, st.st_size)
+
+    def columns(self, name: str) -> list[str]:
+        return list(INVENTORY_COLUMNS) if self.bin.exists() else self.legacy.columns(name)
+
+    def read(self, name: str) -> pd.DataFrame:
+        if not self.bin.exists():
+            return self.legacy.read(name)
+        return InventoryMatrix.load(self.bin).to_long()
+
+    def write(self, name: str, df: pd.DataFrame) -> None:
+        InventoryMatrix.from_long(df).save(self.bin)
+
+    def append(self, name: str, df_new: pd.DataFrame) -> None:
+        self.commit({}, {name: df_new}, {})
+
+    def _cell(self, where: dict) -> bool:
+        return self.bin.exists() and set(where) == {"branch_id", "product_id"}
+
+    def select(self, name: str, where: dict) -> pd.DataFrame | None:
+        if not self.bin.exists() or not set(where) <= {"branch_id", "product_id"}:
+            return None
+        return InventoryMatrix.load(self.bin).select(**{k: int(v) for k, v in where.items()})
+
+    def lookup(self, name: str, keys: list[str], vals: pd.DataFrame) -> pd.DataFrame | None:
+        if not self.bin.exists() or sorted(keys) != self.KEYS:
+            return None
+        return InventoryMatrix.load(self.bin).cells(vals["branch_id"].to_numpy(), vals["product_id"].to_numpy())
+
+    def below_min(self, name: str) -> pd.DataFrame | None:
+        return InventoryMatrix.load(self.bin).below_min() if self.bin.exists() else None
+
+    def keyable(self, name: str) -> bool:
+        return self.bin.exists()
+
+    def update(self, name: str, where: dict, values: dict) -> int | None:
+        if not self._cell(where) or not set(values) <= set(INVENTORY_LAYERS):
+            return None
+        m = InventoryMatrix.load(self.bin, mode="r+")
+        ok = m.set(int(where["branch_id"]), int(where["product_id"]), **values)
+        m.flush()
+        del m
+        os.utime(self.bin)
+        return int(ok)
+
+    def _in_place(self, rows: pd.DataFrame | None, ups: list, ops: list) -> None:
+        # mismo orden que commit_tables: appends, updates y luego sumas/asignaciones
+        m = InventoryMatrix.load(self.bin, mode="r+")
+        if rows is not None:
+            m.put_rows(rows)
+        for where, values in ups:
+            m.set(int(where["branch_id"]), int(where["product_id"]), **values)
+        for op, keys, vals in ops:
+            b, p = vals["branch_id"].to_numpy(), vals["product_id"].to_numpy()
+            for col in [c for c in vals.columns if c not in keys]:
+                (m.add if op == "add" else m.assign)(b, p, col, vals[col].to_numpy())
+        m.flush()
+        del m
+        os.utime(self.bin)
+
+    def _fits(self, rows: pd.DataFrame | None, ups: list, ops: list) -> bool:
+        if not self.bin.exists():
+            return False
+        if not all(self._cell(w) and set(v) <= set(INVENTORY_LAYERS) for w, v in ups):
+            return False
+        if not all(sorted(keys) == self.KEYS and set(vals.columns) - set(keys) <= set(INVENTORY_LAYERS)
+                   for _, keys, vals in ops):
+            return False
+        return rows is None or (set(INVENTORY_LAYERS) <= set(rows.columns) and InventoryMatrix.load(self.bin).covers(
+            rows["branch_id"].astype(int).to_numpy(), rows["product_id"].astype(int).to_numpy()))
+
+    def stage(self, plan: Staging, frames: dict, appends: dict, updates: dict, keyed: dict | None = None) -> None:
+        keyed = keyed or {}
+        for name in set(frames) | set(appends) | set(updates) | set(keyed):
+            rows, ups, ops = appends.get(name), updates.get(name, []), keyed.get(name, [])
+            if name not in frames and self._fits(rows, ups, ops):
+                # celdas dentro de los ejes: se escriben en sitio al publicar
+                plan.then(lambda rows=rows, ups=ups, ops=ops: self._in_place(rows, ups, ops))
+                continue
+            if ops:
+                # commit_tables solo manda sumas por clave si keyable(); no debería llegar aquí
+                raise ValueError(f"Keyed operations on {name} need the matrix file")
+            df = frames[name] if name in frames else self.read(name)
+            if rows is not None:
+                df = pd.concat([df, rows], ignore_index=True)
+            for where, values in ups:
+                m = pd.Series(True, index=df.index)
+                for col, val in where.items():
+                    m &= df[col] == val
+                for col, val in values.items():
+                    df.loc[m, col] = val
+            tmp = plan.tmp(self.bin)
+            InventoryMatrix.from_long(df).write_file(tmp)
+            plan.replace(tmp, self.bin)
+
+    def commit(self, frames: dict, appends: dict, updates: dict, keyed: dict | None = None) -> None:
+        commit_staged(self, frames, appends, updates, keyed)
+
+
+class RoutedBackend:
+    """Backend por defecto + backends propios para algunas tablas (p.ej. inventory)."""
+
+    def __init__(self, default, routes: dict):
+        self.default, self.routes = default, routes
+        self.name = default.name
+
+    def _be(self, name: str):
+        return self.routes.get(name, self.default)
+
+    def exists(self, name: str) -> bool:
+        return self._be(name).exists(name)
+
+    def list_tables(self) -> list[str]:
+        names = set(self.default.list_tables()) | {n for n, be in self.routes.items() if be.exists(n)}
+        return sorted(names)
+
+    def stamp(self, name: str) -> tuple | None:
+        return self._be(name).stamp(name)
+
+    def columns(self, name: str) -> list[str]:
+        return self._be(name).columns(name)
+
+    def read(self, name: str) -> pd.DataFrame:
+        return self._be(name).read(name)
+
+    def write(self, name: str, df: pd.DataFrame) -> None:
+        self._be(name).write(name, df)
+
+    def append(self, name: str, df_new: pd.DataFrame) -> None:
+        self._be(name).append(name, df_new)
+
+    def select(self, name: str, where: dict) -> pd.DataFrame | None:
+        select = getattr(self._be(name), "select", None)
+        return select(name, where) if select is not None else None
+
+    def update(self, name: str, where: dict, values: dict) -> int | None:
+        update = getattr(self._be(name), "update", None)
+        return update(name, where, values) if update is not None else None
+
+    def compact(self, name: str) -> int:
+        compact = getattr(self._be(name), "compact", None)
+        return compact(name) if compact is not None else 0
+
+    def select_in(self, name: str, col: str, values: list) -> pd.DataFrame | None:
+        select_in = getattr(self._be(name), "select_in", None)
+        return select_in(name, col, values) if select_in is not None else None
+
+    def lookup(self, name: str, keys: list[str], vals: pd.DataFrame) -> pd.DataFrame | None:
+        lookup = getattr(self._be(name), "lookup", None)
+        return lookup(name, keys, vals) if lookup is not None else None
+
+    def below_min(self, name: str) -> pd.DataFrame | None:
+        below_min = getattr(self._be(name), "below_min", None)
+        return below_min(name) if below_min is not None else None
+
+    def updatable(self, name: str) -> bool:
+        return hasattr(self._be(name), "update")
+
+    def keyable(self, name: str) -> bool:
+        keyable = getattr(self._be(name), "keyable", None)
+        return keyable is not None and keyable(name)
+
+    def stage(self, plan: Staging, frames: dict, appends: dict, updates: dict, keyed: dict | None = None) -> None:
+        groups: dict[int, tuple] = {}
+        for kind, parts in enumerate((frames, appends, updates, keyed or {})):
+            for name, v in parts.items():
+                be = self._be(name)
+                groups.setdefault(id(be), (be, ({}, {}, {}, {})))[1][kind][name] = v
+        for be, (f, a, u, k) in groups.values():
+            if k:
+                be.stage(plan, f, a, u, k)
+            else:
+                be.stage(plan, f, a, u)
+
+    def commit(self, frames: dict, appends: dict, updates: dict, keyed: dict | None = None) -> None:
+        # todos los backends preparan antes de que cualquiera publique
+        commit_staged(self, frames, appends, updates, keyed)
+
+
+def make_backend(kind: str, table_dir: Path, inventory: str = "table"):
+    kind = (kind or "csv").lower()
+    if kind == "csv":
+        be = CsvBackend(table_dir)
+    elif kind in ("parquet", "feather"):
+        be = ColumnarBackend(table_dir, fmt=kind)
+    elif kind == "sqlite":
+        be = SqliteBackend(table_dir)
+    else:
+        raise ValueError(f"Unknown storage backend: {kind}")
+    if (inventory or "table").lower() == "matrix":
+        return RoutedBackend(be, {"inventory": MatrixInventoryBackend(table_dir, be)})
+    return be
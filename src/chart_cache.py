@@ -0,0 +1,83 @@
+from __future__ import annotations
+import io
+import threading
+from collections import OrderedDict
+import matplotlib.pyplot as plt
+import pandas as pd
+from .config import CHART_CACHE_MAX_MB
+from .storage import table_version
+
+# Caché de gráficos ya rasterizados (PNG) para los dashboards de Streamlit.
+#
+# Clave = (id del gráfico, versión de cada tabla fuente, filtros, huella de los
+# datos si se pasan). Mientras nada de eso cambie se sirven los bytes guardados
+# y matplotlib no se toca. LRU acotada a CHART_CACHE_MAX_MB; vive en el proceso,
+# así que la comparten todas las sesiones de Streamlit.
+
+_cache: OrderedDict[tuple, bytes] = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple, set)):
+        return tuple(_freeze(v) for v in obj)
+    return str(obj) if not isinstance(obj, (int, float, str, type(None))) else obj
+
+def fingerprint(df: pd.DataFrame) -> tuple:
+    # huella barata del contenido (para datos derivados sin versión de tabla)
+    if df.empty:
+        return (0,)
+    return (len(df), int(pd.util.hash_pandas_object(df, index=False).sum()))
+
+def chart_key(chart_id: str, tables=(), filters=None, data: pd.DataFrame | None = None) -> tuple:
+    return (
+        chart_id,
+        tuple((t, table_version(t)) for t in tables),
+        _freeze(filters or {}),
+        fingerprint(data) if data is not None else None,
+    )
+
+def render_png(fig, dpi: int = 160) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+def cached_png(chart_id: str, render, tables=(), filters=None, data: pd.DataFrame | None = None) -> bytes:
+    # render() solo se llama si falta; debe devolver una figura de matplotlib
+    global _cache_bytes
+    key = chart_key(chart_id, tables, filters, data)
+    with _lock:
+        png = _cache.get(key)
+        if png is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return png
+        _stats["misses"] += 1
+
+    png = render_png(render())
+    cap = CHART_CACHE_MAX_MB * 1024 * 1024
+    if len(png) > cap:
+        return png
+    with _lock:
+        if key not in _cache:
+            _cache[key] = png
+            _cache_bytes += len(png)
+        while _cache_bytes > cap:
+            _, old = _cache.popitem(last=False)
+            _cache_bytes -= len(old)
+            _stats["evictions"] += 1
+    return png
+
+def clear_chart_cache() -> None:
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+def chart_cache_info() -> dict:
+    with _lock:
+        return {**_stats, "charts": len(_cache), "bytes": _cache_bytes}
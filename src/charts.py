@@ -0,0 +1,123 @@
+from __future__ import annotations
+import matplotlib.pyplot as plt
+import pandas as pd
+from . import kpi_cube
+
+# Figuras de los dashboards. Las agregaciones se calculan aparte (kpi_series,
+# compute_rfm) y cada fig_* solo dibuja y devuelve una figura de matplotlib.
+# APP.py las pasa por chart_cache; src/report.py las dibuja en paralelo.
+
+# ---- KPIs (leen solo el cubo) ----
+def kpi_series(cube: pd.DataFrame, products: pd.DataFrame) -> dict[str, pd.Series]:
+    # todas las agregaciones de los seis gráficos en una pasada: id -> serie
+    mix = kpi_cube.product_mix(cube, products)
+    return {
+        "kpi_orders_by_hour": kpi_cube.orders_by_hour(cube),
+        "kpi_revenue_by_hour": kpi_cube.revenue_by_hour(cube),
+        "kpi_payment_methods": kpi_cube.payment_counts(cube),
+        "kpi_top_quantity": kpi_cube.top_products(mix, "quantity"),
+        "kpi_top_revenue": kpi_cube.top_products(mix, "line_total"),
+        "kpi_category_revenue": kpi_cube.category_revenue(mix),
+    }
+
+def fig_orders_by_hour(h: pd.Series):
+    fig, ax = plt.subplots(figsize=(4.5, 3.2))
+    ax.bar(h.index, h.values)
+    ax.set_xticks(range(0, 24, 2))
+    ax.set_xlabel("Hora")
+    ax.set_ylabel("# Pedidos")
+    ax.set_title("Pedidos por hora")
+    return fig
+
+def fig_revenue_by_hour(hr: pd.Series):
+    fig, ax = plt.subplots(figsize=(4.5, 3.2))
+    ax.plot(hr.index, hr.values, marker="o")
+    ax.set_xticks(range(0, 24, 2))
+    ax.set_xlabel("Hora")
+    ax.set_ylabel("$ Ingresos")
+    ax.set_title("Ingresos por hora")
+    return fig
+
+def fig_payment_methods(pm: pd.Series):
+    fig, ax = plt.subplots(figsize=(4.5, 3.2))
+    ax.bar(pm.index.astype(str), pm.values)
+    ax.tick_params(axis="x", rotation=20)
+    ax.set_ylabel("# Órdenes")
+    ax.set_title("Órdenes por método de pago")
+    return fig
+
+def fig_top_quantity(top: pd.Series):
+    fig, ax = plt.subplots(figsize=(4.5, 3.2))
+    ax.barh(top.index[::-1], top.values[::-1])
+    ax.set_xlabel("Cantidad")
+    ax.set_title("Top 10 por cantidad")
+    return fig
+
+def fig_top_revenue(top: pd.Series):
+    fig, ax = plt.subplots(figsize=(4.5, 3.2))
+    ax.barh(top.index[::-1], top.values[::-1])
+    ax.set_xlabel("Ingresos ($)")
+    ax.set_title("Top 10 por ingresos")
+    return fig
+
+def fig_category_revenue(cat: pd.Series):
+    fig, ax = plt.subplots(figsize=(4.5, 3.2))
+    ax.bar(cat.index.astype(str), cat.values)
+    ax.tick_params(axis="x", rotation=30)
+    ax.set_ylabel("Ingresos ($)")
+    ax.set_title("Ingresos por categoría")
+    return fig
+
+# id -> (título, función), en el orden del dashboard 3x2
+KPI_CHARTS = {
+    "kpi_orders_by_hour": ("Pedidos por hora", fig_orders_by_hour),
+    "kpi_revenue_by_hour": ("Ingresos por hora", fig_revenue_by_hour),
+    "kpi_payment_methods": ("Método de pago", fig_payment_methods),
+    "kpi_top_quantity": ("Top productos (cantidad)", fig_top_quantity),
+    "kpi_top_revenue": ("Top productos (ingresos)", fig_top_revenue),
+    "kpi_category_revenue": ("Ingresos por categoría", fig_category_revenue),
+}
+
+# ---- RFM (reciben el DataFrame de compute_rfm) ----
+def fig_rfm_segments(rfm: pd.DataFrame):
+    seg_counts = rfm["segmento"].value_counts()
+    fig, ax = plt.subplots()
+    ax.bar(seg_counts.index, seg_counts.values)
+    ax.set_ylabel("# Clientes")
+    ax.tick_params(axis="x", rotation=30)
+    ax.set_title("Segmentos")
+    return fig
+
+def fig_rfm_recency(rfm: pd.DataFrame):
+    fig, ax = plt.subplots()
+    ax.hist(rfm["recency_days"], bins=10)
+    ax.set_xlabel("Días")
+    ax.set_ylabel("# Clientes")
+    ax.set_title("Recency")
+    return fig
+
+def fig_rfm_frequency_monetary(rfm: pd.DataFrame):
+    fig, ax = plt.subplots()
+    ax.scatter(rfm["frequency"], rfm["monetary"])
+    ax.set_xlabel("Frequency (# órdenes)")
+    ax.set_ylabel("Monetary ($)")
+    ax.set_title("F vs M")
+    return fig
+
+RFM_CHARTS = {
+    "rfm_segments": ("Clientes por segmento", fig_rfm_segments),
+    "rfm_recency": ("Recency (días desde última compra)", fig_rfm_recency),
+    "rfm_frequency_monetary": ("Frequency vs Monetary", fig_rfm_frequency_monetary),
+}
+
+# ---- ERP (recibe el DataFrame de rollups.pnl) ----
+def fig_pnl(pnl: pd.DataFrame, title: str):
+    fig, ax = plt.subplots(figsize=(9, 3.2))
+    ax.plot(pnl["period"], pnl["revenue"], marker="o", label="Ingresos")
+    ax.plot(pnl["period"], pnl["cogs"], marker="o", label="COGS")
+    ax.plot(pnl["period"], pnl["gross_margin"], marker="o", label="Margen bruto")
+    ax.set_ylabel("$")
+    ax.set_title(title)
+    ax.legend()
+    fig.autofmt_xdate()
+    return fig
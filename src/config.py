@@ -11,5 +11,43 @@ BASE_DIR = Path(".")
 TABLE_DIR = BASE_DIR / "tables_csv"
 FIG_DIR = BASE_DIR / "figures"
 
+# Backend de tablas: "parquet" (por defecto), "feather", "sqlite" o "csv".
+# Sin pyarrow instalado se usa CSV. Los CSV de TABLE_DIR siguen siendo el
+# formato de importación/exportación (ver `py -m src.migrate`).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "parquet")
+
+# Inventario: "table" (tabla larga en el backend) o "matrix" (matriz densa
+# sucursal × producto en tables_csv/_inventory.bin, ver src/inventory_store.py).
+INVENTORY_STORE = os.environ.get("INVENTORY_STORE", "table")
+
+# Tope de memoria para la caché de tablas leídas (LRU). 0 = sin caché.
+TABLE_CACHE_MAX_MB = int(os.environ.get("TABLE_CACHE_MAX_MB", "256"))
+
+# Tope de la caché de gráficos PNG de los dashboards (src/chart_cache.py).
+CHART_CACHE_MAX_MB = int(os.environ.get("CHART_CACHE_MAX_MB", "32"))
+
+# Filas por bloque al leer RAW_PATH en streaming (etl.iter_orders_csv).
+RAW_CHUNK_ROWS = int(os.environ.get("RAW_CHUNK_ROWS", "200000"))
+
+# Checkout asíncrono: el pedido queda PAID y ERP/SCM se postean en segundo plano
+# (src/posting.py). ASYNC_POSTING=1 lo activa.
+ASYNC_POSTING = os.environ.get("ASYNC_POSTING", "0") == "1"
+POSTING_BATCH = int(os.environ.get("POSTING_BATCH", "500"))
+POSTING_INTERVAL_S = float(os.environ.get("POSTING_INTERVAL_S", "1.0"))
+
+# Cada cuánto corre el planificador de reabastecimiento con
+# `py -m src.replenishment --every` (segundos).
+REPLENISH_INTERVAL_S = float(os.environ.get("REPLENISH_INTERVAL_S", "3600"))
+
+# Pronóstico de demanda (src/forecast.py): alpha del suavizamiento semanal,
+# z del stock de seguridad (1.65 ≈ 95 %) y días que cubre cada reorden.
+FORECAST_ALPHA = float(os.environ.get("FORECAST_ALPHA", "0.3"))
+SERVICE_Z = float(os.environ.get("SERVICE_Z", "1.65"))
+REVIEW_DAYS = int(os.environ.get("REVIEW_DAYS", "7"))
+
+# Checkpoint automático del inventario cada N movimientos (src/inventory_history.py).
+# 0 = solo manual (`py -m src.inventory_history --snapshot`).
+SNAPSHOT_EVERY = int(os.environ.get("SNAPSHOT_EVERY", "1000"))
+
 TABLE_DIR.mkdir(exist_ok=True)
 FIG_DIR.mkdir(exist_ok=True)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+import os
+import re
+import threading
+import unicodedata
+import pandas as pd
+from .config import TABLE_DIR
+from .storage import read_table, on_table_change
+
+# Índice nombre normalizado -> customer_id para buscar/deduplicar clientes en O(1).
+# Se guarda como un log TSV de solo-append ("clave\tcustomer_id"): cada alta añade
+# una línea y los demás procesos solo leen lo que se agregó desde su última lectura.
+# Si el archivo no existe (o se borra) se reconstruye desde la tabla customers.
+# Un hook sobre customers lo mantiene al día: un append agrega sus nombres y una
+# reescritura (restore, reseed, write_table) lo reconstruye, porque los ids viejos
+# pueden ya no existir. El reemplazo se detecta en los demás procesos por el inode.
+
+INDEX_PATH = TABLE_DIR / "_customer_index.tsv"
+_lock = threading.Lock()
+_index: dict[str, int] = {}
+_offset = 0
+_ino = None
+
+_MARKS = re.compile(r"[\u0300-\u036f]")
+_SPACES = re.compile(r"\s+")
+
+def normalize_name(name) -> str:
+    # "  José   PÉREZ " -> "jose perez" (sin tildes, sin mayúsculas, espacios simples)
+    s = _MARKS.sub("", unicodedata.normalize("NFKD", str(name)))
+    return _SPACES.sub(" ", s).strip().casefold()
+
+def normalize_names(names: pd.Series) -> pd.Series:
+    return (
+        names.astype(str)
+             .str.normalize("NFKD")
+             .str.replace(_MARKS, "", regex=True)
+             .str.replace(_SPACES, " ", regex=True)
+             .str.strip()
+             .str.casefold()
+    )
+
+def rebuild_customer_index() -> int:
+    global _index, _offset, _ino
+    customers = read_table("customers")
+    with _lock:
+        keys = normalize_names(customers["customer_name"]) if not customers.empty else pd.Series(dtype=str)
+        pairs = pd.DataFrame({"key": keys, "customer_id": customers["customer_id"].astype(int) if not customers.empty else []})
+        pairs = pairs.drop_duplicates("key")
+        tmp = INDEX_PATH.with_suffix(".tmp")
+        pairs.to_csv(tmp, sep="\t", header=False, index=False)
+        os.replace(tmp, INDEX_PATH)
+        _index = dict(zip(pairs["key"], pairs["customer_id"].tolist()))
+        st = INDEX_PATH.stat()
+        _offset, _ino = st.st_size, st.st_ino
+    return len(_index)
+
+def _sync():
+    # lee solo las líneas añadidas desde la última vez (otros procesos también insertan)
+    global _index, _offset, _ino
+    if not INDEX_PATH.exists():
+        rebuild_customer_index()
+        return
+    with _lock:
+        st = INDEX_PATH.stat()
+        size = st.st_size
+        if st.st_ino != _ino or size < _offset:
+            # otro proceso lo reconstruyó: se relee desde el inicio
+            _index, _offset, _ino = {}, 0, st.st_ino
+        if size == _offset:
+            return
+        with open(INDEX_PATH, "rb") as fh:
+            fh.seek(_offset)
+            data = fh.read(size - _offset)
+        # una línea a medio escribir se deja para la próxima lectura
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            key, _, cid = line.rpartition("\t")
+            _index.setdefault(key, int(cid))
+        _offset += end
+
+def lookup_customer(name) -> int | None:
+    _sync()
+    return _index.get(normalize_name(name))
+
+def lookup_customers(names: pd.Series) -> pd.Series:
+    _sync()
+    return normalize_names(names).map(_index)
+
+def index_customers(names, customer_ids) -> None:
+    # lo llama el hook de customers después de guardar las filas
+    _sync()
+    keys = [normalize_name(n) for n in names]
+    with _lock:
+        lines = []
+        for key, cid in zip(keys, customer_ids):
+            if key not in _index:
+                _index[key] = int(cid)
+                lines.append(f"{key}\t{int(cid)}\n")
+        if lines:
+            with open(INDEX_PATH, "a", encoding="utf-8") as fh:
+                fh.write("".join(lines))
+
+def _on_customers(df_new: pd.DataFrame | None) -> None:
+    if df_new is None:
+        rebuild_customer_index()
+    else:
+        index_customers(df_new["customer_name"], df_new["customer_id"])
+
+on_table_change("customers", _on_customers)
@@ -1,47 +1,81 @@
 from __future__ import annotations
+import argparse
 from datetime import datetime
+import numpy as np
 import pandas as pd
-from .storage import read_table, append_table, next_id
+from .storage import read_table, reserve_ids
+from .session import Session
 
-def record_sale(order_id: int):
-    orders = read_table("orders")
-    items = read_table("order_items")
-    prod = read_table("products")
+NOTES = {
+    "REVENUE": "Ingreso por venta confirmada",
+    "COGS": "Costo de venta estimado (unit_cost sintético)",
+}
 
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    row = orders[orders["order_id"] == int(order_id)]
-    if row.empty:
-        raise ValueError("Order not found")
+def record_sale(order_id: int, session: Session | None = None):
+    record_sales([order_id], session=session)
 
-    total = float(pd.to_numeric(row["total_amount"], errors="coerce").fillna(0.0).iloc[0])
-    now = datetime.utcnow().isoformat()
+def record_sales(order_ids, session: Session | None = None, at_order_ts: bool = False) -> int:
+    # REVENUE y COGS de todos los pedidos: un merge/groupby sobre order_items ⨝ products,
+    # un bloque de ids y un solo append. at_order_ts fecha los asientos con order_ts
+    # (backfill del histórico) en lugar de la hora actual.
+    if session is None:
+        with Session() as s:
+            return record_sales(order_ids, session=s, at_order_ts=at_order_ts)
 
-    entry_id = next_id("ledger_entries","entry_id",start=1)
-    append_table("ledger_entries", pd.DataFrame([{
-        "entry_id": entry_id,
-        "entry_ts": now,
-        "order_id": int(order_id),
-        "entry_type": "REVENUE",
-        "amount": total,
-        "note": "Ingreso por venta confirmada"
-    }]))
+    ids = pd.Index(pd.unique(np.asarray(order_ids, dtype="int64")))
+    if ids.empty:
+        return 0
+    orders = session.rows_in("orders", "order_id", ids).drop_duplicates("order_id").set_index("order_id")
+    if len(orders) < len(ids):
+        raise ValueError("Order not found")
+    orders = orders.reindex(ids)
 
-    items["order_id"] = pd.to_numeric(items["order_id"], errors="coerce")
-    oi = items[items["order_id"] == int(order_id)].merge(prod, on="product_id", how="left")
+    prod = session.table("products")[["product_id", "unit_cost"]]
+    oi = session.rows_in("order_items", "order_id", ids).merge(prod, on="product_id", how="left")
+    cogs = (oi["quantity"] * oi["unit_cost"].fillna(0.0)).groupby(oi["order_id"]).sum().reindex(ids, fill_value=0.0)
 
-    if oi.empty:
-        cogs = 0.0
+    n = len(ids)
+    if at_order_ts:
+        ts = orders["order_ts"].fillna(pd.Timestamp(datetime.utcnow())).to_numpy()
     else:
-        q = pd.to_numeric(oi["quantity"], errors="coerce").fillna(0).astype(int)
-        uc = pd.to_numeric(oi["unit_cost"], errors="coerce").fillna(0.0)
-        cogs = float((q * uc).sum())
-
-    entry_id2 = next_id("ledger_entries","entry_id",start=1)
-    append_table("ledger_entries", pd.DataFrame([{
-        "entry_id": entry_id2,
-        "entry_ts": now,
-        "order_id": int(order_id),
-        "entry_type": "COGS",
-        "amount": cogs,
-        "note": "Costo de venta estimado (unit_cost sintético)"
-    }]))
+        ts = np.full(n, pd.Timestamp(datetime.utcnow()).to_datetime64())
+
+    # por pedido: REVENUE y luego COGS (ids consecutivos, igual que antes)
+    entry_id = reserve_ids("ledger_entries", "entry_id", 2 * n, start=1)
+    entries = pd.DataFrame({
+        "entry_id": entry_id + np.arange(2 * n),
+        "entry_ts": np.repeat(ts, 2),
+        "order_id": np.repeat(ids.to_numpy(), 2),
+        "entry_type": np.tile(["REVENUE", "COGS"], n),
+        "amount": np.column_stack([orders["total_amount"].astype(float).to_numpy(), cogs.to_numpy()]).ravel(),
+    })
+    entries["note"] = entries["entry_type"].map(NOTES)
+    session.append("ledger_entries", entries)
+    return n
+
+def backfill_ledger(batch_size: int = 100_000) -> int:
+    # asienta los pedidos PAID que aún no tienen asientos (p.ej. el histórico importado)
+    orders = read_table("orders")
+    ledger = read_table("ledger_entries")
+    if orders.empty:
+        return 0
+    paid = orders.loc[orders["status"] == "PAID", "order_id"]
+    todo = paid[~paid.isin(ledger["order_id"])] if not ledger.empty else paid
+    n = 0
+    for i in range(0, len(todo), batch_size):
+        n += record_sales(todo.iloc[i:i + batch_size].tolist(), at_order_ts=True)
+    return n
+
+def main():
+    ap = argparse.ArgumentParser(description="ERP: asientos contables")
+    ap.add_argument("--backfill", action="store_true", help="asienta los pedidos PAID sin asientos")
+    args = ap.parse_args()
+
+    if args.backfill:
+        print("Pedidos asentados:", backfill_ledger())
+    ledger = read_table("ledger_entries")
+    if not ledger.empty:
+        print(ledger.groupby("entry_type", observed=True)["amount"].sum().round(2).to_string())
+
+if __name__ == "__main__":
+    main()
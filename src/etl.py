@@ -1,16 +1,119 @@
 from __future__ import annotations
+import hashlib
+import os
+import time
+import warnings
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
 
-def load_orders_csv(path) -> pd.DataFrame:
-    df = pd.read_csv(path)
+def normalize_orders(df: pd.DataFrame, ts_format: str | None = None) -> pd.DataFrame:
     df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
 
     df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0).astype(int)
     df["price"] = pd.to_numeric(df["price"], errors="coerce").fillna(0.0)
 
-    df["order_ts"] = pd.to_datetime(df["order_time"], errors="coerce")
+    df["order_ts"] = pd.to_datetime(df["order_time"], errors="coerce", format=ts_format)
     df["order_date"] = df["order_ts"].dt.date.astype(str)
     df["order_hour"] = df["order_ts"].dt.hour
     df["day_of_week"] = df["order_ts"].dt.day_name()
     df["line_total"] = df["quantity"] * df["price"]
     return df
+
+def load_orders_csv(path) -> pd.DataFrame:
+    return normalize_orders(pd.read_csv(path))
+
+def sniff_ts_format(path, nrows: int = 200) -> str | None:
+    # formato de `Order Time` según una muestra de filas; se fija para todos los
+    # bloques, inferirlo por bloque podría leer día/mes al revés. El export es
+    # dd/mm: con dayfirst una fila ambigua (día <= 12) propone %d/%m y una con
+    # día > 12 en mm/dd propone %m/%d; gana el primer formato que lee toda la
+    # muestra. Si ninguno la lee entera, None (pandas infiere fila a fila).
+    head = pd.read_csv(path, nrows=nrows)
+    col = next((c for c in head.columns if c.strip().lower().replace(" ", "_") == "order_time"), None)
+    sample = head[col].dropna().astype(str) if col is not None else pd.Series(dtype=str)
+    if sample.empty:
+        return None
+    with warnings.catch_warnings():
+        # el aviso de dayfirst es justo el caso que se resuelve aquí
+        warnings.simplefilter("ignore", UserWarning)
+        candidates = pd.unique(pd.Series([guess_datetime_format(v, dayfirst=True) for v in sample]).dropna())
+    for fmt in candidates:
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().all():
+            return fmt
+    return None
+
+class ContentHash:
+    # sha256 + bytes leídos; envuelve el archivo para hashear mientras pandas lo lee
+    def __init__(self):
+        self.sha = hashlib.sha256()
+        self.nbytes = 0
+
+    def update(self, data: bytes):
+        self.sha.update(data)
+        self.nbytes += len(data)
+
+    def hexdigest(self) -> str:
+        return self.sha.hexdigest()
+
+    def prefix(self, path, nbytes: int, block: int = 1 << 20) -> str:
+        with open(path, "rb") as fh:
+            while self.nbytes < nbytes:
+                data = fh.read(min(block, nbytes - self.nbytes))
+                if not data:
+                    break
+                self.update(data)
+        return self.hexdigest()
+
+class _HashingReader:
+    def __init__(self, fh, content_hash: ContentHash):
+        self.fh, self.content_hash = fh, content_hash
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fh.read(size)
+        self.content_hash.update(data)
+        return data
+
+def print_progress(rows: int, nbytes: int, total_bytes: int, secs: float):
+    secs = max(secs, 1e-9)
+    pct = 100 * nbytes / total_bytes if total_bytes else 100.0
+    print(f"  ... {rows:,} filas ({pct:5.1f}%) | {rows/secs:,.0f} filas/s | {nbytes/secs/2**20:,.1f} MB/s")
+
+def iter_orders_csv(path, chunksize: int, progress=print_progress, start: int = 0,
+                    skip_rows: int = 0, ts_format: str | None = None, content_hash: ContentHash | None = None):
+    # lee el export crudo por bloques de `chunksize` filas (memoria constante)
+    # y aplica a cada bloque las mismas transformaciones que load_orders_csv.
+    # `start` retoma desde un offset en bytes (fin de línea) y `skip_rows` salta filas ya leídas.
+    total_bytes = os.path.getsize(path)
+    if ts_format is None:
+        ts_format = sniff_ts_format(path)
+    names = list(pd.read_csv(path, nrows=0).columns) if start else None
+    t0 = time.perf_counter()
+    rows = 0
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        src = _HashingReader(fh, content_hash) if content_hash is not None else fh
+        reader = pd.read_csv(
+            src, chunksize=chunksize,
+            header=None if names else "infer", names=names,
+            skiprows=range(1, skip_rows + 1) if skip_rows else None,
+        )
+        for chunk in reader:
+            rows += len(chunk)
+            yield normalize_orders(chunk, ts_format=ts_format)
+            if progress:
+                nbytes = min(fh.tell(), total_bytes) - start
+                progress(rows, nbytes, total_bytes - start, time.perf_counter() - t0)
+
+def profile_orders(df: pd.DataFrame) -> pd.DataFrame:
+    # resumen compacto (food_item, category, price) -> filas y cantidad vendida;
+    # su tamaño depende del catálogo, no del número de pedidos
+    return (
+        df.groupby(["food_item", "category", "price"], as_index=False, dropna=False)
+          .agg(n=("price", "size"), quantity=("quantity", "sum"))
+    )
+
+def merge_profiles(profiles) -> pd.DataFrame:
+    return (
+        pd.concat(profiles, ignore_index=True)
+          .groupby(["food_item", "category", "price"], as_index=False, dropna=False)[["n", "quantity"]].sum()
+    )
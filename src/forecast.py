@@ -0,0 +1,139 @@
+from __future__ import annotations
+import argparse
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from .config import FORECAST_ALPHA, SERVICE_Z, REVIEW_DAYS
+from .session import Session
+
+# Pronóstico de demanda por sucursal × producto × hora de la semana (168 franjas).
+#
+# Suavizamiento exponencial simple sobre semanas, en forma cerrada: el nivel de
+# cada serie es sum_t w_t·x_t / sum_t w_t con w_t = (1-alpha)^(L-t), donde L es
+# la última semana con ventas de esa serie (no la de toda la historia: una serie
+# sin ventas recientes conserva su último nivel en vez de decaer a ~0). Así todas
+# las series salen de una sola suma ponderada agrupada con np.bincount (semanas
+# sin ventas aportan 0), sin recorrer series en Python. La varianza semanal se
+# estima con los mismos pesos: E_w[x²] - E_w[x]².
+#
+# stock_min = demanda esperada durante lead_time_days (según el perfil horario
+#             de las próximas horas) + SERVICE_Z · sigma_diaria · sqrt(lead)
+# reorder_qty = demanda esperada en REVIEW_DAYS días
+
+KEYS = ["branch_id", "product_id"]
+SLOTS = 7 * 24
+
+def demand_history(session: Session) -> pd.DataFrame:
+    # una fila por línea vendida: branch_id, product_id, order_ts, quantity
+    orders = session.table("orders")
+    orders = orders[orders["status"] == "PAID"][["order_id", "branch_id", "order_ts"]]
+    items = session.table("order_items")[["order_id", "product_id", "quantity"]]
+    return items.merge(orders, on="order_id", how="inner")
+
+def forecast_demand(history: pd.DataFrame, alpha: float = FORECAST_ALPHA) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    # devuelve (series, perfil, sigma): series = KEYS por fila, perfil = unidades
+    # esperadas por franja (n_series × 168), sigma = desviación semanal por serie.
+    # El nivel es el de la última semana con datos de cada serie.
+    if history.empty:
+        return pd.DataFrame(columns=KEYS), np.zeros((0, SLOTS)), np.zeros(0)
+    ts = history["order_ts"]
+    start = ts.min().normalize() - pd.Timedelta(days=int(ts.min().dayofweek))
+    hours = ((ts - start) // pd.Timedelta(hours=1)).to_numpy()
+    week, slot = hours // SLOTS, hours % SLOTS
+    n_weeks = int(week.max()) + 1
+
+    # una clave entera por (sucursal, producto) y conteos con bincount
+    key = history["branch_id"].to_numpy().astype(np.int64) << 32 | history["product_id"].to_numpy().astype(np.int64)
+    code, uniq = pd.factorize(key, sort=True)
+    n = len(uniq)
+    qty = history["quantity"].to_numpy().astype(float)
+
+    # pesos por serie (series × semanas): (1-alpha)^(última - t), 0 después de la última
+    last = np.zeros(n, dtype=np.int64)
+    np.maximum.at(last, code, week)
+    age = last[:, None] - np.arange(n_weeks)[None, :]
+    w = np.where(age >= 0, (1.0 - alpha) ** np.clip(age, 0, None), 0.0)
+    w_sum = w.sum(axis=1)
+
+    # nivel por franja: suma ponderada agrupada en una matriz (series × 168)
+    profile = np.bincount(code * SLOTS + slot, weights=qty * w[code, week], minlength=n * SLOTS).reshape(n, SLOTS)
+    profile /= w_sum[:, None]
+
+    # totales semanales (series × semanas) para la varianza ponderada
+    weekly = np.bincount(code * n_weeks + week, weights=qty, minlength=n * n_weeks).reshape(n, n_weeks)
+    mean = (weekly * w).sum(axis=1) / w_sum
+    sigma = np.sqrt(np.clip((weekly * weekly * w).sum(axis=1) / w_sum - mean * mean, 0.0, None))
+
+    series = pd.DataFrame({"branch_id": (uniq >> 32).astype(int), "product_id": (uniq & 0xFFFFFFFF).astype(int)})
+    return series, profile, sigma
+
+def window_slots(now: pd.Timestamp, days: np.ndarray) -> np.ndarray:
+    # cuántas veces aparece cada franja en las próximas days·24 horas (una fila por valor)
+    start = now.floor("h")
+    first = start.dayofweek * 24 + start.hour
+    out = np.zeros((len(days), SLOTS))
+    for i, d in enumerate(days):
+        out[i] = np.bincount((first + np.arange(int(d) * 24)) % SLOTS, minlength=SLOTS)
+    return out
+
+def compute_params(session: Session, alpha: float = FORECAST_ALPHA, z: float = SERVICE_Z,
+                   review_days: int = REVIEW_DAYS, now: pd.Timestamp | None = None) -> pd.DataFrame:
+    now = pd.Timestamp(datetime.utcnow()) if now is None else now
+    series, profile, sigma = forecast_demand(demand_history(session), alpha)
+    cols = KEYS + ["lead_time_days", "weekly_demand", "lead_demand", "stock_min", "reorder_qty"]
+    if series.empty:
+        return pd.DataFrame(columns=cols)
+
+    lead = series.merge(session.table("products")[["product_id", "supplier_id"]], on="product_id", how="left") \
+                 .merge(session.table("suppliers")[["supplier_id", "lead_time_days"]], on="supplier_id", how="left")
+    lead_days = lead["lead_time_days"].fillna(1).astype(int).clip(lower=1).to_numpy()
+
+    # demanda en la ventana de cada proveedor: perfil · ocurrencias de cada franja
+    uniq, which = np.unique(np.append(lead_days, review_days), return_inverse=True)
+    counts = window_slots(now, uniq)
+    lead_demand = np.einsum("ij,ij->i", profile, counts[which[:-1]])
+    review_demand = profile @ counts[which[-1]]
+
+    daily_sigma = sigma / np.sqrt(7.0)
+    out = series.assign(
+        lead_time_days=lead_days,
+        weekly_demand=profile.sum(axis=1),
+        lead_demand=lead_demand,
+        stock_min=np.ceil(lead_demand + z * daily_sigma * np.sqrt(lead_days)).astype(int).clip(min=1),
+        reorder_qty=np.ceil(review_demand).astype(int).clip(min=1),
+    )
+    return out[cols]
+
+def update_inventory_params(session: Session | None = None, **kwargs) -> pd.DataFrame:
+    # reescribe stock_min/reorder_qty de las filas de inventory con historia;
+    # las que no tienen ventas conservan sus valores
+    if session is None:
+        with Session() as s:
+            return update_inventory_params(session=s, **kwargs)
+
+    params = compute_params(session, **kwargs)
+    if params.empty:
+        return params
+    params = params.merge(session.lookup("inventory", KEYS, params)[KEYS], on=KEYS)
+    session.assign("inventory", KEYS, params[KEYS + ["stock_min", "reorder_qty"]])
+    return params
+
+def main():
+    ap = argparse.ArgumentParser(description="Pronóstico de demanda y mínimos de inventario")
+    ap.add_argument("--apply", action="store_true", help="guarda stock_min/reorder_qty en inventory")
+    ap.add_argument("--alpha", type=float, default=FORECAST_ALPHA)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    if args.apply:
+        params = update_inventory_params(alpha=args.alpha)
+    else:
+        with Session() as s:
+            params = compute_params(s, alpha=args.alpha)
+    secs = time.perf_counter() - t0
+    print(params.to_string(index=False) if not params.empty else "Sin historia de ventas.")
+    print(f"Series: {len(params)} × {SLOTS} franjas | {secs:.3f}s" + (" | inventario actualizado" if args.apply else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+import argparse
+from datetime import datetime
+import pandas as pd
+from .config import SNAPSHOT_EVERY
+from .storage import read_table, get_rows, table_columns, table_version, on_table_change
+from .session import Session
+
+# Historia del inventario: stock_movements es la fuente de verdad (SALE,
+# RECEIVED, ADJUST) y cada tanto se guarda un checkpoint compacto del stock.
+#
+#   inventory_checkpoints: snapshot_id, snapshot_ts, last_movement_id, rows
+#   inventory_snapshots:   snapshot_id, branch_id, product_id, stock_on_hand
+#
+# last_movement_id marca qué movimientos ya están dentro del checkpoint. El stock
+# en una fecha D sale del checkpoint más cercano anterior a D más los movimientos
+# posteriores hasta D; si no hay ninguno anterior, del siguiente (o del
+# inventario actual) restando los movimientos entre D y ese punto.
+
+KEYS = ["branch_id", "product_id"]
+_last_snapshot_mid: int | None = None
+_max_mid: tuple | None = None  # (versión de stock_movements, max movement_id)
+
+def checkpoints() -> pd.DataFrame:
+    cp = read_table("inventory_checkpoints")
+    if cp.empty:
+        return pd.DataFrame(columns=["snapshot_id", "snapshot_ts", "last_movement_id", "rows"])
+    return cp.sort_values("snapshot_id").reset_index(drop=True)
+
+def _last_movement_id() -> int:
+    # se recalcula solo si stock_movements cambió
+    global _max_mid
+    version = table_version("stock_movements")
+    if _max_mid is None or _max_mid[0] != version:
+        mov = read_table("stock_movements")
+        _max_mid = (version, int(mov["movement_id"].max()) if not mov.empty else 0)
+    return _max_mid[1]
+
+def take_snapshot() -> int:
+    global _last_snapshot_mid
+    inv = read_table("inventory")
+    mid = _last_movement_id()
+    cp = checkpoints()
+    sid = int(cp["snapshot_id"].max()) + 1 if not cp.empty else 1
+    # filas y checkpoint en un solo commit: sin el checkpoint las filas se ignoran
+    with Session() as s:
+        s.append("inventory_snapshots", pd.DataFrame({
+            "snapshot_id": sid,
+            "branch_id": inv["branch_id"].to_numpy(),
+            "product_id": inv["product_id"].to_numpy(),
+            "stock_on_hand": inv["stock_on_hand"].to_numpy()
+        }))
+        s.append("inventory_checkpoints", pd.DataFrame([{
+            "snapshot_id": sid,
+            "snapshot_ts": datetime.utcnow().isoformat(),
+            "last_movement_id": mid,
+            "rows": len(inv)
+        }]))
+    _last_snapshot_mid = mid
+    return sid
+
+def _on_movements(df_new: pd.DataFrame | None) -> None:
+    # checkpoint automático cada SNAPSHOT_EVERY movimientos
+    global _last_snapshot_mid
+    if df_new is None or df_new.empty or SNAPSHOT_EVERY <= 0 or not table_columns("inventory_checkpoints"):
+        return
+    if _last_snapshot_mid is None:
+        cp = checkpoints()
+        _last_snapshot_mid = int(cp["last_movement_id"].max()) if not cp.empty else 0
+    if int(df_new["movement_id"].max()) - _last_snapshot_mid >= SNAPSHOT_EVERY:
+        take_snapshot()
+
+on_table_change("stock_movements", _on_movements)
+
+def _filter(df: pd.DataFrame, branch_id: int | None, product_id: int | None) -> pd.DataFrame:
+    if branch_id is not None:
+        df = df[df["branch_id"] == int(branch_id)]
+    if product_id is not None:
+        df = df[df["product_id"] == int(product_id)]
+    return df
+
+def _movements(branch_id: int | None, product_id: int | None) -> pd.DataFrame:
+    if branch_id is not None and product_id is not None:
+        # índice (branch_id, product_id)
+        return get_rows("stock_movements", branch_id=int(branch_id), product_id=int(product_id))
+    return _filter(read_table("stock_movements"), branch_id, product_id)
+
+def stock_at(ts, branch_id: int | None = None, product_id: int | None = None) -> pd.DataFrame:
+    # stock_on_hand por (sucursal, producto) al instante ts
+    ts = pd.Timestamp(ts)
+    cp = checkpoints()
+    before = cp[cp["snapshot_ts"] <= ts]
+    after = cp[cp["snapshot_ts"] > ts]
+    mov = _movements(branch_id, product_id)
+
+    if not before.empty:
+        base = before.iloc[-1]
+        state = get_rows("inventory_snapshots", snapshot_id=int(base["snapshot_id"]))
+        tail = mov[(mov["movement_id"] > int(base["last_movement_id"])) & (mov["movement_ts"] <= ts)]
+        sign = 1
+    else:
+        if not after.empty:
+            base = after.iloc[0]
+            state = get_rows("inventory_snapshots", snapshot_id=int(base["snapshot_id"]))
+            last_mid = int(base["last_movement_id"])
+        else:
+            state = read_table("inventory")
+            last_mid = int(mov["movement_id"].max()) if not mov.empty else 0
+        tail = mov[(mov["movement_id"] <= last_mid) & (mov["movement_ts"] > ts)]
+        sign = -1
+
+    state = _filter(state, branch_id, product_id)[KEYS + ["stock_on_hand"]]
+    delta = tail.groupby(KEYS, as_index=False)["qty_change"].sum()
+    out = state.merge(delta, on=KEYS, how="outer")
+    out["stock_on_hand"] = (out["stock_on_hand"].fillna(0) + sign * out["qty_change"].fillna(0)).astype(int)
+    return out[KEYS + ["stock_on_hand"]].sort_values(KEYS).reset_index(drop=True)
+
+def verify() -> pd.DataFrame:
+    # diferencias entre el inventario actual y lo reconstruido hacia adelante desde
+    # el checkpoint base (el primero, que guarda el seed; una resiembra deja
+    # movimientos ADJUST) con todos los movimientos posteriores: cambios de stock
+    # sin movimiento. Sin checkpoint no hay contra qué
+    # comparar (reconstruir desde inventory mismo siempre cuadra).
+    cp = checkpoints()
+    if cp.empty:
+        raise ValueError("No inventory checkpoint to verify against; take a snapshot first")
+    base = cp.iloc[0]
+    state = get_rows("inventory_snapshots", snapshot_id=int(base["snapshot_id"]))[KEYS + ["stock_on_hand"]]
+    mov = read_table("stock_movements")
+    tail = mov[mov["movement_id"] > int(base["last_movement_id"])]
+    delta = tail.groupby(KEYS, as_index=False)["qty_change"].sum()
+    rebuilt = state.merge(delta, on=KEYS, how="outer")
+    rebuilt["stock_on_hand"] = (rebuilt["stock_on_hand"].fillna(0) + rebuilt["qty_change"].fillna(0)).astype(int)
+    rebuilt = rebuilt[KEYS + ["stock_on_hand"]]
+
+    inv = read_table("inventory")[KEYS + ["stock_on_hand"]]
+    diff = inv.merge(rebuilt, on=KEYS, how="outer", suffixes=("", "_rebuilt")).fillna(0)
+    diff["drift"] = (diff["stock_on_hand"] - diff["stock_on_hand_rebuilt"]).astype(int)
+    return diff[diff["drift"] != 0].reset_index(drop=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="Historia del inventario (checkpoints + movimientos)")
+    ap.add_argument("--snapshot", action="store_true", help="guarda un checkpoint del inventario actual")
+    ap.add_argument("--at", metavar="FECHA", help="stock a esa fecha/hora")
+    ap.add_argument("--branch", type=int)
+    ap.add_argument("--product", type=int)
+    ap.add_argument("--verify", action="store_true", help="compara inventory con la reconstrucción")
+    args = ap.parse_args()
+
+    if args.snapshot:
+        print("Checkpoint:", take_snapshot())
+    if args.at:
+        print(stock_at(args.at, args.branch, args.product).to_string(index=False))
+    if args.verify:
+        try:
+            drift = verify()
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print("✅ Inventario cuadra con stock_movements." if drift.empty else drift.to_string(index=False))
+    if not (args.snapshot or args.at or args.verify):
+        print(checkpoints().to_string(index=False))
+
+if __name__ == "__main__":
+    main()
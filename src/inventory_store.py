@@ -0,0 +1,215 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import struct
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Inventario denso sucursal × producto.
+#
+# stock_on_hand, stock_min y reorder_qty viven en un arreglo int32 (4, B, P)
+# (la 4ª capa marca qué celdas existen en la tabla larga). branch_id/product_id
+# se traducen a posiciones con searchsorted, así que leer, descontar o buscar
+# bajo mínimo son operaciones de arreglo, sin filtrar DataFrames. Con el archivo
+# abierto en "r+" (MatrixInventoryBackend) add/assign/put_rows escriben en sitio.
+#
+# Archivo: "VINV" + largo del encabezado (uint32) + encabezado JSON con los ids,
+# relleno hasta múltiplo de 64 y luego las capas en crudo. load() lo abre con
+# np.memmap, no copia nada a memoria.
+
+MAGIC = b"VINV"
+LAYERS = ["stock_on_hand", "stock_min", "reorder_qty"]
+COLUMNS = ["branch_id", "product_id"] + LAYERS
+
+class InventoryMatrix:
+    def __init__(self, branch_ids, product_ids, data: np.ndarray | None = None):
+        self.branch_ids = np.asarray(branch_ids, dtype=np.int32)
+        self.product_ids = np.asarray(product_ids, dtype=np.int32)
+        shape = (len(LAYERS) + 1, len(self.branch_ids), len(self.product_ids))
+        self.data = np.zeros(shape, dtype=np.int32) if data is None else data
+
+    # ---- capas ----
+    @property
+    def stock_on_hand(self) -> np.ndarray:
+        return self.data[0]
+
+    @property
+    def stock_min(self) -> np.ndarray:
+        return self.data[1]
+
+    @property
+    def reorder_qty(self) -> np.ndarray:
+        return self.data[2]
+
+    @property
+    def present(self) -> np.ndarray:
+        return self.data[3]
+
+    # ---- ids -> posiciones ----
+    @staticmethod
+    def _locate(ids: np.ndarray, values) -> np.ndarray:
+        values = np.asarray(values, dtype=np.int64)
+        if len(ids) == 0:
+            return np.full(values.shape, -1)
+        pos = np.searchsorted(ids, values).clip(max=len(ids) - 1)
+        return np.where(ids[pos] == values, pos, -1)
+
+    def positions(self, branch_ids, product_ids) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (filas, columnas, válido): válido = la celda existe en el inventario
+        b = self._locate(self.branch_ids, branch_ids)
+        p = self._locate(self.product_ids, product_ids)
+        ok = (b >= 0) & (p >= 0)
+        ok[ok] = self.present[b[ok], p[ok]] == 1
+        return b, p, ok
+
+    # ---- conversión con la tabla larga ----
+    @classmethod
+    def from_long(cls, df: pd.DataFrame) -> "InventoryMatrix":
+        m = cls(np.unique(df["branch_id"].astype(int)), np.unique(df["product_id"].astype(int)))
+        if df.empty:
+            return m
+        b = np.searchsorted(m.branch_ids, df["branch_id"].astype(int).to_numpy())
+        p = np.searchsorted(m.product_ids, df["product_id"].astype(int).to_numpy())
+        for k, col in enumerate(LAYERS):
+            m.data[k, b, p] = df[col].fillna(0).astype(int).to_numpy()
+        m.data[3, b, p] = 1
+        return m
+
+    def to_long(self) -> pd.DataFrame:
+        # mismo orden que el seed: producto y dentro de cada producto las sucursales
+        p, b = np.nonzero(self.present.T)
+        out = {"branch_id": self.branch_ids[b], "product_id": self.product_ids[p]}
+        for k, col in enumerate(LAYERS):
+            out[col] = np.asarray(self.data[k, b, p])
+        return pd.DataFrame(out, columns=COLUMNS)
+
+    def cells(self, branch_ids, product_ids) -> pd.DataFrame:
+        # forma larga solo de esas celdas (las que existen), en el orden pedido
+        b, p, ok = self.positions(branch_ids, product_ids)
+        b, p = b[ok], p[ok]
+        out = {"branch_id": self.branch_ids[b], "product_id": self.product_ids[p]}
+        for k, col in enumerate(LAYERS):
+            out[col] = np.asarray(self.data[k, b, p])
+        return pd.DataFrame(out, columns=COLUMNS)
+
+    def select(self, branch_id: int | None = None, product_id: int | None = None) -> pd.DataFrame:
+        if branch_id is not None and product_id is not None:
+            return self.cells([branch_id], [product_id])
+        if branch_id is not None:
+            # una fila de la matriz: solo los productos presentes en esa sucursal
+            b = self._locate(self.branch_ids, [branch_id])[0]
+            p = np.nonzero(self.present[b])[0] if b >= 0 else np.zeros(0, dtype=int)
+            return self.cells(np.full(len(p), int(branch_id)), self.product_ids[p])
+        if product_id is not None:
+            p = self._locate(self.product_ids, [product_id])[0]
+            b = np.nonzero(self.present[:, p])[0] if p >= 0 else np.zeros(0, dtype=int)
+            return self.cells(self.branch_ids[b], np.full(len(b), int(product_id)))
+        return self.to_long()
+
+    # ---- operaciones ----
+    def get(self, branch_id: int, product_id: int) -> dict | None:
+        b, p, ok = self.positions([branch_id], [product_id])
+        if not ok[0]:
+            return None
+        return {col: int(self.data[k, b[0], p[0]]) for k, col in enumerate(LAYERS)}
+
+    def set(self, branch_id: int, product_id: int, **values) -> bool:
+        b, p, ok = self.positions([branch_id], [product_id])
+        if not ok[0]:
+            return False
+        for col, v in values.items():
+            self.data[LAYERS.index(col), b[0], p[0]] = int(v)
+        return True
+
+    def add(self, branch_ids, product_ids, col: str, values) -> np.ndarray:
+        # suma agrupada sobre una capa (claves repetidas se acumulan); devuelve qué líneas aplicaron
+        b, p, ok = self.positions(branch_ids, product_ids)
+        np.add.at(self.data[LAYERS.index(col)], (b[ok], p[ok]), np.asarray(values, dtype=np.int32)[ok])
+        return ok
+
+    def assign(self, branch_ids, product_ids, col: str, values) -> np.ndarray:
+        b, p, ok = self.positions(branch_ids, product_ids)
+        self.data[LAYERS.index(col), b[ok], p[ok]] = np.asarray(values, dtype=np.int32)[ok]
+        return ok
+
+    def covers(self, branch_ids, product_ids) -> bool:
+        # todas las claves caen dentro de los ejes actuales (no hace falta crecer el archivo)
+        return bool((self._locate(self.branch_ids, branch_ids) >= 0).all()
+                    and (self._locate(self.product_ids, product_ids) >= 0).all())
+
+    def put_rows(self, df: pd.DataFrame) -> None:
+        # filas nuevas (o repetidas: gana la última) dentro de los ejes; ver covers()
+        b = self._locate(self.branch_ids, df["branch_id"].astype(int).to_numpy())
+        p = self._locate(self.product_ids, df["product_id"].astype(int).to_numpy())
+        for k, col in enumerate(LAYERS):
+            self.data[k, b, p] = df[col].fillna(0).astype(int).to_numpy()
+        self.data[3, b, p] = 1
+
+    def below_min(self) -> pd.DataFrame:
+        b, p = np.nonzero((self.present == 1) & (self.stock_on_hand < self.stock_min))
+        return self.cells(self.branch_ids[b], self.product_ids[p])
+
+    # ---- persistencia ----
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        self.write_file(tmp)
+        os.replace(tmp, path)
+
+    def write_file(self, path: Path) -> None:
+        # escribe el archivo completo en `path` (sin rename; ver save)
+        header = json.dumps({
+            "version": 1,
+            "branch_ids": self.branch_ids.tolist(),
+            "product_ids": self.product_ids.tolist(),
+        }).encode("utf-8")
+        offset = -(-(len(MAGIC) + 4 + len(header)) // 64) * 64
+        with open(path, "wb") as fh:
+            fh.write(MAGIC + struct.pack("<I", len(header)) + header)
+            fh.write(b"\0" * (offset - fh.tell()))
+            fh.write(np.ascontiguousarray(self.data, dtype="<i4").tobytes())
+
+    @classmethod
+    def load(cls, path: Path, mode: str = "r") -> "InventoryMatrix":
+        # mode: "r" solo lectura, "r+" escribe en el archivo, "c" copia-en-escritura
+        with open(path, "rb") as fh:
+            if fh.read(4) != MAGIC:
+                raise ValueError(f"{path} is not an inventory matrix file")
+            (n,) = struct.unpack("<I", fh.read(4))
+            header = json.loads(fh.read(n).decode("utf-8"))
+        offset = -(-(len(MAGIC) + 4 + n) // 64) * 64
+        branch_ids, product_ids = header["branch_ids"], header["product_ids"]
+        shape = (len(LAYERS) + 1, len(branch_ids), len(product_ids))
+        if 0 in shape:
+            return cls(branch_ids, product_ids)
+        data = np.memmap(path, dtype="<i4", mode=mode, offset=offset, shape=shape)
+        return cls(branch_ids, product_ids, data)
+
+    def flush(self) -> None:
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+
+def main():
+    from .config import TABLE_DIR
+    from .storage import read_table
+
+    ap = argparse.ArgumentParser(description="Inventario denso sucursal × producto")
+    ap.add_argument("--build", action="store_true", help="crea _inventory.bin desde la tabla inventory actual")
+    ap.add_argument("--export", metavar="CSV", help="escribe el inventario en formato largo (CSV)")
+    args = ap.parse_args()
+
+    path = TABLE_DIR / "_inventory.bin"
+    if args.build:
+        InventoryMatrix.from_long(read_table("inventory")).save(path)
+        print("✅ Inventario denso:", path)
+    m = InventoryMatrix.load(path)
+    print(f"Sucursales: {len(m.branch_ids)} | Productos: {len(m.product_ids)} | Bajo mínimo: {len(m.below_min())}")
+    if args.export:
+        m.to_long().to_csv(args.export, index=False)
+        print("Exportado a", args.export)
+
+if __name__ == "__main__":
+    main()
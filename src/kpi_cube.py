@@ -0,0 +1,140 @@
+from __future__ import annotations
+import argparse
+import pandas as pd
+from .storage import read_table, write_table, table_columns
+from .session import Session
+
+# Cubo de KPIs: agregados aditivos por fecha × hora × sucursal × producto ×
+# método de pago, solo de pedidos PAID. Los seis gráficos del dashboard leen de
+# aquí, así que su costo depende del número de celdas y no del histórico.
+#
+# Medidas de pedido (orders, revenue = total_amount) van en filas con
+# product_id = 0; medidas de línea (quantity, line_total) en filas por producto.
+# Así todo se puede sumar por cualquier combinación de claves sin contar dos
+# veces un pedido con varios productos.
+#
+# Checkout e importación agregan solo las celdas de sus pedidos (append en la
+# misma sesión); read_cube() suma las filas repetidas y compacta de vez en
+# cuando. rebuild_cube() lo recalcula desde orders/order_items.
+
+CUBE = "kpi_cube"
+KEYS = ["date", "hour", "branch_id", "product_id", "payment_method"]
+MEASURES = ["orders", "revenue", "quantity", "line_total"]
+ORDER_ROW = 0
+
+def cube_rows(orders: pd.DataFrame, items: pd.DataFrame) -> pd.DataFrame:
+    paid = orders[orders["status"] == "PAID"]
+    if paid.empty:
+        return pd.DataFrame(columns=KEYS + MEASURES)
+    keys = pd.DataFrame({
+        "order_id": paid["order_id"].to_numpy(),
+        "date": paid["order_ts"].dt.normalize().to_numpy(),
+        "hour": paid["order_ts"].dt.hour.to_numpy(),
+        "branch_id": paid["branch_id"].to_numpy(),
+        "payment_method": paid["payment_method"].to_numpy(),
+        "total_amount": paid["total_amount"].to_numpy(),
+    })
+
+    per_order = (
+        keys.assign(product_id=ORDER_ROW)
+            .groupby(KEYS, as_index=False, observed=True)
+            .agg(orders=("order_id", "size"), revenue=("total_amount", "sum"))
+    )
+    lines = items[["order_id", "product_id", "quantity", "line_total"]].merge(
+        keys.drop(columns="total_amount"), on="order_id", how="inner"
+    )
+    per_product = lines.groupby(KEYS, as_index=False, observed=True)[["quantity", "line_total"]].sum()
+
+    out = pd.concat([per_order, per_product], ignore_index=True)
+    out[MEASURES] = out[MEASURES].fillna(0)
+    return out[KEYS + MEASURES]
+
+def rebuild_cube() -> int:
+    out = cube_rows(read_table("orders"), read_table("order_items"))
+    write_table(CUBE, out)
+    return len(out)
+
+def append_orders(session: Session, orders: pd.DataFrame, items: pd.DataFrame) -> None:
+    # si el cubo aún no existe, read_cube() lo construye completo la primera vez
+    if table_columns(CUBE):
+        session.append(CUBE, cube_rows(orders, items))
+
+def add_orders(order_ids, session: Session) -> None:
+    # llamar en la sesión que marca los pedidos PAID (una sola vez por pedido)
+    ids = pd.unique(pd.Series(order_ids, dtype="int64"))
+    append_orders(session, session.rows_in("orders", "order_id", ids), session.rows_in("order_items", "order_id", ids))
+
+def read_cube() -> pd.DataFrame:
+    if not table_columns(CUBE):
+        rebuild_cube()
+    cube = read_table(CUBE)
+    if cube.empty:
+        return cube
+    out = cube.groupby(KEYS, as_index=False, observed=True)[MEASURES].sum()
+    if len(cube) > 2 * len(out):
+        write_table(CUBE, out)
+    return out
+
+def filter_cube(cube: pd.DataFrame, since=None, until=None, branch_ids=None) -> pd.DataFrame:
+    # ventana [since, until] por fecha (ambas inclusive) y sucursales; read_cube()
+    # devuelve las celdas ordenadas por fecha, así que el rango es un slice
+    if since is not None or until is not None:
+        d = cube["date"]
+        lo = None if since is None else pd.Timestamp(since).normalize()
+        hi = None if until is None else pd.Timestamp(until).normalize()
+        if d.is_monotonic_increasing:
+            a = 0 if lo is None else d.searchsorted(lo, side="left")
+            z = len(d) if hi is None else d.searchsorted(hi, side="right")
+            cube = cube.iloc[a:z]
+        else:
+            cube = cube[((d >= lo) if lo is not None else True) & ((d <= hi) if hi is not None else True)]
+    if branch_ids is not None:
+        cube = cube[cube["branch_id"].isin([int(b) for b in branch_ids])]
+    return cube
+
+# ---- vistas de los gráficos (todas leen solo el cubo) ----
+def summary(cube: pd.DataFrame) -> dict:
+    o = cube[cube["product_id"] == ORDER_ROW]
+    n, rev = int(o["orders"].sum()), float(o["revenue"].sum())
+    return {
+        "orders": n,
+        "revenue": rev,
+        "avg_ticket": rev / n if n else 0.0,
+        "branches": int(o.loc[o["orders"] > 0, "branch_id"].nunique()),
+    }
+
+def orders_by_hour(cube: pd.DataFrame) -> pd.Series:
+    o = cube[cube["product_id"] == ORDER_ROW]
+    return o.groupby("hour")["orders"].sum().reindex(range(24), fill_value=0)
+
+def revenue_by_hour(cube: pd.DataFrame) -> pd.Series:
+    o = cube[cube["product_id"] == ORDER_ROW]
+    return o.groupby("hour")["revenue"].sum().reindex(range(24), fill_value=0)
+
+def payment_counts(cube: pd.DataFrame) -> pd.Series:
+    o = cube[cube["product_id"] == ORDER_ROW]
+    pm = o.groupby("payment_method", observed=True)["orders"].sum().sort_values(ascending=False)
+    return pm[pm > 0]
+
+def product_mix(cube: pd.DataFrame, products: pd.DataFrame) -> pd.DataFrame:
+    p = cube[cube["product_id"] != ORDER_ROW].groupby("product_id", as_index=False)[["quantity", "line_total"]].sum()
+    return p.merge(products[["product_id", "food_item", "category"]], on="product_id", how="left")
+
+def top_products(mix: pd.DataFrame, by: str = "quantity", n: int = 10) -> pd.Series:
+    return mix.groupby("food_item")[by].sum().sort_values(ascending=False).head(n)
+
+def category_revenue(mix: pd.DataFrame) -> pd.Series:
+    return mix.groupby("category", observed=True)["line_total"].sum().sort_values(ascending=False)
+
+def main():
+    ap = argparse.ArgumentParser(description="Cubo de KPIs")
+    ap.add_argument("--rebuild", action="store_true", help="reconstruye kpi_cube desde orders/order_items")
+    args = ap.parse_args()
+
+    if args.rebuild:
+        print("Celdas en kpi_cube:", rebuild_cube())
+    cube = read_cube()
+    print(f"Celdas: {len(cube)} | {summary(cube)}" if not cube.empty else "Cubo vacío.")
+
+if __name__ == "__main__":
+    main()
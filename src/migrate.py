@@ -0,0 +1,52 @@
+from __future__ import annotations
+import argparse
+from pathlib import Path
+import pandas as pd
+from .config import TABLE_DIR
+from .storage import set_backend, write_table, read_table, export_csv, get_backend, compact_tables
+
+# Migración única: tables_csv/*.csv -> backend columnar (parquet/feather) o SQLite.
+# Con --export hace el camino inverso (backend actual -> CSV) y con --compact
+# junta las partes que fueron dejando los appends en parquet/feather.
+
+def migrate(src_dir: Path = TABLE_DIR, fmt: str = "parquet") -> list[str]:
+    set_backend(fmt)
+    done = []
+    for p in sorted(Path(src_dir).glob("*.csv")):
+        write_table(p.stem, pd.read_csv(p))
+        done.append(p.stem)
+    return done
+
+def export_all(dst_dir: Path = TABLE_DIR) -> list[str]:
+    names = get_backend().list_tables()
+    for name in names:
+        export_csv(name, Path(dst_dir) / f"{name}.csv")
+    return names
+
+def main():
+    ap = argparse.ArgumentParser(description="Migra tables_csv a un backend columnar o exporta a CSV.")
+    ap.add_argument("--to", default="parquet", choices=["parquet", "feather", "sqlite"])
+    ap.add_argument("--src", default=str(TABLE_DIR))
+    ap.add_argument("--export", action="store_true", help="exportar el backend actual a CSV")
+    ap.add_argument("--compact", action="store_true", help="juntar las partes de las tablas del backend actual")
+    args = ap.parse_args()
+
+    if args.compact:
+        done = compact_tables()
+        for name, n in done.items():
+            print(f"  {name}: {n} partes -> 1")
+        print("✅ Compactación completa:", len(done), "tablas")
+        return
+
+    if args.export:
+        names = export_all(Path(args.src))
+        print("Tablas exportadas a CSV:", len(names))
+        return
+
+    names = migrate(Path(args.src), fmt=args.to)
+    for name in names:
+        print(f"  {name}: {len(read_table(name))} filas -> {args.to}")
+    print("✅ Migración completa:", len(names), "tablas")
+
+if __name__ == "__main__":
+    main()
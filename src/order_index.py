@@ -0,0 +1,225 @@
+from __future__ import annotations
+import argparse
+import os
+import threading
+import numpy as np
+import pandas as pd
+from .config import TABLE_DIR
+from .storage import read_table, table_version, on_table_change
+
+# Índice persistido de orders.order_ts para filtrar ventanas de tiempo sin
+# recorrer todo el histórico.
+#
+# Los pedidos se agrupan por sucursal y, dentro de cada una, se ordenan por
+# order_ts: ts[offsets[i]:offsets[i+1]] son los de branch_ids[i], con su
+# order_id al lado. Una ventana [since, until] se resuelve con dos búsquedas
+# binarias por sucursal. Cubre todos los estados (order_ts no cambia al pagar);
+# el filtro por status se aplica solo a las filas elegidas.
+#
+# Se guarda en tables_csv/_order_ts_index.npz junto con el mayor order_id
+# cubierto; los pedidos nuevos se insertan en su lugar (merge por sucursal) sin
+# reordenar todo.
+#
+# En el proceso se mantiene con el hook de orders: un append inserta sus filas,
+# un update en sitio (p.ej. status) no toca el índice y solo una reescritura lo
+# reconstruye. Si orders cambió sin pasar por el hook (otro proceso), _sync()
+# relee la tabla y agrega lo que falte.
+
+INDEX_PATH = TABLE_DIR / "_order_ts_index.npz"
+NAT = np.iinfo(np.int64).min
+_lock = threading.Lock()
+_state: dict | None = None
+_rewritten = False  # el hook vio una reescritura de orders: no cargar el .npz
+
+def _empty() -> dict:
+    return {
+        "branch_ids": np.zeros(0, dtype=np.int64),
+        "offsets": np.zeros(1, dtype=np.int64),
+        "ts": np.zeros(0, dtype=np.int64),
+        "order_id": np.zeros(0, dtype=np.int64),
+        "max_order_id": 0,
+        "version": None,
+    }
+
+def _ts_ns(s: pd.Series) -> np.ndarray:
+    # ns desde epoch; NaT queda al inicio de cada sucursal y nunca entra en una ventana
+    return s.astype("datetime64[ns]").to_numpy().view(np.int64)
+
+def _build(orders: pd.DataFrame) -> dict:
+    return _merge(_empty(), orders)
+
+def _merge(st: dict, new: pd.DataFrame) -> dict:
+    # inserta pedidos nuevos en el segmento de su sucursal (ya ordenado)
+    if new.empty:
+        return st
+    nb = new["branch_id"].to_numpy().astype(np.int64)
+    nts = _ts_ns(new["order_ts"])
+    nid = new["order_id"].to_numpy().astype(np.int64)
+    order = np.lexsort((nid, nts, nb))
+    nb, nts, nid = nb[order], nts[order], nid[order]
+
+    branches = np.union1d(st["branch_ids"], nb)
+    ts_parts, id_parts, sizes = [], [], []
+    for b in branches:
+        i = np.searchsorted(st["branch_ids"], b)
+        if i < len(st["branch_ids"]) and st["branch_ids"][i] == b:
+            lo, hi = st["offsets"][i], st["offsets"][i + 1]
+            old_ts, old_id = st["ts"][lo:hi], st["order_id"][lo:hi]
+        else:
+            old_ts = old_id = np.zeros(0, dtype=np.int64)
+        a, z = np.searchsorted(nb, b, side="left"), np.searchsorted(nb, b, side="right")
+        add_ts, add_id = nts[a:z], nid[a:z]
+        if len(add_ts) and (len(old_ts) == 0 or add_ts[0] >= old_ts[-1]):
+            seg_ts, seg_id = np.concatenate([old_ts, add_ts]), np.concatenate([old_id, add_id])
+        else:
+            pos = np.searchsorted(old_ts, add_ts, side="right")
+            seg_ts, seg_id = np.insert(old_ts, pos, add_ts), np.insert(old_id, pos, add_id)
+        ts_parts.append(seg_ts)
+        id_parts.append(seg_id)
+        sizes.append(len(seg_ts))
+
+    return {
+        "branch_ids": branches.astype(np.int64),
+        "offsets": np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+        "ts": np.concatenate(ts_parts) if ts_parts else np.zeros(0, dtype=np.int64),
+        "order_id": np.concatenate(id_parts) if id_parts else np.zeros(0, dtype=np.int64),
+        "max_order_id": max(st["max_order_id"], int(nid.max())),
+        "version": st["version"],
+    }
+
+def _save(st: dict) -> None:
+    tmp = INDEX_PATH.with_name(INDEX_PATH.name + ".tmp.npz")
+    np.savez(tmp, branch_ids=st["branch_ids"], offsets=st["offsets"], ts=st["ts"],
+             order_id=st["order_id"], max_order_id=np.int64(st["max_order_id"]))
+    os.replace(tmp, INDEX_PATH)
+
+def _load() -> dict | None:
+    if not INDEX_PATH.exists():
+        return None
+    with np.load(INDEX_PATH) as z:
+        st = {k: z[k] for k in ["branch_ids", "offsets", "ts", "order_id"]}
+        st["max_order_id"] = int(z["max_order_id"])
+    st["version"] = None
+    return st
+
+def _missing(st: dict, orders: pd.DataFrame) -> pd.DataFrame:
+    # filas aún no indexadas (los ids pueden llegar fuera de orden entre sesiones)
+    return orders[~np.isin(orders["order_id"].to_numpy(), st["order_id"])]
+
+def _on_orders(df_new: pd.DataFrame | None, kind: str, before, after) -> None:
+    global _state, _rewritten
+    with _lock:
+        if kind == "rewrite":
+            _state, _rewritten = None, True  # la próxima consulta reconstruye (el .npz ya no sirve)
+            return
+        st = _state
+        if st is None:
+            return
+        fresh = st["version"] is not None and st["version"] == before
+        if df_new is not None and not df_new.empty:
+            new = _missing(st, df_new)
+            if not new.empty:
+                st = _merge(st, new)
+                _save(st)
+        st["version"] = after if fresh else None
+        _state = st
+
+on_table_change("orders", _on_orders, detail=True)
+
+def rebuild_order_index() -> int:
+    global _state, _rewritten
+    orders = read_table("orders")
+    with _lock:
+        st = _build(orders) if not orders.empty else _empty()
+        st["version"] = table_version("orders")
+        _save(st)
+        _state, _rewritten = st, False
+    return len(st["ts"])
+
+def _sync() -> dict:
+    # al día con orders: solo relee la tabla si cambió sin pasar por el hook
+    global _state, _rewritten
+    version = table_version("orders")
+    with _lock:
+        if _state is None and not _rewritten:
+            _state = _load()
+        if _state is not None and _state["version"] == version and version is not None:
+            return _state
+    orders = read_table("orders")
+    with _lock:
+        st = _state
+        if st is None or (not orders.empty and int(orders["order_id"].max()) < st["max_order_id"]):
+            # sin índice, o la tabla se regeneró desde cero
+            st = _build(orders) if not orders.empty else _empty()
+            _save(st)
+            _rewritten = False
+        elif not orders.empty:
+            new = _missing(st, orders)
+            if not new.empty:
+                st = _merge(st, new)
+                _save(st)
+        st["version"] = version
+        _state = st
+        return st
+
+def bounds() -> tuple[pd.Timestamp | None, pd.Timestamp | None]:
+    # primer y último order_ts: están en los extremos de cada segmento (NaT al inicio)
+    st = _sync()
+    lo, hi = [], []
+    for a, z in zip(st["offsets"][:-1], st["offsets"][1:]):
+        seg = st["ts"][a:z]
+        k = np.searchsorted(seg, NAT, side="right")
+        if k < len(seg):
+            lo.append(seg[k])
+            hi.append(seg[-1])
+    if not lo:
+        return None, None
+    return pd.Timestamp(min(lo)), pd.Timestamp(max(hi))
+
+def window_order_ids(since=None, until=None, branch_ids=None) -> np.ndarray:
+    # order_id con since <= order_ts < until + 1 día (fechas inclusive), por sucursal
+    st = _sync()
+    lo_ts = NAT + 1 if since is None else pd.Timestamp(since).normalize().value
+    hi_ts = np.iinfo(np.int64).max if until is None else (pd.Timestamp(until).normalize() + pd.Timedelta(days=1)).value
+    wanted = st["branch_ids"] if branch_ids is None else np.asarray([int(b) for b in branch_ids])
+    parts = []
+    for b in wanted:
+        i = np.searchsorted(st["branch_ids"], b)
+        if i >= len(st["branch_ids"]) or st["branch_ids"][i] != b:
+            continue
+        a, z = st["offsets"][i], st["offsets"][i + 1]
+        seg = st["ts"][a:z]
+        parts.append(st["order_id"][a + np.searchsorted(seg, lo_ts, side="left"):a + np.searchsorted(seg, hi_ts, side="left")])
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+def orders_in_window(orders: pd.DataFrame, since=None, until=None, branch_ids=None) -> pd.DataFrame:
+    # filas de orders dentro de la ventana; sin filtros devuelve la tabla tal cual
+    if since is None and until is None and branch_ids is None:
+        return orders
+    ids = np.sort(window_order_ids(since, until, branch_ids))
+    oid = orders["order_id"].to_numpy()
+    if len(oid) and (oid[1:] >= oid[:-1]).all():
+        # orders va por order_id creciente: posiciones por búsqueda binaria
+        pos = np.searchsorted(oid, ids)
+        ok = pos < len(oid)
+        pos = pos[ok]
+        return orders.iloc[pos[oid[pos] == ids[ok]]]
+    return orders[np.isin(oid, ids)]
+
+def main():
+    ap = argparse.ArgumentParser(description="Índice de orders.order_ts por sucursal")
+    ap.add_argument("--rebuild", action="store_true", help="reconstruye tables_csv/_order_ts_index.npz")
+    ap.add_argument("--since")
+    ap.add_argument("--until")
+    ap.add_argument("--branch", type=int, action="append")
+    args = ap.parse_args()
+
+    if args.rebuild:
+        print("Pedidos indexados:", rebuild_order_index())
+    st = _sync()
+    print("Sucursales:", dict(zip(st["branch_ids"].tolist(), np.diff(st["offsets"]).tolist())), "| rango:", bounds())
+    if args.since or args.until or args.branch:
+        print("Pedidos en la ventana:", len(window_order_ids(args.since, args.until, args.branch)))
+
+if __name__ == "__main__":
+    main()
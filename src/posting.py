@@ -0,0 +1,148 @@
+from __future__ import annotations
+import argparse
+import threading
+import traceback
+from datetime import datetime
+import pandas as pd
+from .config import POSTING_BATCH, POSTING_INTERVAL_S
+from .storage import read_table, reserve_ids
+from .session import Session
+from . import erp, scm
+
+# Cola durable de posteos ERP/SCM (modo asíncrono del checkout).
+#
+# posting_queue es un log de solo-append: checkout agrega un evento PENDING en la
+# misma sesión que marca el pedido PAID, y el worker, al terminar un lote, agrega
+# un evento DONE por pedido en la misma sesión que los asientos y movimientos.
+# Un pedido está pendiente si su último PENDING es posterior a su último DONE.
+#
+# Semántica al-menos-una-vez: si el worker cae antes del commit el lote se
+# reintenta. Se deduplica por order_id: varios eventos del mismo pedido se postean
+# una vez y un pedido que ya tiene asientos en ledger_entries solo se confirma.
+
+def _events(session: Session, order_ids, status: str) -> None:
+    order_ids = [int(o) for o in order_ids]
+    if not order_ids:
+        return
+    start = reserve_ids("posting_queue", "event_id", len(order_ids), start=1)
+    session.append("posting_queue", pd.DataFrame({
+        "event_id": start + pd.RangeIndex(len(order_ids)),
+        "order_id": order_ids,
+        "event_ts": datetime.utcnow().isoformat(),
+        "status": status
+    }))
+
+def enqueue_sale(order_id: int, session: Session) -> None:
+    _events(session, [order_id], "PENDING")
+
+def pending_events() -> pd.DataFrame:
+    # un registro por pedido pendiente: order_id, first_event_id, enqueued_ts
+    q = read_table("posting_queue")
+    if q.empty:
+        return pd.DataFrame(columns=["order_id", "first_event_id", "enqueued_ts"])
+    done = q[q["status"] == "DONE"].groupby("order_id")["event_id"].max().rename("done_id")
+    pend = q[q["status"] == "PENDING"].join(done, on="order_id")
+    pend = pend[pend["event_id"] > pend["done_id"].fillna(-1)]
+    return (
+        pend.groupby("order_id", as_index=False)
+            .agg(first_event_id=("event_id", "min"), enqueued_ts=("event_ts", "min"))
+            .sort_values("first_event_id")
+            .reset_index(drop=True)
+    )
+
+def queue_lag() -> dict:
+    pend = pending_events()
+    if pend.empty:
+        return {"pending": 0, "oldest_ts": None, "lag_seconds": 0.0}
+    oldest = pend["enqueued_ts"].min()
+    return {
+        "pending": int(len(pend)),
+        "oldest_ts": oldest,
+        "lag_seconds": max(0.0, (pd.Timestamp(datetime.utcnow()) - oldest).total_seconds())
+    }
+
+def post_sales(order_ids: list[int], session: Session) -> None:
+    erp.record_sales(order_ids, session=session)
+    scm.apply_sales(order_ids, session=session)
+
+def drain(batch_size: int = POSTING_BATCH, poster=post_sales) -> int:
+    # un lote: todos los pedidos se postean en una sola sesión (una escritura por tabla)
+    pend = pending_events()
+    if pend.empty:
+        return 0
+    order_ids = pend["order_id"].head(batch_size).astype(int).tolist()
+
+    # dedup: pedidos que ya tienen asientos (o que no existen) solo se confirman
+    ledger = read_table("ledger_entries")
+    posted = set(ledger["order_id"].astype(int)) if not ledger.empty else set()
+    known = set(read_table("orders")["order_id"].astype(int))
+    todo = [o for o in order_ids if o not in posted and o in known]
+
+    with Session() as s:
+        poster(todo, s)
+        _events(s, order_ids, "DONE")
+    return len(todo)
+
+def drain_all(batch_size: int = POSTING_BATCH, poster=post_sales) -> int:
+    n = 0
+    while not pending_events().empty:
+        n += drain(batch_size, poster)
+    return n
+
+class PostingWorker(threading.Thread):
+    def __init__(self, interval: float = POSTING_INTERVAL_S, batch_size: int = POSTING_BATCH, poster=post_sales):
+        super().__init__(name="posting-worker", daemon=True)
+        self.interval, self.batch_size, self.poster = interval, batch_size, poster
+        self._halt = threading.Event()
+        self._wake = threading.Event()
+
+    def run(self) -> None:
+        while not self._halt.is_set():
+            try:
+                while drain(self.batch_size, self.poster) and not self._halt.is_set():
+                    pass
+            except Exception:
+                # el lote queda PENDING y se reintenta en la próxima vuelta
+                traceback.print_exc()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._halt.set()
+        self._wake.set()
+        self.join(timeout)
+
+_worker: PostingWorker | None = None
+_worker_lock = threading.Lock()
+
+def start_worker(interval: float = POSTING_INTERVAL_S, batch_size: int = POSTING_BATCH, poster=post_sales) -> PostingWorker:
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = PostingWorker(interval, batch_size, poster)
+            _worker.start()
+    return _worker
+
+def stop_worker(timeout: float | None = None) -> None:
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop(timeout)
+            _worker = None
+
+def main():
+    ap = argparse.ArgumentParser(description="Cola de posteos ERP/SCM")
+    ap.add_argument("--drain", action="store_true", help="postea todo lo pendiente y termina")
+    ap.add_argument("--batch", type=int, default=POSTING_BATCH)
+    args = ap.parse_args()
+
+    if args.drain:
+        print("Pedidos posteados:", drain_all(args.batch))
+    lag = queue_lag()
+    print(f"Pendientes: {lag['pending']} | más antiguo: {lag['oldest_ts']} | retraso: {lag['lag_seconds']:.1f}s")
+
+if __name__ == "__main__":
+    main()
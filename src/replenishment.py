@@ -0,0 +1,113 @@
+from __future__ import annotations
+import argparse
+import time
+from datetime import datetime
+import pandas as pd
+from .config import REPLENISH_INTERVAL_S
+from .storage import reserve_ids
+from .session import Session
+
+# Planificador de reabastecimiento (lote programado, no por venta).
+#
+# Recorre todo inventory de una vez: posición = stock_on_hand + lo pendiente en
+# OCs CREATED. Si la posición queda bajo stock_min se pide
+# max(reorder_qty, stock_min - posición). Las necesidades se agrupan en una OC
+# por (proveedor, sucursal) con una línea por producto, y expected_date sale de
+# suppliers.lead_time_days. Volver a correrlo no duplica: lo ya pedido se descuenta.
+
+KEYS = ["branch_id", "product_id"]
+PLAN_COLUMNS = ["supplier_id", "branch_id", "product_id", "stock_on_hand", "open_qty",
+                "stock_min", "reorder_qty", "qty", "unit_cost", "expected_date"]
+
+def open_po_qty(session: Session) -> pd.DataFrame:
+    # cantidad pendiente por (sucursal, producto) en OCs CREATED
+    po = session.rows("purchase_orders", status="CREATED")
+    if po.empty:
+        return pd.DataFrame(columns=KEYS + ["open_qty"])
+    items = session.rows_in("purchase_order_items", "po_id", po["po_id"]).merge(
+        po[["po_id", "branch_id"]], on="po_id", how="inner"
+    )
+    return items.groupby(KEYS, as_index=False).agg(open_qty=("qty_ordered", "sum"))
+
+def plan_replenishment(session: Session | None = None) -> pd.DataFrame:
+    if session is None:
+        with Session() as s:
+            return plan_replenishment(session=s)
+
+    inv = session.table("inventory")
+    if inv.empty:
+        return pd.DataFrame(columns=PLAN_COLUMNS)
+    plan = inv.merge(open_po_qty(session), on=KEYS, how="left")
+    plan["open_qty"] = plan["open_qty"].fillna(0).astype(int)
+    position = plan["stock_on_hand"] + plan["open_qty"]
+    plan = plan[position < plan["stock_min"]].copy()
+    if plan.empty:
+        return pd.DataFrame(columns=PLAN_COLUMNS)
+
+    shortfall = plan["stock_min"] - (plan["stock_on_hand"] + plan["open_qty"])
+    plan["qty"] = shortfall.where(shortfall > plan["reorder_qty"], plan["reorder_qty"]).astype(int)
+
+    plan = plan.merge(session.table("products")[["product_id", "supplier_id", "unit_cost"]], on="product_id", how="left")
+    plan = plan.merge(session.table("suppliers")[["supplier_id", "lead_time_days"]], on="supplier_id", how="left")
+    plan["supplier_id"] = plan["supplier_id"].fillna(0).astype(int)
+    today = pd.Timestamp(datetime.utcnow()).normalize()
+    lead = pd.to_timedelta(plan["lead_time_days"].fillna(0).astype(int), unit="D")
+    plan["expected_date"] = (today + lead).dt.date.astype(str)
+    return plan.sort_values(["supplier_id", "branch_id", "product_id"])[PLAN_COLUMNS].reset_index(drop=True)
+
+def create_purchase_orders(plan: pd.DataFrame, session: Session) -> pd.DataFrame:
+    # una OC por (proveedor, sucursal); devuelve el plan con su po_id
+    if plan.empty:
+        return plan.assign(po_id=pd.Series(dtype="int64"))
+    groups = plan.groupby(["supplier_id", "branch_id"], sort=True)
+    heads = groups.agg(expected_date=("expected_date", "max")).reset_index()
+
+    now = datetime.utcnow().isoformat()
+    heads["po_id"] = reserve_ids("purchase_orders", "po_id", len(heads), start=1) + pd.RangeIndex(len(heads))
+    plan = plan.merge(heads[["supplier_id", "branch_id", "po_id"]], on=["supplier_id", "branch_id"], how="left")
+    item_id = reserve_ids("purchase_order_items", "po_item_id", len(plan), start=1)
+
+    session.append("purchase_orders", pd.DataFrame({
+        "po_id": heads["po_id"].to_numpy(),
+        "po_ts": now,
+        "supplier_id": heads["supplier_id"].to_numpy(),
+        "branch_id": heads["branch_id"].to_numpy(),
+        "status": "CREATED",
+        "expected_date": heads["expected_date"].to_numpy()
+    }))
+    session.append("purchase_order_items", pd.DataFrame({
+        "po_item_id": item_id + pd.RangeIndex(len(plan)),
+        "po_id": plan["po_id"].to_numpy(),
+        "product_id": plan["product_id"].to_numpy(),
+        "qty_ordered": plan["qty"].to_numpy(),
+        "unit_cost_est": plan["unit_cost"].fillna(0.0).to_numpy()
+    }))
+    return plan
+
+def run_replenishment(session: Session | None = None) -> pd.DataFrame:
+    if session is None:
+        with Session() as s:
+            return run_replenishment(session=s)
+    return create_purchase_orders(plan_replenishment(session), session)
+
+def main():
+    ap = argparse.ArgumentParser(description="Planificador de reabastecimiento")
+    ap.add_argument("--dry-run", action="store_true", help="muestra el plan sin crear OCs")
+    ap.add_argument("--every", type=float, nargs="?", const=REPLENISH_INTERVAL_S, metavar="SEG",
+                    help=f"repite cada SEG segundos (por defecto {REPLENISH_INTERVAL_S:g})")
+    args = ap.parse_args()
+
+    while True:
+        if args.dry_run:
+            plan = plan_replenishment()
+            print(plan.to_string(index=False) if not plan.empty else "Nada que pedir.")
+        else:
+            plan = run_replenishment()
+            n_po = plan["po_id"].nunique() if not plan.empty else 0
+            print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] OCs creadas: {n_po} | líneas: {len(plan)}")
+        if args.every is None:
+            break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+import matplotlib
+matplotlib.use("Agg")  # antes de importar pyplot: sin ventanas ni plt.show()
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import matplotlib.pyplot as plt
+import pandas as pd
+from .config import FIG_DIR
+from .storage import read_table
+from .kpi_cube import read_cube, filter_cube, summary
+from .charts import KPI_CHARTS, RFM_CHARTS, kpi_series
+from .rfm import paid_orders, compute_rfm
+from .order_index import orders_in_window
+
+# Reporte de KPIs/RFM no interactivo (servidores sin pantalla, corridas nocturnas).
+#
+# Las tablas se leen una vez y las agregaciones se calculan una vez por alcance
+# (todas las sucursales o una); solo el dibujo de las figuras se reparte en un
+# pool de procesos. Cada alcance deja sus PNG y un JSON con los números en
+# FIG_DIR/report_<alcance>/.
+
+def _numbers(s: pd.Series) -> dict:
+    return {str(k): (float(v) if isinstance(v, float) else int(v)) for k, v in s.items()}
+
+def compute_report(cube, products, orders, customers, since=None, until=None, branch_ids=None) -> tuple[dict, dict]:
+    # (números para el JSON, datos de cada figura por id)
+    cube = filter_cube(cube, since, until, branch_ids)
+    paid = paid_orders(orders_in_window(orders, since, until, branch_ids))
+    rfm = compute_rfm(paid, customers)
+
+    series = kpi_series(cube, products)
+    rfm_data = rfm[["segmento", "recency_days", "frequency", "monetary"]]
+    data = {**series, **{chart_id: rfm_data for chart_id in RFM_CHARTS}}
+
+    numbers = {
+        "window": {"since": None if since is None else str(since), "until": None if until is None else str(until)},
+        "branches": None if branch_ids is None else [int(b) for b in branch_ids],
+        "summary": {**summary(cube), "customers": int(paid["customer_id"].nunique())},
+        **{chart_id: _numbers(s) for chart_id, s in series.items()},
+        "rfm": {
+            "customers": int(len(rfm)),
+            "segments": _numbers(rfm["segmento"].value_counts()),
+            "avg_recency_days": float(rfm["recency_days"].mean()) if not rfm.empty else 0.0,
+            "avg_frequency": float(rfm["frequency"].mean()) if not rfm.empty else 0.0,
+            "avg_monetary": float(rfm["monetary"].mean()) if not rfm.empty else 0.0,
+        },
+    }
+    return numbers, data
+
+def _render(job: tuple[str, object, str]) -> str:
+    # corre en el pool: solo dibuja y guarda
+    chart_id, data, path = job
+    build = {**KPI_CHARTS, **RFM_CHARTS}[chart_id][1]
+    fig = build(data)
+    fig.savefig(path, dpi=160, bbox_inches="tight")
+    plt.close(fig)
+    return path
+
+def build_reports(scopes: list[list[int] | None], since=None, until=None,
+                  out_dir: Path = FIG_DIR, workers: int | None = None) -> list[Path]:
+    cube = read_cube()
+    products = read_table("products")
+    orders = read_table("orders")
+    customers = read_table("customers")
+
+    jobs, outputs = [], []
+    for branch_ids in scopes:
+        tag = "todas" if branch_ids is None else "sucursal_" + "_".join(str(b) for b in branch_ids)
+        folder = Path(out_dir) / f"report_{tag}"
+        folder.mkdir(parents=True, exist_ok=True)
+
+        numbers, data = compute_report(cube, products, orders, customers, since, until, branch_ids)
+        numbers["generated_at"] = datetime.utcnow().isoformat()
+        numbers["figures"] = {}
+        for chart_id, d in data.items():
+            if len(d) == 0:
+                continue
+            path = folder / f"{chart_id}.png"
+            numbers["figures"][chart_id] = path.name
+            jobs.append((chart_id, d, str(path)))
+
+        out = folder / "report.json"
+        out.write_text(json.dumps(numbers, ensure_ascii=False, indent=2), encoding="utf-8")
+        outputs.append(out)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_render, jobs))
+    return outputs
+
+def main():
+    ap = argparse.ArgumentParser(description="Reporte de KPIs y RFM (sin pantalla, en paralelo)")
+    ap.add_argument("--since", help="fecha inicial (inclusive), p.ej. 2026-01-01")
+    ap.add_argument("--until", help="fecha final (inclusive)")
+    ap.add_argument("--branch", type=int, action="append", help="una sucursal; se puede repetir (un reporte por sucursal)")
+    ap.add_argument("--per-branch", action="store_true", help="un reporte por cada sucursal además del total")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--out", default=str(FIG_DIR))
+    args = ap.parse_args()
+
+    if args.per_branch:
+        scopes = [None] + [[int(b)] for b in read_table("branches")["branch_id"]]
+    elif args.branch:
+        scopes = [[b] for b in args.branch]
+    else:
+        scopes = [None]
+
+    t0 = time.perf_counter()
+    outputs = build_reports(scopes, args.since, args.until, Path(args.out), args.workers)
+    for p in outputs:
+        print("✅", p)
+    print(f"{len(outputs)} reporte(s) en {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+# Segmentación RFM (Recency, Frequency, Monetary) de clientes con ventas pagadas.
+# La usan la pestaña RFM de APP.py y el reporte headless (src/report.py).
+
+COLUMNS = ["customer_id", "customer_name", "recency_days", "frequency", "monetary",
+           "segmento", "R", "F", "M", "RFM", "rfm_score_total"]
+
+def paid_orders(orders: pd.DataFrame) -> pd.DataFrame:
+    return orders[(orders["status"] == "PAID") & orders["order_ts"].notna()]
+
+def qscore(series: pd.Series, bins: int = 5, reverse: bool = False) -> pd.Series:
+    # scoring robusto (qcut a veces falla con pocos datos)
+    s = pd.to_numeric(series, errors="coerce").fillna(0)
+    # rank para evitar empates exactos en qcut
+    r = s.rank(method="first")
+
+    b = min(bins, int(r.nunique())) if int(r.nunique()) > 0 else 1
+    if b == 1:
+        score = pd.Series([1] * len(r), index=r.index)
+    else:
+        try:
+            score = pd.qcut(r, q=b, labels=list(range(1, b + 1)))
+            score = score.astype(int)
+        except Exception:
+            # fallback simple si qcut se pone pesado
+            score = pd.Series(pd.cut(r, bins=b, labels=list(range(1, b + 1)), include_lowest=True)).astype(int)
+
+    if reverse:
+        score = (b + 1) - score  # recency: menor recency => mejor score
+    return score
+
+def segment(R: pd.Series, F: pd.Series, M: pd.Series) -> np.ndarray:
+    # mismas reglas que la leyenda de la pestaña RFM, en orden de prioridad
+    rules = [
+        (R >= 4) & (F >= 4) & (M >= 4),
+        (R >= 4) & (F >= 3),
+        (R >= 4) & (F <= 2),
+        (R <= 2) & (F >= 3),
+        (R <= 2) & (F <= 2),
+        (M >= 4) & (R >= 3),
+    ]
+    names = ["Campeones", "Leales", "Nuevos", "En riesgo", "Dormidos", "Alto gasto"]
+    return np.select(rules, names, default="Otros")
+
+def compute_rfm(paid: pd.DataFrame, customers: pd.DataFrame, bins: int = 5) -> pd.DataFrame:
+    if paid.empty:
+        return pd.DataFrame(columns=COLUMNS)
+
+    # Fecha de referencia (snapshot) -> para recency
+    snapshot = paid["order_ts"].max() + pd.Timedelta(days=1)
+    rfm = (
+        paid.groupby("customer_id")
+        .agg(last_ts=("order_ts", "max"), frequency=("order_id", "nunique"), monetary=("total_amount", "sum"))
+        .reset_index()
+    )
+    rfm["recency_days"] = (snapshot - rfm.pop("last_ts")).dt.days.astype(int)
+
+    # Join con nombres de clientes (si existe)
+    if not customers.empty and "customer_name" in customers.columns:
+        rfm = rfm.merge(customers[["customer_id", "customer_name"]], on="customer_id", how="left")
+    else:
+        rfm["customer_name"] = None
+
+    rfm["R"] = qscore(rfm["recency_days"], bins=bins, reverse=True)
+    rfm["F"] = qscore(rfm["frequency"], bins=bins)
+    rfm["M"] = qscore(rfm["monetary"], bins=bins)
+    rfm["RFM"] = rfm["R"].astype(str) + rfm["F"].astype(str) + rfm["M"].astype(str)
+    rfm["rfm_score_total"] = rfm["R"] + rfm["F"] + rfm["M"]
+    rfm["segmento"] = segment(rfm["R"], rfm["F"], rfm["M"])
+
+    return rfm[COLUMNS].sort_values(["segmento", "rfm_score_total"], ascending=[True, False]).reset_index(drop=True)
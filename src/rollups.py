@@ -0,0 +1,141 @@
+from __future__ import annotations
+import argparse
+import pandas as pd
+from .storage import read_table, write_table, append_table, get_rows, get_rows_in, table_columns, table_version, on_table_change
+
+# Rollup materializado del ERP: ledger_daily = día × sucursal × entry_type
+# (suma de montos y número de asientos). Cada append a ledger_entries agrega
+# aquí solo el agregado de las filas nuevas; si ledger_entries se reescribe, el
+# rollup se reconstruye. Las vistas P&L leen este rollup, no el libro completo.
+#
+# Es de solo-append: varios lotes pueden dejar filas repetidas para el mismo
+# (día, sucursal, tipo); read_rollup() las suma y compacta de vez en cuando.
+#
+# El append del rollup ocurre después del commit del libro y puede fallar (o el
+# proceso caer entre ambos). Cada fila guarda max_entry_id, el último asiento
+# que incluye: read_rollup() compara esa marca y el conteo de asientos con el
+# libro y agrega lo que falte (o reconstruye si no cuadra). La comparación se
+# hace una vez por proceso y después solo si el libro cambió sin pasar por el
+# hook (otro proceso) o si un append del hook falló.
+
+ROLLUP = "ledger_daily"
+KEYS = ["day", "branch_id", "entry_type"]
+_synced = None  # versión de ledger_entries que el rollup ya refleja (None: sin verificar)
+
+def _branches(order_ids: pd.Series) -> pd.DataFrame:
+    ids = order_ids.drop_duplicates()
+    if len(ids) <= 32:
+        # pocos pedidos (checkout): búsqueda por clave, indexada en SQLite
+        parts = [get_rows("orders", order_id=int(o))[["order_id", "branch_id"]] for o in ids]
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["order_id", "branch_id"])
+    return read_table("orders")[["order_id", "branch_id"]]
+
+def _aggregate(entries: pd.DataFrame) -> pd.DataFrame:
+    e = entries.merge(_branches(entries["order_id"]), on="order_id", how="left")
+    e["branch_id"] = e["branch_id"].fillna(0).astype(int)
+    e["day"] = e["entry_ts"].dt.normalize()
+    return (
+        e.groupby(KEYS, as_index=False, observed=True)
+         .agg(amount=("amount", "sum"), entries=("entry_id", "size"), max_entry_id=("entry_id", "max"))
+    )
+
+def rebuild_ledger_rollup() -> int:
+    global _synced
+    version = table_version("ledger_entries")
+    ledger = read_table("ledger_entries")
+    out = _aggregate(ledger) if not ledger.empty else pd.DataFrame(columns=KEYS + ["amount", "entries", "max_entry_id"])
+    write_table(ROLLUP, out)
+    _synced = version
+    return len(out)
+
+def _current() -> bool:
+    return "max_entry_id" in table_columns(ROLLUP)
+
+def _on_ledger_change(df_new: pd.DataFrame | None) -> None:
+    global _synced
+    if df_new is None or not _current():
+        # libro reescrito, o rollup aún no creado / sin marca (incluye el histórico)
+        rebuild_ledger_rollup()
+        return
+    try:
+        append_table(ROLLUP, _aggregate(df_new))
+    except Exception:
+        _synced = None  # read_rollup() revisará la marca contra el libro
+        raise
+    if _synced is not None:
+        _synced = table_version("ledger_entries")
+
+on_table_change("ledger_entries", _on_ledger_change)
+
+def _catch_up(roll: pd.DataFrame) -> bool:
+    # agrega los asientos posteriores a la marca; True si el rollup cambió
+    global _synced
+    version = table_version("ledger_entries")
+    ledger = read_table("ledger_entries")
+    mark = int(roll["max_entry_id"].max()) if not roll.empty else 0
+    missing = ledger[ledger["entry_id"] > mark]
+    if int(roll["entries"].sum()) + len(missing) != len(ledger):
+        rebuild_ledger_rollup()
+        return True
+    if not missing.empty:
+        append_table(ROLLUP, _aggregate(missing))
+    _synced = version
+    return not missing.empty
+
+def read_rollup() -> pd.DataFrame:
+    if not _current():
+        rebuild_ledger_rollup()
+    roll = read_table(ROLLUP)
+    if table_version("ledger_entries") != _synced and _catch_up(roll):
+        roll = read_table(ROLLUP)
+    if roll.empty:
+        return roll
+    out = roll.groupby(KEYS, as_index=False, observed=True).agg(
+        amount=("amount", "sum"), entries=("entries", "sum"), max_entry_id=("max_entry_id", "max"))
+    if len(roll) > 2 * len(out):
+        write_table(ROLLUP, out)
+    return out
+
+def pnl(freq: str = "D", by_branch: bool = False) -> pd.DataFrame:
+    # revenue, cogs y margen bruto por periodo (D/W/M) [y sucursal]
+    roll = read_rollup()
+    cols = ["period"] + (["branch_id"] if by_branch else []) + ["revenue", "cogs", "gross_margin", "margin_pct"]
+    if roll.empty:
+        return pd.DataFrame(columns=cols)
+    roll["period"] = roll["day"].dt.to_period(freq).dt.start_time
+    idx = ["period"] + (["branch_id"] if by_branch else [])
+    t = roll.pivot_table(index=idx, columns="entry_type", values="amount", aggfunc="sum", observed=True, fill_value=0.0)
+    t = t.reindex(columns=["REVENUE", "COGS"], fill_value=0.0).reset_index()
+    t = t.rename(columns={"REVENUE": "revenue", "COGS": "cogs"}).rename_axis(columns=None)
+    t["gross_margin"] = t["revenue"] - t["cogs"]
+    t["margin_pct"] = (t["gross_margin"] / t["revenue"].where(t["revenue"] != 0)).fillna(0.0)
+    return t[cols]
+
+def trial_balance() -> pd.DataFrame:
+    # saldos por cuenta (entry_type)
+    roll = read_rollup()
+    if roll.empty:
+        return pd.DataFrame(columns=["entry_type", "amount", "entries"])
+    return roll.groupby("entry_type", as_index=False, observed=True)[["amount", "entries"]].sum()
+
+def last_entries(n: int = 10) -> pd.DataFrame:
+    # últimos n asientos por entry_id a partir de la marca del rollup, sin leer el
+    # libro completo (la ventana es más ancha por si quedaron ids sin usar)
+    roll = read_rollup()
+    if roll.empty:
+        return pd.DataFrame()
+    mark = int(roll["max_entry_id"].max())
+    last = get_rows_in("ledger_entries", "entry_id", range(max(1, mark - 4 * n + 1), mark + 1))
+    return last.sort_values("entry_id").tail(n).reset_index(drop=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="Rollups del ERP")
+    ap.add_argument("--rebuild", action="store_true", help="reconstruye ledger_daily desde ledger_entries")
+    args = ap.parse_args()
+
+    if args.rebuild:
+        print("Filas en ledger_daily:", rebuild_ledger_rollup())
+    print(trial_balance().to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,35 @@
 from __future__ import annotations
-from .config import RAW_PATH, SEED
-from .etl import load_orders_csv
+from .config import RAW_PATH, SEED, RAW_CHUNK_ROWS
+from .etl import iter_orders_csv, profile_orders, merge_profiles
 from .seed_master import seed_and_save
 from . import tps
 from .kpis import run_kpis
+from .storage import read_table
 
 def main():
     if not RAW_PATH.exists():
         raise FileNotFoundError(f"No encuentro {RAW_PATH}. Coloca restaurant_orders.csv en la raíz o cambia RAW_PATH en config.py")
 
-    df_raw = load_orders_csv(RAW_PATH)
+    # el export crudo se lee por bloques de RAW_CHUNK_ROWS filas: una pasada
+    # para el perfil de productos y otra para importar, con memoria constante
+    print("Perfilando", RAW_PATH)
+    profile = merge_profiles(profile_orders(ch) for ch in iter_orders_csv(RAW_PATH, RAW_CHUNK_ROWS))
 
     # 1) crear tablas + 2) sembrar maestros sintéticos
     tps.init_tables()
-    seed_and_save(df_raw, seed=SEED)
+    seed_and_save(profile=profile, seed=SEED)
 
     # 3) importar transacciones reales
-    n = tps.import_real_transactions(df_raw)
+    print("Importando", RAW_PATH)
+    n = tps.import_real_file(RAW_PATH, RAW_CHUNK_ROWS)
     print("Órdenes reales importadas:", n)
 
     # 4) demo TPS nuevo -> ERP+SCM
-    products = __import__("pandas").read_csv("tables_csv/products.csv")
+    products = read_table("products")
     sample = products.sample(3, random_state=SEED)["product_id"].tolist()
 
     oid = tps.create_order("Cliente Demo", branch_id=1, payment_method="Cash")
-    tps.add_item(oid, int(sample[0]), 2)
-    tps.add_item(oid, int(sample[1]), 1)
-    tps.add_item(oid, int(sample[2]), 3)
+    tps.add_items(oid, [(int(sample[0]), 2), (int(sample[1]), 1), (int(sample[2]), 3)])
     result = tps.checkout(oid)
     print("✅ Pedido demo pagado:", result)
 
@@ -0,0 +1,221 @@
+from __future__ import annotations
+import pandas as pd
+
+# Claves de cada tabla: se usan para búsquedas puntuales (storage.get_row /
+# update_rows) y como índices reales en el backend SQLite.
+PRIMARY_KEYS: dict[str, list[str]] = {
+    "customers": ["customer_id"],
+    "branches": ["branch_id"],
+    "suppliers": ["supplier_id"],
+    "products": ["product_id"],
+    "inventory": ["branch_id", "product_id"],
+    "orders": ["order_id"],
+    "order_items": ["order_item_id"],
+    "ledger_entries": ["entry_id"],
+    "stock_movements": ["movement_id"],
+    "purchase_orders": ["po_id"],
+    "purchase_order_items": ["po_item_id"],
+    "posting_queue": ["event_id"],
+    "inventory_checkpoints": ["snapshot_id"],
+}
+
+# Índices secundarios (claves foráneas más consultadas).
+INDEXES: dict[str, list[list[str]]] = {
+    "orders": [["status"]],
+    "order_items": [["order_id"]],
+    "ledger_entries": [["order_id"]],
+    "stock_movements": [["branch_id", "product_id"], ["ref_order_id"]],
+    "purchase_orders": [["status"]],
+    "purchase_order_items": [["po_id"]],
+    "products": [["supplier_id"]],
+    "posting_queue": [["order_id"]],
+    "inventory_snapshots": [["snapshot_id"], ["branch_id", "product_id"]],
+}
+
+# ====== Tipos por columna ======
+# (dtype, default). read_table aplica estos tipos una sola vez al parsear, así
+# que los llamadores ya no necesitan pd.to_numeric(...).fillna(...).astype(...).
+# dtype: "int8"/"int32" (NaN -> default), "Int32" (entero con nulos), "float64",
+# "str", "category", "datetime".
+TABLES: dict[str, dict[str, tuple[str, object]]] = {
+    "customers": {
+        "customer_id": ("int32", 0),
+        "customer_name": ("str", None),
+        "created_at": ("datetime", None),
+    },
+    "branches": {
+        "branch_id": ("int32", 0),
+        "branch_name": ("str", None),
+        "city": ("category", None),
+    },
+    "suppliers": {
+        "supplier_id": ("int32", 0),
+        "supplier_name": ("str", None),
+        "lead_time_days": ("int32", 0),
+        "contact_email": ("str", None),
+    },
+    "products": {
+        "product_id": ("int32", 0),
+        "food_item": ("str", None),
+        "category": ("category", None),
+        "sale_price": ("float64", 0.0),
+        "unit_cost": ("float64", 0.0),
+        "supplier_id": ("int32", 0),
+        "is_active": ("int8", 1),
+    },
+    "inventory": {
+        "branch_id": ("int32", 0),
+        "product_id": ("int32", 0),
+        "stock_on_hand": ("int32", 0),
+        "stock_min": ("int32", 0),
+        "reorder_qty": ("int32", 0),
+    },
+    "orders": {
+        "order_id": ("int32", 0),
+        "customer_id": ("int32", 0),
+        "branch_id": ("int32", 0),
+        "order_ts": ("datetime", None),
+        "status": ("category", None),
+        "payment_method": ("category", "Desconocido"),
+        "total_amount": ("float64", 0.0),
+        "is_synthetic": ("int8", 0),
+    },
+    "order_items": {
+        "order_item_id": ("int32", 0),
+        "order_id": ("int32", 0),
+        "product_id": ("int32", 0),
+        "quantity": ("int32", 0),
+        "unit_price": ("float64", 0.0),
+        "line_total": ("float64", 0.0),
+    },
+    "ledger_entries": {
+        "entry_id": ("int32", 0),
+        "entry_ts": ("datetime", None),
+        "order_id": ("int32", 0),
+        "entry_type": ("category", None),
+        "amount": ("float64", 0.0),
+        "note": ("str", None),
+    },
+    "stock_movements": {
+        "movement_id": ("int32", 0),
+        "movement_ts": ("datetime", None),
+        "branch_id": ("int32", 0),
+        "product_id": ("int32", 0),
+        "qty_change": ("int32", 0),
+        "reason": ("category", None),
+        "ref_order_id": ("Int32", None),
+        "ref_po_id": ("Int32", None),
+    },
+    "purchase_orders": {
+        "po_id": ("int32", 0),
+        "po_ts": ("datetime", None),
+        "supplier_id": ("int32", 0),
+        "branch_id": ("int32", 0),
+        "status": ("category", None),
+        "expected_date": ("str", None),
+        "received_ts": ("datetime", None),
+    },
+    "purchase_order_items": {
+        "po_item_id": ("int32", 0),
+        "po_id": ("int32", 0),
+        "product_id": ("int32", 0),
+        "qty_ordered": ("int32", 0),
+        "unit_cost_est": ("float64", 0.0),
+    },
+    "ledger_daily": {
+        "day": ("datetime", None),
+        "branch_id": ("int32", 0),
+        "entry_type": ("category", None),
+        "amount": ("float64", 0.0),
+        "entries": ("int32", 0),
+        "max_entry_id": ("int32", 0),
+    },
+    "posting_queue": {
+        "event_id": ("int32", 0),
+        "order_id": ("int32", 0),
+        "event_ts": ("datetime", None),
+        "status": ("category", None),
+    },
+    "kpi_cube": {
+        "date": ("datetime", None),
+        "hour": ("int8", 0),
+        "branch_id": ("int32", 0),
+        "product_id": ("int32", 0),
+        "payment_method": ("category", None),
+        "orders": ("int32", 0),
+        "revenue": ("float64", 0.0),
+        "quantity": ("int32", 0),
+        "line_total": ("float64", 0.0),
+    },
+    "inventory_checkpoints": {
+        "snapshot_id": ("int32", 0),
+        "snapshot_ts": ("datetime", None),
+        "last_movement_id": ("int32", 0),
+        "rows": ("int32", 0),
+    },
+    "inventory_snapshots": {
+        "snapshot_id": ("int32", 0),
+        "branch_id": ("int32", 0),
+        "product_id": ("int32", 0),
+        "stock_on_hand": ("int32", 0),
+    },
+}
+
+# Valores conocidos de las columnas categóricas: siempre forman parte de las
+# categorías, así asignar p.ej. status="PAID" nunca cae fuera del dtype.
+CATEGORIES: dict[tuple[str, str], list[str]] = {
+    ("orders", "status"): ["OPEN", "PAID", "CANCELLED"],
+    ("orders", "payment_method"): ["Cash", "Card", "Transfer", "Desconocido"],
+    ("kpi_cube", "payment_method"): ["Cash", "Card", "Transfer", "Desconocido"],
+    ("ledger_entries", "entry_type"): ["REVENUE", "COGS"],
+    ("ledger_daily", "entry_type"): ["REVENUE", "COGS"],
+    ("stock_movements", "reason"): ["SALE", "RECEIVED", "ADJUST"],
+    ("purchase_orders", "status"): ["CREATED", "RECEIVED", "CANCELLED"],
+    ("posting_queue", "status"): ["PENDING", "DONE"],
+}
+
+
+def csv_dtypes(name: str) -> dict[str, str]:
+    # tipos que read_csv puede aplicar directamente al parsear
+    return {c: "category" for c, (dt, _) in TABLES.get(name, {}).items() if dt == "category"}
+
+
+def _category(name: str, col: str, s: pd.Series) -> pd.Series:
+    known = CATEGORIES.get((name, col), [])
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        observed = [c for c in s.cat.categories if c not in known]
+    else:
+        observed = sorted(str(v) for v in s.dropna().unique() if str(v) not in known)
+    cats = known + [c for c in observed if c not in known]
+    if isinstance(s.dtype, pd.CategoricalDtype) and list(s.cat.categories) == cats:
+        return s
+    return s.astype(object).where(s.notna(), None).astype(pd.CategoricalDtype(cats))
+
+
+def apply_schema(name: str, df: pd.DataFrame) -> pd.DataFrame:
+    cols = TABLES.get(name)
+    if not cols or len(df.columns) == 0:
+        return df
+    out = df.copy(deep=False)
+    for col, (dtype, default) in cols.items():
+        if col not in out.columns:
+            out[col] = default
+        s = out[col]
+        if dtype == "Int32":
+            if str(s.dtype) != dtype:
+                out[col] = pd.to_numeric(s, errors="coerce").astype("Int32")
+        elif dtype.startswith("int"):
+            if str(s.dtype) != dtype:
+                out[col] = pd.to_numeric(s, errors="coerce").fillna(default or 0).astype(dtype)
+        elif dtype == "float64":
+            if str(s.dtype) != dtype:
+                s = pd.to_numeric(s, errors="coerce").astype("float64")
+            out[col] = s if default is None else s.fillna(default)
+        elif dtype == "datetime":
+            if not pd.api.types.is_datetime64_any_dtype(s):
+                out[col] = pd.to_datetime(s, errors="coerce", format="ISO8601")
+        elif dtype == "category":
+            if default is not None and s.isna().any():
+                s = s.astype(object).fillna(default)
+            out[col] = _category(name, col, s)
+    return out
@@ -1,81 +1,178 @@
 from __future__ import annotations
-from datetime import datetime, timedelta
+from datetime import datetime
 import pandas as pd
-from .storage import read_table, write_table, append_table, next_id
-
-def apply_sale(order_id: int):
-    orders = read_table("orders")
-    items = read_table("order_items")
-    inv = read_table("inventory")
-    prod = read_table("products")
-    supp = read_table("suppliers")
-
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    orow = orders[orders["order_id"] == int(order_id)]
-    if orow.empty:
+from .storage import reserve_ids
+from .session import Session
+
+INV_KEYS = ["branch_id", "product_id"]
+
+def decrement_stock(session: Session, lines: pd.DataFrame) -> pd.DataFrame:
+    # lines: branch_id, product_id, quantity (puede repetir claves). Resta agrupada
+    # por (branch_id, product_id) guardada como delta por clave: el commit la aplica
+    # sobre el stock vigente (en sitio si inventory es la matriz densa).
+    # Devuelve una fila por clave tocada con stock_on_hand ya descontado.
+    need = lines.groupby(INV_KEYS, as_index=False)["quantity"].sum()
+    cur = session.lookup("inventory", INV_KEYS, need)
+    need = need.merge(cur[INV_KEYS + ["stock_on_hand", "stock_min", "reorder_qty"]], on=INV_KEYS)
+    if need.empty:
+        return need
+
+    session.increment("inventory", INV_KEYS, need[INV_KEYS].assign(stock_on_hand=-need["quantity"].to_numpy()))
+    return need.assign(stock_on_hand=need["stock_on_hand"] - need["quantity"])
+
+def apply_sale(order_id: int, session: Session | None = None):
+    apply_sales([order_id], session=session)
+
+def apply_sales(order_ids, session: Session | None = None) -> pd.DataFrame:
+    # todas las líneas de uno o varios pedidos: una resta agrupada, un append de
+    # movimientos y una sola comparación contra stock_min. Devuelve los bajo mínimo.
+    if session is None:
+        with Session() as s:
+            return apply_sales(order_ids, session=s)
+
+    ids = pd.unique(pd.Series(order_ids, dtype="int64"))
+    orders = session.rows_in("orders", "order_id", ids)
+    if len(orders["order_id"].unique()) < len(ids):
         raise ValueError("Order not found")
-    branch_id = int(orow["branch_id"].iloc[0])
 
-    items["order_id"] = pd.to_numeric(items["order_id"], errors="coerce")
-    oitems = items[items["order_id"] == int(order_id)]
-    if oitems.empty:
-        return
+    items = session.rows_in("order_items", "order_id", ids).merge(
+        orders[["order_id", "branch_id"]].drop_duplicates("order_id"), on="order_id", how="left"
+    )
+    if items.empty:
+        return items
+
+    touched = decrement_stock(session, items)
+    # solo hay movimiento para líneas con fila de inventario
+    lines = items.merge(touched[INV_KEYS], on=INV_KEYS, how="inner")
+
+    now = datetime.utcnow().isoformat()
+    mov_id = reserve_ids("stock_movements", "movement_id", len(lines), start=1)
+    session.append("stock_movements", pd.DataFrame({
+        "movement_id": mov_id + pd.RangeIndex(len(lines)),
+        "movement_ts": now,
+        "branch_id": lines["branch_id"].to_numpy(),
+        "product_id": lines["product_id"].to_numpy(),
+        "qty_change": -lines["quantity"].to_numpy(),
+        "reason": "SALE",
+        "ref_order_id": lines["order_id"].to_numpy(),
+        "ref_po_id": pd.NA
+    }))
+
+    # las OCs ya no se crean por venta: las arma el planificador por lotes
+    # (src/replenishment.py), que descuenta lo ya pedido y consolida por proveedor
+    return touched[touched["stock_on_hand"] < touched["stock_min"]].reset_index(drop=True)
+
+def increment_stock(session: Session, lines: pd.DataFrame, stock_min: int = 10, reorder_qty: int = 20) -> pd.DataFrame:
+    # suma agrupada por (branch_id, product_id); las claves sin fila en inventory
+    # se crean con mínimos por defecto. Devuelve las claves tocadas y el stock final.
+    add = lines.groupby(INV_KEYS, as_index=False)["quantity"].sum()
+    cur = add[INV_KEYS].merge(session.lookup("inventory", INV_KEYS, add)[INV_KEYS + ["stock_on_hand"]],
+                              on=INV_KEYS, how="left")
+    hit = cur["stock_on_hand"].notna().to_numpy()
 
-    # normalizar tipos
-    for c in ["branch_id","product_id","stock_on_hand","stock_min","reorder_qty"]:
-        inv[c] = pd.to_numeric(inv[c], errors="coerce").fillna(0).astype(int)
+    session.increment("inventory", INV_KEYS, add[hit][INV_KEYS].assign(stock_on_hand=add["quantity"].to_numpy()[hit]))
 
+    new = add[~hit]
+    if not new.empty:
+        session.append("inventory", pd.DataFrame({
+            "branch_id": new["branch_id"].to_numpy(),
+            "product_id": new["product_id"].to_numpy(),
+            "stock_on_hand": new["quantity"].to_numpy(),
+            "stock_min": stock_min,
+            "reorder_qty": reorder_qty
+        }))
+
+    final = add["quantity"].to_numpy().copy()
+    final[hit] += cur["stock_on_hand"].to_numpy()[hit].astype(final.dtype)
+    return add[INV_KEYS].assign(received=add["quantity"].to_numpy(), stock_on_hand=final)
+
+def set_stock(lines: pd.DataFrame, session: Session | None = None, stock_min: int = 10, reorder_qty: int = 20) -> pd.DataFrame:
+    # ajuste manual: lines trae branch_id, product_id, stock_on_hand (absoluto) y
+    # opcionalmente stock_min/reorder_qty. La diferencia contra el stock actual
+    # queda como movimiento ADJUST, así inventory siempre cuadra con stock_movements.
+    if session is None:
+        with Session() as s:
+            return set_stock(lines, session=s, stock_min=stock_min, reorder_qty=reorder_qty)
+
+    lines = lines.drop_duplicates(INV_KEYS, keep="last").reset_index(drop=True)
+    cur = lines[INV_KEYS].merge(session.lookup("inventory", INV_KEYS, lines)[INV_KEYS + ["stock_on_hand"]],
+                                on=INV_KEYS, how="left")
+    hit = cur["stock_on_hand"].notna().to_numpy()
+
+    target = lines["stock_on_hand"].to_numpy().astype(int)
+    before = cur["stock_on_hand"].fillna(0).to_numpy().astype(int)
+    # el stock se ajusta por la diferencia vista (igual que el movimiento ADJUST);
+    # los mínimos se asignan tal cual
+    session.increment("inventory", INV_KEYS, lines[hit][INV_KEYS].assign(stock_on_hand=(target - before)[hit]))
+    params = [c for c in ["stock_min", "reorder_qty"] if c in lines.columns]
+    if params:
+        session.assign("inventory", INV_KEYS, lines[hit][INV_KEYS + params])
+
+    new = lines[~hit]
+    if not new.empty:
+        session.append("inventory", pd.DataFrame({
+            "branch_id": new["branch_id"].to_numpy(),
+            "product_id": new["product_id"].to_numpy(),
+            "stock_on_hand": new["stock_on_hand"].to_numpy(),
+            "stock_min": new["stock_min"].to_numpy() if "stock_min" in new.columns else stock_min,
+            "reorder_qty": new["reorder_qty"].to_numpy() if "reorder_qty" in new.columns else reorder_qty
+        }))
+
+    out = lines[INV_KEYS].assign(qty_change=target - before)
+    moved = out[out["qty_change"] != 0]
+    if not moved.empty:
+        mov_id = reserve_ids("stock_movements", "movement_id", len(moved), start=1)
+        session.append("stock_movements", pd.DataFrame({
+            "movement_id": mov_id + pd.RangeIndex(len(moved)),
+            "movement_ts": datetime.utcnow().isoformat(),
+            "branch_id": moved["branch_id"].to_numpy(),
+            "product_id": moved["product_id"].to_numpy(),
+            "qty_change": moved["qty_change"].to_numpy(),
+            "reason": "ADJUST",
+            "ref_order_id": pd.NA,
+            "ref_po_id": pd.NA
+        }))
+    return out
+
+def receive_pos(po_ids, session: Session | None = None) -> pd.DataFrame:
+    # recepción de varias OC a la vez (un camión con muchas OC): cantidades
+    # agregadas por (sucursal, producto), una suma contra inventory, un append de
+    # movimientos RECEIVED (uno por línea de OC) y las OC marcadas en bloque.
+    # Las OC ya recibidas se ignoran. Devuelve lo cargado por (sucursal, producto).
+    if session is None:
+        with Session() as s:
+            return receive_pos(po_ids, session=s)
+
+    ids = pd.unique(pd.Series(po_ids, dtype="int64"))
+    sel = session.rows_in("purchase_orders", "po_id", ids)
+    if len(sel["po_id"].unique()) < len(ids):
+        raise ValueError("Purchase order not found")
+    sel = sel[sel["status"] != "RECEIVED"]
+
+    # todas las OC seleccionadas quedan recibidas, también las que no tienen líneas
     now = datetime.utcnow().isoformat()
+    if not sel.empty:
+        session.assign("purchase_orders", ["po_id"], pd.DataFrame({
+            "po_id": sel["po_id"].unique(), "status": "RECEIVED", "received_ts": pd.Timestamp(now)
+        }))
+
+    items = session.rows_in("purchase_order_items", "po_id", sel["po_id"]).merge(
+        sel[["po_id", "branch_id"]], on="po_id", how="inner"
+    )
+    if items.empty:
+        return pd.DataFrame(columns=INV_KEYS + ["received", "stock_on_hand"])
+
+    loaded = increment_stock(session, items.rename(columns={"qty_ordered": "quantity"}))
 
-    for _, it in oitems.iterrows():
-        pid = int(it["product_id"]); qty = int(it["quantity"])
-        mask = (inv["branch_id"] == branch_id) & (inv["product_id"] == pid)
-        if not mask.any():
-            continue
-
-        inv.loc[mask, "stock_on_hand"] = inv.loc[mask, "stock_on_hand"] - qty
-
-        mov_id = next_id("stock_movements","movement_id",start=1)
-        append_table("stock_movements", pd.DataFrame([{
-            "movement_id": mov_id,
-            "movement_ts": now,
-            "branch_id": branch_id,
-            "product_id": pid,
-            "qty_change": -qty,
-            "reason": "SALE",
-            "ref_order_id": int(order_id),
-            "ref_po_id": float("nan")
-        }]))
-
-        soh = int(inv.loc[mask, "stock_on_hand"].iloc[0])
-        smin = int(inv.loc[mask, "stock_min"].iloc[0])
-        rq = int(inv.loc[mask, "reorder_qty"].iloc[0])
-
-        if soh < smin:
-            prow = prod[pd.to_numeric(prod["product_id"], errors="coerce") == pid].iloc[0]
-            supplier_id = int(prow["supplier_id"])
-            unit_cost = float(prow["unit_cost"])
-
-            lead = int(supp[pd.to_numeric(supp["supplier_id"], errors="coerce") == supplier_id]["lead_time_days"].iloc[0])
-            expected = (datetime.utcnow() + timedelta(days=lead)).date().isoformat()
-
-            po_id = next_id("purchase_orders","po_id",start=1)
-            append_table("purchase_orders", pd.DataFrame([{
-                "po_id": po_id,
-                "po_ts": now,
-                "supplier_id": supplier_id,
-                "branch_id": branch_id,
-                "status": "CREATED",
-                "expected_date": expected
-            }]))
-
-            po_item_id = next_id("purchase_order_items","po_item_id",start=1)
-            append_table("purchase_order_items", pd.DataFrame([{
-                "po_item_id": po_item_id,
-                "po_id": po_id,
-                "product_id": pid,
-                "qty_ordered": rq,
-                "unit_cost_est": unit_cost
-            }]))
-
-    write_table("inventory", inv)
+    mov_id = reserve_ids("stock_movements", "movement_id", len(items), start=1)
+    session.append("stock_movements", pd.DataFrame({
+        "movement_id": mov_id + pd.RangeIndex(len(items)),
+        "movement_ts": now,
+        "branch_id": items["branch_id"].to_numpy(),
+        "product_id": items["product_id"].to_numpy(),
+        "qty_change": items["qty_ordered"].to_numpy(),
+        "reason": "RECEIVED",
+        "ref_order_id": pd.NA,
+        "ref_po_id": items["po_id"].to_numpy()
+    }))
+    return loaded
@@ -1,9 +1,27 @@
 from __future__ import annotations
 import numpy as np
 import pandas as pd
-from .storage import write_table
+from .storage import write_table, read_table
+from .etl import profile_orders
+from .inventory_history import take_snapshot
+from .scm import set_stock, INV_KEYS
+
+def _median_from_counts(g: pd.DataFrame) -> float:
+    # mediana exacta a partir de (precio, repeticiones), igual que Series.median
+    g = g.sort_values("price")
+    cum = g["n"].cumsum().to_numpy()
+    total = int(cum[-1])
+    prices = g["price"].to_numpy()
+    lo = prices[np.searchsorted(cum, (total - 1) // 2, side="right")]
+    hi = prices[np.searchsorted(cum, total // 2, side="right")]
+    return float((lo + hi) / 2)
 
 def generate_master_data(df_raw: pd.DataFrame, seed: int = 42):
+    return generate_master_from_profile(profile_orders(df_raw), seed=seed)
+
+def generate_master_from_profile(profile: pd.DataFrame, seed: int = 42):
+    # `profile` viene de etl.profile_orders / merge_profiles: permite sembrar
+    # maestros desde un export leído por bloques sin tenerlo entero en memoria
     rng = np.random.default_rng(seed)
 
     branches = pd.DataFrame([
@@ -12,7 +30,7 @@ def generate_master_data(df_raw: pd.DataFrame, seed: int = 42):
         {"branch_id": 3, "branch_name": "Sucursal Valle",  "city": "Cumbayá"},
     ])
 
-    categories = sorted(df_raw["category"].dropna().unique().tolist())
+    categories = sorted(profile["category"].dropna().unique().tolist())
     suppliers = pd.DataFrame([
         {
             "supplier_id": i,
@@ -24,8 +42,10 @@ def generate_master_data(df_raw: pd.DataFrame, seed: int = 42):
     ])
     # 1 producto por (food_item, category) — precio estándar = mediana
     prod_keys = (
-        df_raw.groupby(["food_item", "category"], as_index=False)
-            .agg(sale_price=("price", "median"))
+        profile.groupby(["food_item", "category"])[["price", "n"]]
+            .apply(_median_from_counts)
+            .rename("sale_price")
+            .reset_index()
     )
 
     prod_keys = prod_keys.sort_values(["category", "food_item"]).reset_index(drop=True)
@@ -45,7 +65,7 @@ def generate_master_data(df_raw: pd.DataFrame, seed: int = 42):
     ]
 
         
-    demand = df_raw.groupby(["food_item", "category"])["quantity"].sum().reset_index()
+    demand = profile.groupby(["food_item", "category"])["quantity"].sum().reset_index()
     demand = demand.merge(products, on=["food_item", "category"], how="left")
 
     qmin, qmax = demand["quantity"].min(), demand["quantity"].max()
@@ -67,9 +87,24 @@ def generate_master_data(df_raw: pd.DataFrame, seed: int = 42):
 
     return branches, suppliers, products, inventory
 
-def seed_and_save(df_raw: pd.DataFrame, seed: int = 42):
-    branches, suppliers, products, inventory = generate_master_data(df_raw, seed=seed)
+def seed_and_save(df_raw: pd.DataFrame | None = None, seed: int = 42, profile: pd.DataFrame | None = None):
+    if profile is None:
+        profile = profile_orders(df_raw)
+    branches, suppliers, products, inventory = generate_master_from_profile(profile, seed=seed)
     write_table("branches", branches)
     write_table("suppliers", suppliers)
     write_table("products", products)
-    write_table("inventory", inventory)
+    cur = read_table("inventory")
+    if cur.empty:
+        write_table("inventory", inventory)
+    else:
+        # resiembra: la diferencia con el stock actual queda como movimientos ADJUST
+        # (así verify() sigue cuadrando); las claves que ya no existen bajan a 0 y
+        # después se quitan
+        gone = cur[INV_KEYS].merge(inventory[INV_KEYS], how="left", indicator=True)
+        gone = gone[gone.pop("_merge") == "left_only"]
+        set_stock(pd.concat([inventory, gone.assign(stock_on_hand=0)], ignore_index=True))
+        if not gone.empty:
+            write_table("inventory", inventory)
+    # checkpoint del inventario sembrado (base de stock_at y de verify)
+    take_snapshot()
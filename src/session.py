@@ -0,0 +1,193 @@
+from __future__ import annotations
+import pandas as pd
+from .storage import read_table, get_rows, get_rows_in, lookup_rows, row_mask, set_values, apply_keyed, commit_tables, table_version
+
+# Unidad de trabajo: cada tabla se lee una sola vez, TPS/ERP/SCM dejan sus
+# cambios en memoria y commit() escribe todo junto (una escritura por tabla).
+#
+#   with Session() as s:
+#       s.update("orders", {"order_id": 7}, {"status": "PAID"})
+#       erp.record_sale(7, session=s)
+#       scm.apply_sale(7, session=s)
+#
+# Si el bloque lanza una excepción no se escribe nada.
+#
+# Los cambios se guardan como operaciones (append, update por clave, increment /
+# assign por clave) y en commit() se aplican sobre la versión vigente de cada
+# tabla: dos sesiones que descuentan stock a la vez no se pisan. Solo las tablas
+# marcadas con mark_dirty()/put() se escriben completas tal como las dejó la
+# sesión; si otra sesión las cambió entretanto, commit() lanza ConflictError.
+
+class Session:
+    def __init__(self):
+        self._frames: dict[str, pd.DataFrame] = {}
+        self._read_versions: dict[str, tuple | None] = {}
+        self._merged: dict[str, int] = {}  # filas de _appends ya incluidas en _frames
+        self._dirty: set[str] = set()
+        self._appends: dict[str, list[pd.DataFrame]] = {}
+        self._updates: dict[str, list[tuple[dict, dict]]] = {}
+        self._keyed: dict[str, list[tuple[str, list[str], pd.DataFrame]]] = {}
+        self._on_commit: list = []
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def _pending(self, name: str) -> pd.DataFrame | None:
+        parts = self._appends.get(name)
+        if not parts:
+            return None
+        if len(parts) > 1:
+            self._appends[name] = parts = [pd.concat(parts, ignore_index=True)]
+        return parts[0]
+
+    def _unmerged(self, name: str) -> pd.DataFrame | None:
+        # filas agregadas que todavía no están en _frames[name]
+        pend = self._pending(name)
+        if pend is None or name not in self._frames:
+            return pend
+        return pend.iloc[self._merged.get(name, 0):]
+
+    # ---- lectura ----
+    def table(self, name: str) -> pd.DataFrame:
+        # tabla completa; si se modifica en sitio hay que llamar mark_dirty()
+        if name not in self._frames:
+            version = table_version(name)
+            df = read_table(name)
+            for where, values in self._updates.get(name, []):
+                set_values(df, row_mask(df, where), values)
+            for op, keys, vals in self._keyed.get(name, []):
+                apply_keyed(df, op, keys, vals)
+            self._frames[name], self._read_versions[name], self._merged[name] = df, version, 0
+        tail = self._unmerged(name)
+        if tail is not None and len(tail):
+            self._frames[name] = pd.concat([self._frames[name], tail], ignore_index=True)
+            self._merged[name] += len(tail)
+        return self._frames[name]
+
+    def rows(self, name: str, **where) -> pd.DataFrame:
+        if name in self._frames:
+            df = self._frames[name]
+            out = df[row_mask(df, where)]
+        else:
+            out = get_rows(name, **where)
+        pend = self._unmerged(name)
+        if pend is not None:
+            out = pd.concat([out, pend[row_mask(pend, where)]], ignore_index=True)
+        return self._replay(name, out.reset_index(drop=True))
+
+    def rows_in(self, name: str, col: str, values) -> pd.DataFrame:
+        # como rows() pero con col IN values (lotes de pedidos)
+        if name in self._frames:
+            df = self._frames[name]
+            out = df[df[col].isin(values)] if col in df.columns else df.iloc[0:0]
+        else:
+            out = get_rows_in(name, col, values)
+        pend = self._unmerged(name)
+        if pend is not None:
+            out = pd.concat([out, pend[pend[col].isin(values)]], ignore_index=True)
+        return self._replay(name, out.reset_index(drop=True))
+
+    def lookup(self, name: str, keys: list[str], vals: pd.DataFrame) -> pd.DataFrame:
+        # filas con esas claves (una por clave presente) sin cargar la tabla completa
+        want = vals[keys].drop_duplicates()
+        if name in self._frames:
+            df = self._frames[name]
+            out = want.merge(df, on=keys)[list(df.columns)]
+        else:
+            out = lookup_rows(name, keys, want)
+        pend = self._unmerged(name)
+        if pend is not None:
+            out = pd.concat([out, want.merge(pend, on=keys)[list(pend.columns)]], ignore_index=True)
+        return self._replay(name, out.reset_index(drop=True))
+
+    def _replay(self, name: str, out: pd.DataFrame) -> pd.DataFrame:
+        # filas leídas fuera de _frames: se les aplican los cambios de la sesión
+        if name in self._frames:
+            return out
+        for w, vals in self._updates.get(name, []):
+            set_values(out, row_mask(out, w), vals)
+        for op, keys, vals in self._keyed.get(name, []):
+            apply_keyed(out, op, keys, vals)
+        return out
+
+    def row(self, name: str, **where) -> dict | None:
+        out = self.rows(name, **where)
+        return None if out.empty else out.iloc[0].to_dict()
+
+    # ---- escritura (en memoria hasta commit) ----
+    def mark_dirty(self, name: str) -> None:
+        self._dirty.add(name)
+
+    def put(self, name: str, df: pd.DataFrame) -> None:
+        self._frames[name] = df
+        self._read_versions[name] = None  # reemplazo deliberado: no se compara versión
+        self._merged[name] = 0
+        self._appends.pop(name, None)
+        self._updates.pop(name, None)
+        self._keyed.pop(name, None)
+        self._dirty.add(name)
+
+    def append(self, name: str, df_new: pd.DataFrame) -> None:
+        if not df_new.empty:
+            self._appends.setdefault(name, []).append(df_new)
+
+    def update(self, name: str, where: dict, values: dict) -> None:
+        self._updates.setdefault(name, []).append((where, values))
+        if name in self._frames:
+            df = self.table(name)
+            set_values(df, row_mask(df, where), values)
+        pend = self._pending(name)
+        if pend is not None:
+            set_values(pend, row_mask(pend, where), values)
+
+    def _keyed_op(self, op: str, name: str, keys: list[str], vals: pd.DataFrame) -> None:
+        if vals.empty:
+            return
+        vals = vals.reset_index(drop=True)
+        self._keyed.setdefault(name, []).append((op, list(keys), vals))
+        if name in self._frames:
+            apply_keyed(self.table(name), op, keys, vals)
+
+    def increment(self, name: str, keys: list[str], vals: pd.DataFrame) -> None:
+        # vals: columnas clave + deltas; se suman a la fila vigente al hacer commit
+        self._keyed_op("add", name, keys, vals)
+
+    def assign(self, name: str, keys: list[str], vals: pd.DataFrame) -> None:
+        # vals: columnas clave + valores nuevos para esas filas (sin reescribir el resto)
+        self._keyed_op("set", name, keys, vals)
+
+    def on_commit(self, fn) -> None:
+        # se ejecuta solo si commit() escribe bien (p.ej. índices derivados)
+        self._on_commit.append(fn)
+
+    def commit(self) -> None:
+        # las tablas completas ya incluyen sus appends, updates y operaciones por clave
+        for name in self._dirty:
+            self.table(name)
+        frames = {n: self._frames[n] for n in self._dirty}
+        appends = {n: df for n in list(self._appends) if n not in self._dirty and (df := self._pending(n)) is not None}
+        updates = {n: u for n, u in self._updates.items() if n not in self._dirty}
+        keyed = {n: k for n, k in self._keyed.items() if n not in self._dirty}
+        if frames or appends or updates or keyed:
+            commit_tables(frames, appends, updates, keyed,
+                          expect={n: self._read_versions.get(n) for n in frames})
+        callbacks = list(self._on_commit)
+        self.rollback()
+        for fn in callbacks:
+            fn()
+
+    def rollback(self) -> None:
+        self._frames.clear()
+        self._read_versions.clear()
+        self._merged.clear()
+        self._dirty.clear()
+        self._appends.clear()
+        self._updates.clear()
+        self._keyed.clear()
+        self._on_commit.clear()
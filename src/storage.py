@@ -1,33 +1,480 @@
 from __future__ import annotations
+import importlib
+import json
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from .config import TABLE_DIR
+from .config import TABLE_DIR, TABLE_CACHE_MAX_MB, STORAGE_BACKEND, INVENTORY_STORE
+from .backends import make_backend
+from .schema import apply_schema
+try:
+    import fcntl
+except ImportError:  # Windows: solo el lock entre hilos
+    fcntl = None
+
+SEQ_PATH = TABLE_DIR / "_sequences.json"
+_seq_lock = threading.Lock()
+
+# ====== Caché de tablas ======
+# name -> (stamp, df, nbytes). El stamp combina la versión local (se incrementa
+# en write/append) con mtime/tamaño del archivo, así también se detectan
+# cambios hechos por otro proceso.
+_cache: OrderedDict[str, tuple] = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_versions: dict[str, int] = {}
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+try:
+    _COW = int(pd.__version__.split(".")[0]) >= 3 or pd.get_option("mode.copy_on_write") is True
+except Exception:
+    _COW = False
+
+_backend = None
+
+# Un commit a la vez dentro del proceso (UI + worker de posteos son hilos del
+# mismo proceso): las sumas por clave y los updates se aplican sobre la tabla
+# vigente dentro de este lock, así un commit no pisa el de otra sesión.
+_commit_lock = threading.RLock()
+
+class ConflictError(RuntimeError):
+    # una sesión quiso reescribir completa una tabla que otro commit cambió
+    # después de que ella la leyó
+    pass
+
+# ====== Hooks de cambios ======
+# Tablas derivadas (p.ej. rollups.ledger_daily) se registran para enterarse de
+# cada escritura: fn(df_nuevo) tras un append, fn(None) si la tabla se reescribió
+# o se actualizó en sitio (el derivado debe reconstruirse).
+#
+# Con detail=True se llama fn(df_nuevo, kind, before, after): kind es "append",
+# "update" (en sitio; df_nuevo trae lo agregado en el mismo commit, si hubo) o
+# "rewrite", y before/after son table_version() justo antes y después del
+# cambio, para que el derivado sepa si estaba al día (p.ej. order_index, que no
+# depende de las columnas que se actualizan).
+#
+# Los módulos de HOOK_MODULES registran sus hooks al importarse; _notify() los
+# carga antes de avisar del primer cambio, así ningún escritor depende de
+# haberlos importado él mismo.
+HOOK_MODULES = ("rollups", "inventory_history", "customer_index", "order_index")
+_change_hooks: dict[str, list] = {}
+_hooks_loaded = False
+
+def on_table_change(name: str, fn, detail: bool = False) -> None:
+    hooks = _change_hooks.setdefault(name, [])
+    if (fn, detail) not in hooks:
+        hooks.append((fn, detail))
+
+def register_default_hooks() -> None:
+    global _hooks_loaded
+    if not _hooks_loaded:
+        for mod in HOOK_MODULES:
+            importlib.import_module(f"{__package__}.{mod}")
+        _hooks_loaded = True
+
+def _notify(name: str, df_new: pd.DataFrame | None, kind: str, before=None, after=None) -> None:
+    register_default_hooks()
+    for fn, detail in _change_hooks.get(name, []):
+        try:
+            if detail:
+                fn(df_new, kind, before, after)
+            else:
+                fn(df_new if kind == "append" else None)
+        except Exception as e:
+            # los datos ya están escritos: el derivado queda desactualizado, no se aborta
+            warnings.warn(f"Hook de {name} falló: {e!r}")
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        try:
+            _backend = make_backend(STORAGE_BACKEND, TABLE_DIR, INVENTORY_STORE)
+        except ImportError:
+            warnings.warn(f"pyarrow no está instalado; se usa CSV en lugar de {STORAGE_BACKEND}")
+            _backend = make_backend("csv", TABLE_DIR, INVENTORY_STORE)
+    return _backend
+
+def set_backend(kind: str) -> None:
+    global _backend
+    _backend = make_backend(kind, TABLE_DIR, INVENTORY_STORE)
+    clear_table_cache()
 
 def tpath(name: str) -> Path:
     return TABLE_DIR / f"{name}.csv"
 
+def table_version(name: str) -> tuple | None:
+    stamp = get_backend().stamp(name)
+    if stamp is None:
+        return None
+    return (_versions.get(name, 0),) + stamp
+
+def _bump_version(name: str) -> None:
+    global _cache_bytes
+    with _cache_lock:
+        _versions[name] = _versions.get(name, 0) + 1
+        hit = _cache.pop(name, None)
+        if hit is not None:
+            _cache_bytes -= hit[2]
+
+def _cache_put(name: str, stamp: tuple, df: pd.DataFrame) -> None:
+    global _cache_bytes
+    cap = TABLE_CACHE_MAX_MB * 1024 * 1024
+    nbytes = int(df.memory_usage(index=True, deep=True).sum())
+    if nbytes > cap:
+        return
+    with _cache_lock:
+        old = _cache.pop(name, None)
+        if old is not None:
+            _cache_bytes -= old[2]
+        _cache[name] = (stamp, df, nbytes)
+        _cache_bytes += nbytes
+        while _cache_bytes > cap:
+            _, (_, _, nb) = _cache.popitem(last=False)
+            _cache_bytes -= nb
+            _cache_stats["evictions"] += 1
+
+def _view(df: pd.DataFrame) -> pd.DataFrame:
+    # con copy-on-write la copia superficial es gratis y protege la caché
+    return df.copy(deep=not _COW)
+
+def clear_table_cache() -> None:
+    global _cache_bytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+def table_cache_info() -> dict:
+    with _cache_lock:
+        return {**_cache_stats, "tables": len(_cache), "bytes": _cache_bytes}
+
 def read_table(name: str) -> pd.DataFrame:
-    p = tpath(name)
-    return pd.read_csv(p) if p.exists() else pd.DataFrame()
+    stamp = table_version(name)
+    if stamp is None:
+        return pd.DataFrame()
+    with _cache_lock:
+        hit = _cache.get(name)
+        if hit is not None and hit[0] == stamp:
+            _cache.move_to_end(name)
+            _cache_stats["hits"] += 1
+            return _view(hit[1])
+        _cache_stats["misses"] += 1
+    df = apply_schema(name, get_backend().read(name))
+    _cache_put(name, stamp, df)
+    return _view(df)
 
 def write_table(name: str, df: pd.DataFrame) -> None:
-    df.to_csv(tpath(name), index=False)
+    df = apply_schema(name, df)
+    with _commit_lock:
+        before = table_version(name)
+        get_backend().write(name, df)
+        _bump_version(name)
+        after = table_version(name)
+    _sync_sequences(name, df)
+    _notify(name, None, "rewrite", before, after)
+
+def table_columns(name: str) -> list[str]:
+    return get_backend().columns(name)
 
 def append_table(name: str, df_new: pd.DataFrame) -> None:
-    df_old = read_table(name)
-    if df_old.empty:
+    # solo escribe las filas nuevas al final del archivo (O(filas nuevas))
+    if df_new.empty:
+        return
+    cols = table_columns(name)
+    if not cols:
         write_table(name, df_new)
-    else:
-        write_table(name, pd.concat([df_old, df_new], ignore_index=True))
+        return
+    extra = [c for c in df_new.columns if c not in cols]
+    if extra:
+        raise ValueError(f"Columns {extra} not in {name} schema {cols}")
+    df_new = apply_schema(name, df_new).reindex(columns=cols)
+    with _commit_lock:
+        before = table_version(name)
+        get_backend().append(name, df_new)
+        _bump_version(name)
+        after = table_version(name)
+    _sync_sequences(name, df_new)
+    _notify(name, df_new, "append", before, after)
 
 def ensure_table(name: str, columns: list[str]) -> None:
-    p = tpath(name)
-    if not p.exists():
+    if not get_backend().exists(name):
         write_table(name, pd.DataFrame(columns=columns))
 
-def next_id(name: str, id_col: str, start: int = 1) -> int:
+def compact_tables(names: list[str] | None = None) -> dict[str, int]:
+    # mantenimiento fuera de los commits: junta las partes de las tablas columnares
+    # (mismo contenido, así que no avisa a los hooks); tabla -> partes juntadas
+    be = get_backend()
+    compact = getattr(be, "compact", None)
+    if compact is None:
+        return {}
+    done = {}
+    for name in names or be.list_tables():
+        with _commit_lock:
+            n = compact(name)
+            if n:
+                _bump_version(name)
+        if n:
+            done[name] = n
+    return done
+
+def export_csv(name: str, path: Path | None = None) -> Path:
+    out = Path(path) if path is not None else tpath(name)
+    read_table(name).to_csv(out, index=False)
+    return out
+
+# ====== Búsquedas por clave ======
+# get_row / get_rows / update_rows usan índices reales si el backend los tiene
+# (SQLite); en CSV/Parquet filtran la tabla en caché.
+
+def row_mask(df: pd.DataFrame, where: dict) -> pd.Series:
+    m = pd.Series(True, index=df.index)
+    for col, val in where.items():
+        if col not in df.columns:
+            return pd.Series(False, index=df.index)
+        m &= df[col] == val
+    return m
+
+def set_values(df: pd.DataFrame, mask: pd.Series, values: dict) -> None:
+    for col, val in values.items():
+        try:
+            df.loc[mask, col] = val
+        except (TypeError, ValueError):
+            df[col] = df[col].astype(object)
+            df.loc[mask, col] = val
+
+def get_rows(name: str, **where) -> pd.DataFrame:
+    select = getattr(get_backend(), "select", None)
+    if select is not None:
+        out = select(name, where)
+        if out is not None:
+            return apply_schema(name, out)
+    df = read_table(name)
+    if df.empty:
+        return df
+    return df[row_mask(df, where)].reset_index(drop=True)
+
+def get_rows_in(name: str, col: str, values) -> pd.DataFrame:
+    # como get_rows pero con col IN values; SQLite lo resuelve con el índice
+    select_in = getattr(get_backend(), "select_in", None)
+    if select_in is not None:
+        out = select_in(name, col, list(values))
+        if out is not None:
+            return apply_schema(name, out)
+    df = read_table(name)
+    if col not in df.columns:
+        return df.iloc[0:0]
+    return df[df[col].isin(values)].reset_index(drop=True)
+
+def get_row(name: str, **where) -> dict | None:
+    rows = get_rows(name, **where)
+    return None if rows.empty else rows.iloc[0].to_dict()
+
+def lookup_rows(name: str, keys: list[str], vals: pd.DataFrame) -> pd.DataFrame:
+    # filas cuyas claves están en vals (una por clave presente, en el orden de vals);
+    # la matriz de inventario las lee por posición y SQLite por su índice compuesto
+    want = vals[keys].drop_duplicates()
+    lookup = getattr(get_backend(), "lookup", None)
+    if lookup is not None:
+        out = lookup(name, keys, want)
+        if out is not None:
+            out = apply_schema(name, out)
+            return want.merge(out, on=keys)[list(out.columns)]
+    df = read_table(name)
+    if df.empty:
+        return df
+    return want.merge(df, on=keys)[list(df.columns)]
+
+def rows_below_min(name: str = "inventory") -> pd.DataFrame:
+    # filas con stock_on_hand < stock_min (alertas de reabastecimiento)
+    below_min = getattr(get_backend(), "below_min", None)
+    if below_min is not None:
+        out = below_min(name)
+        if out is not None:
+            return apply_schema(name, out)
+    df = read_table(name)
+    if df.empty:
+        return df
+    return df[df["stock_on_hand"] < df["stock_min"]].reset_index(drop=True)
+
+def apply_keyed(df: pd.DataFrame, op: str, keys: list[str], vals: pd.DataFrame) -> None:
+    # op "add": suma vals a las filas con esas claves (claves repetidas se acumulan);
+    # op "set": las sobrescribe. Claves sin fila se ignoran.
+    if df.empty or vals.empty:
+        return
+    pos = pd.MultiIndex.from_frame(df[keys]).get_indexer(pd.MultiIndex.from_frame(vals[keys]))
+    hit = pos >= 0
+    for col in [c for c in vals.columns if c not in keys]:
+        arr = df[col].to_numpy().copy()
+        v = vals[col].to_numpy()[hit]
+        if op == "add":
+            np.add.at(arr, pos[hit], v.astype(arr.dtype))
+        else:
+            arr[pos[hit]] = v
+        df[col] = arr
+
+def update_rows(name: str, where: dict, values: dict) -> int:
+    update = getattr(get_backend(), "update", None)
+    with _commit_lock:
+        before = table_version(name)
+        n = update(name, where, values) if update is not None else None
+        if n is None:
+            df = read_table(name)
+            if df.empty:
+                return 0
+            m = row_mask(df, where)
+            n = int(m.sum())
+            if n:
+                set_values(df, m, values)
+                get_backend().write(name, df)
+        if n:
+            _bump_version(name)
+        after = table_version(name)
+    if n:
+        _notify(name, None, "update", before, after)
+    return n
+
+# ====== Commit por lotes ======
+# Usado por session.Session: reescrituras completas, appends, updates por clave
+# y sumas/asignaciones por clave (keyed) de varias tablas en una sola llamada al
+# backend (archivos temporales + rename, o una sola transacción en SQLite).
+#
+# Todo ocurre dentro de _commit_lock: updates y keyed se aplican sobre la
+# versión vigente de la tabla, no sobre la que la sesión leyó, y una reescritura
+# completa (`expect`) falla con ConflictError si la tabla cambió desde su
+# lectura. Entre procesos distintos no hay lock: el backend publica de forma
+# atómica, pero dos commits simultáneos sobre la misma tabla pueden pisarse.
+
+def commit_tables(frames: dict[str, pd.DataFrame], appends: dict[str, pd.DataFrame],
+                  updates: dict[str, list[tuple[dict, dict]]], keyed: dict[str, list] | None = None,
+                  expect: dict[str, tuple | None] | None = None) -> None:
+    frames, appends, updates, keyed = dict(frames), dict(appends), dict(updates), dict(keyed or {})
+    replaced, updated, appended = set(frames), set(updates) | set(keyed), dict(appends)
+    touched = replaced | updated | set(appends)
+
+    with _commit_lock:
+        for name, version in (expect or {}).items():
+            if version is not None and table_version(name) != version:
+                raise ConflictError(f"Table {name} changed since it was read; retry the operation")
+        before = {name: table_version(name) for name in touched}
+
+        be = get_backend()
+        updatable = getattr(be, "updatable", lambda name: hasattr(be, "update"))
+        keyable = getattr(be, "keyable", lambda name: False)
+        # sin updates indexados (o con sumas por clave que el backend no aplica en
+        # sitio): se carga la versión vigente una vez, se aplica todo y se reescribe
+        rewrite = [n for n in updates if not updatable(n)]
+        rewrite += [n for n in keyed if n not in rewrite and (n in frames or not keyable(n))]
+        for name in rewrite:
+            df = frames.get(name)
+            if df is None:
+                df = read_table(name)
+            if name in appends:
+                df = pd.concat([df, appends.pop(name)], ignore_index=True)
+            for where, values in updates.pop(name, []):
+                set_values(df, row_mask(df, where), values)
+            for op, keys, vals in keyed.pop(name, []):
+                apply_keyed(df, op, keys, vals)
+            frames[name] = df
+
+        for name in list(appends):
+            if name in frames:
+                frames[name] = pd.concat([frames[name], appends.pop(name)], ignore_index=True)
+                continue
+            cols = table_columns(name)
+            if not cols:
+                frames[name] = appends.pop(name)
+                continue
+            extra = [c for c in appends[name].columns if c not in cols]
+            if extra:
+                raise ValueError(f"Columns {extra} not in {name} schema {cols}")
+            appends[name] = apply_schema(name, appends[name]).reindex(columns=cols)
+
+        frames = {name: apply_schema(name, df) for name, df in frames.items()}
+        if keyed:
+            be.commit(frames, appends, updates, keyed)
+        else:
+            be.commit(frames, appends, updates)
+
+        for name in touched:
+            _bump_version(name)
+        after = {name: table_version(name) for name in touched}
+    for name, df in list(frames.items()) + list(appends.items()):
+        _sync_sequences(name, df)
+    for name in touched:
+        df_new = apply_schema(name, appended[name]) if name in appended else None
+        kind = "rewrite" if name in replaced else "update" if name in updated else "append"
+        _notify(name, df_new, kind, before[name], after[name])
+
+# ====== Secuencias de IDs ======
+# Un contador persistente por tabla/columna ("orders.order_id" -> siguiente id).
+# Si el archivo se pierde o no tiene la clave, se recupera con max() de la tabla.
+# Leer-incrementar-escribir va bajo _seq_lock (hilos) y un flock sobre
+# _sequences.lock (procesos: la app, posting --worker, run_demo).
+
+@contextmanager
+def _sequences_locked():
+    with _seq_lock:
+        if fcntl is None:
+            yield
+            return
+        SEQ_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(SEQ_PATH.with_suffix(".lock"), "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _load_sequences() -> dict:
+    try:
+        return json.loads(SEQ_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def _save_sequences(seqs: dict) -> None:
+    tmp = SEQ_PATH.with_name(f"{SEQ_PATH.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(seqs, indent=1, sort_keys=True))
+    os.replace(tmp, SEQ_PATH)
+
+def _scan_next_id(name: str, id_col: str, start: int) -> int:
     df = read_table(name)
     if df.empty or id_col not in df.columns:
         return start
     mx = pd.to_numeric(df[id_col], errors="coerce").max()
     return start if pd.isna(mx) else int(mx) + 1
+
+def _sync_sequences(name: str, df: pd.DataFrame) -> None:
+    # si alguien escribe ids explícitos, el contador nunca queda por debajo
+    with _sequences_locked():
+        seqs = _load_sequences()
+        changed = False
+        for key, nxt in seqs.items():
+            table, col = key.split(".", 1)
+            if table != name or col not in df.columns:
+                continue
+            mx = pd.to_numeric(df[col], errors="coerce").max()
+            if pd.notna(mx) and int(mx) + 1 > nxt:
+                seqs[key] = int(mx) + 1
+                changed = True
+        if changed:
+            _save_sequences(seqs)
+
+# reserva `count` ids consecutivos (inserciones masivas) y devuelve el primero
+def reserve_ids(name: str, id_col: str, count: int, start: int = 1) -> int:
+    key = f"{name}.{id_col}"
+    with _sequences_locked():
+        seqs = _load_sequences()
+        nxt = seqs.get(key)
+        if nxt is None:
+            nxt = _scan_next_id(name, id_col, start)
+        nxt = max(int(nxt), start)
+        seqs[key] = nxt + max(int(count), 0)
+        _save_sequences(seqs)
+    return nxt
+
+def next_id(name: str, id_col: str, start: int = 1) -> int:
+    return reserve_ids(name, id_col, 1, start=start)
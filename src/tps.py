@@ -1,8 +1,16 @@
 from __future__ import annotations
+import json
+import os
 from datetime import datetime
+from pathlib import Path
+import numpy as np
 import pandas as pd
-from .storage import read_table, write_table, append_table, ensure_table, next_id
-from . import erp, scm
+from .config import TABLE_DIR, ASYNC_POSTING
+from .etl import ContentHash, iter_orders_csv, print_progress, sniff_ts_format
+from .storage import read_table, append_table, ensure_table, next_id, reserve_ids
+from .session import Session
+from .customer_index import lookup_customer, lookup_customers, normalize_names
+from . import erp, scm, posting, kpi_cube
 
 def init_tables():
     ensure_table("customers", ["customer_id","customer_name","created_at"])
@@ -12,13 +20,15 @@ def init_tables():
     ensure_table("stock_movements", ["movement_id","movement_ts","branch_id","product_id","qty_change","reason","ref_order_id","ref_po_id"])
     ensure_table("purchase_orders", ["po_id","po_ts","supplier_id","branch_id","status","expected_date"])
     ensure_table("purchase_order_items", ["po_item_id","po_id","product_id","qty_ordered","unit_cost_est"])
+    ensure_table("posting_queue", ["event_id","order_id","event_ts","status"])
+    ensure_table("inventory_checkpoints", ["snapshot_id","snapshot_ts","last_movement_id","rows"])
+    ensure_table("inventory_snapshots", ["snapshot_id","branch_id","product_id","stock_on_hand"])
 
 def ensure_customer(customer_name: str) -> int:
-    customers = read_table("customers")
-    if not customers.empty:
-        row = customers[customers["customer_name"] == customer_name]
-        if not row.empty:
-            return int(row["customer_id"].iloc[0])
+    # búsqueda O(1) por nombre normalizado (sin tildes ni mayúsculas)
+    cid = lookup_customer(customer_name)
+    if cid is not None:
+        return cid
     cid = next_id("customers","customer_id",start=1)
     append_table("customers", pd.DataFrame([{
         "customer_id": cid,
@@ -27,60 +37,196 @@ def ensure_customer(customer_name: str) -> int:
     }]))
     return cid
 
-def import_real_transactions(df_raw: pd.DataFrame):
-    products = read_table("products")
+def ensure_customers(names: pd.Series, session: Session) -> pd.Series:
+    # versión vectorizada de ensure_customer: un map contra el índice y un solo append
+    ids = lookup_customers(names)
+
+    missing = names[ids.isna()]
+    keys = normalize_names(missing)
+    new = pd.DataFrame({"customer_name": missing.values, "key": keys.values}).drop_duplicates("key")
+    if len(new):
+        start = reserve_ids("customers", "customer_id", len(new), start=1)
+        new["customer_id"] = start + pd.RangeIndex(len(new))
+        session.append("customers", pd.DataFrame({
+            "customer_id": new["customer_id"].values,
+            "customer_name": new["customer_name"].values,
+            "created_at": datetime.utcnow().isoformat()
+        }))
+        ids = ids.fillna(keys.map(new.set_index("key")["customer_id"]))
+    return ids.astype(int)
+
+IMPORT_STATE_PATH = TABLE_DIR / "_import_state.json"
+
+def _load_import_state() -> dict:
+    if IMPORT_STATE_PATH.exists():
+        return json.loads(IMPORT_STATE_PATH.read_text(encoding="utf-8"))
+    return {"watermark": None, "files": {}, "hashes": []}
+
+def _save_import_state(state: dict):
+    tmp = IMPORT_STATE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp, IMPORT_STATE_PATH)
+
+def _real_orders_imported() -> bool:
     orders = read_table("orders")
+    return not orders.empty and "is_synthetic" in orders.columns and bool((orders["is_synthetic"] == 0).any())
+
+def _raw_ids(df: pd.DataFrame) -> pd.Series:
+    if "order_id" in df.columns:
+        return pd.to_numeric(df["order_id"], errors="coerce").fillna(-1).astype("int64")
+    return pd.Series(-1, index=df.index, dtype="int64")
+
+def _after_watermark(df: pd.DataFrame, wm: dict | None) -> np.ndarray:
+    # filas nuevas: (Order Time, Order ID) > marca; sin fecha no se pueden ubicar y se importan
+    if wm is None:
+        return np.ones(len(df), dtype=bool)
+    ts, ids = df["order_ts"], _raw_ids(df)
+    wts = pd.Timestamp(wm["order_time"])
+    return (ts.isna() | (ts > wts) | ((ts == wts) & (ids > wm["order_id"]))).to_numpy()
+
+def _advance_watermark(wm: dict | None, df: pd.DataFrame) -> dict | None:
+    ts = df["order_ts"]
+    if ts.notna().sum() == 0:
+        return wm
+    top = ts.max()
+    oid = int(_raw_ids(df)[ts == top].max())
+    if wm is not None and (pd.Timestamp(wm["order_time"]), wm["order_id"]) >= (top, oid):
+        return wm
+    return {"order_time": top.isoformat(), "order_id": oid}
+
+def import_real_transactions(df_raw: pd.DataFrame):
+    return import_real_stream([df_raw])
+
+def import_real_stream(chunks) -> int:
+    # importa solo las filas posteriores a la marca de agua (último Order Time/Order ID);
+    # `offset` mantiene la asignación de sucursal por posición igual que en la carga completa.
+    # El export no viene ordenado por fecha: todos los bloques se filtran contra la
+    # marca con la que empezó la corrida y la nueva se guarda una vez, al final
+    state = _load_import_state()
+    # datos importados antes de existir la marca: se toman como ya cargados
+    bootstrap = state["watermark"] is None and not state["files"] and _real_orders_imported()
+    start_wm = wm = state["watermark"]
+    n, offset = 0, 0
+    for chunk in chunks:
+        if not bootstrap:
+            n += _import_chunk(chunk, offset=offset, new_rows=_after_watermark(chunk, start_wm))
+        wm = _advance_watermark(wm, chunk)
+        offset += len(chunk)
+    state["watermark"] = wm
+    _save_import_state(state)
+    return n
 
-    if not orders.empty and "is_synthetic" in orders.columns:
-        if (pd.to_numeric(orders["is_synthetic"], errors="coerce").fillna(0).astype(int) == 0).any():
+def import_real_file(path, chunksize: int, progress=print_progress) -> int:
+    # import incremental e idempotente de un export crudo:
+    # - mismo archivo con filas añadidas al final: se verifica el hash del prefijo ya
+    #   cargado y se sigue leyendo desde ese byte (solo se parsean las filas nuevas)
+    # - archivo nuevo: se saltan las filas con (Order Time, Order ID) <= marca de agua
+    #   (la de antes de esta corrida; la nueva se publica al terminar el archivo)
+    # - contenido idéntico ya cargado (aunque cambie el nombre): no se lee
+    state = _load_import_state()
+    key = str(Path(path).resolve())
+    entry = state["files"].get(key)
+    size = os.path.getsize(path)
+    content = ContentHash()
+    start, skip_rows, use_watermark = 0, 0, True
+
+    if entry and entry.get("sha256"):
+        if size >= entry["bytes"] and content.prefix(path, entry["bytes"]) == entry["sha256"]:
+            if size == entry["bytes"]:
+                return 0
+            start, use_watermark = entry["bytes"], False
+        else:
+            content = ContentHash()
+    elif entry:
+        # import interrumpido: se retoma tras las filas ya confirmadas
+        skip_rows, use_watermark = entry["rows"], False
+
+    if start == 0 and not skip_rows:
+        digest = ContentHash().prefix(path, size)
+        if digest in state["hashes"]:
+            state["files"][key] = {"rows": None, "bytes": size, "sha256": digest, "ts_format": None}
+            _save_import_state(state)
             return 0
 
-    order_id_start = next_id("orders", "order_id", start=1)
-    oi_id_start = next_id("order_items", "order_item_id", start=1)
+    bootstrap = state["watermark"] is None and not state["files"] and _real_orders_imported()
+    ts_format = (entry or {}).get("ts_format") or sniff_ts_format(path)
+    rows = skip_rows
+    if start:
+        rows = entry["rows"] or 0
+    # marca pendiente de esta corrida (si se retoma un import interrumpido, la que
+    # ya llevaba); la global no se mueve hasta terminar el archivo
+    start_wm = state["watermark"]
+    wm = (entry or {}).get("watermark", start_wm) if skip_rows else start_wm
+    n = 0
+    for chunk in iter_orders_csv(path, chunksize, progress, start=start, skip_rows=skip_rows,
+                                 ts_format=ts_format, content_hash=content if not skip_rows else None):
+        if not bootstrap:
+            new_rows = _after_watermark(chunk, start_wm) if use_watermark else None
+            n += _import_chunk(chunk, offset=rows, new_rows=new_rows)
+        rows += len(chunk)
+        wm = _advance_watermark(wm, chunk)
+        state["files"][key] = {"rows": rows, "bytes": None, "sha256": None, "ts_format": ts_format, "watermark": wm}
+        _save_import_state(state)
 
-    new_orders, new_items = [], []
-    branches_pool = [1,2,3]
+    if skip_rows:
+        # el hash no se pudo calcular mientras se leía: se calcula ahora sobre todo el archivo
+        content = ContentHash()
+        content.prefix(path, os.path.getsize(path))
+    state["watermark"] = wm
+    state["files"][key] = {"rows": rows, "bytes": content.nbytes, "sha256": content.hexdigest(), "ts_format": ts_format}
+    if content.hexdigest() not in state["hashes"]:
+        state["hashes"].append(content.hexdigest())
+    _save_import_state(state)
+    return n
 
-    for i, row in df_raw.reset_index(drop=True).iterrows():
-        cname = str(row.get("customer_name","")).strip() or "Cliente_Anon"
-        cid = ensure_customer(cname)
+def _import_chunk(df_raw: pd.DataFrame, offset: int = 0, new_rows: np.ndarray | None = None) -> int:
+    with Session() as s:
+        df = df_raw.reset_index(drop=True)
+        n = len(df)
+        names = df["customer_name"].astype(str).str.strip() if "customer_name" in df.columns else pd.Series("", index=df.index)
+        names = names.mask(names.isin(["", "nan"]), "Cliente_Anon")
+        cids = ensure_customers(names, s)
 
-        oid = order_id_start + i
-        p = products[(products["food_item"] == row["food_item"]) & (products["category"] == row["category"])]
-        if p.empty:
-            continue
-        pid = int(p["product_id"].iloc[0])
+        keys = s.table("products")[["food_item", "category", "product_id"]].astype({"category": str}) \
+            .drop_duplicates(["food_item", "category"])
+        pids = df[["food_item", "category"]].astype({"category": str}).merge(keys, on=["food_item", "category"], how="left")["product_id"]
+        keep = pids.notna().to_numpy()
+        if new_rows is not None:
+            keep = keep & new_rows
 
-        ts = pd.to_datetime(row.get("order_ts"), errors="coerce")
-        ts_iso = ts.isoformat() if pd.notna(ts) else datetime.utcnow().isoformat()
+        branches_pool = [1,2,3]
+        ts = pd.to_datetime(df["order_ts"], errors="coerce") if "order_ts" in df.columns else pd.Series(pd.NaT, index=df.index)
+        qty = df["quantity"].astype(int) if "quantity" in df.columns else pd.Series(1, index=df.index)
+        unit_price = df["price"].astype(float) if "price" in df.columns else pd.Series(0.0, index=df.index)
+        line_total = df["line_total"].astype(float) if "line_total" in df.columns else unit_price * qty
+        payment = df["payment_method"].astype(str) if "payment_method" in df.columns else pd.Series("Cash", index=df.index)
 
-        branch_id = branches_pool[i % len(branches_pool)]
-        payment = str(row.get("payment_method","Cash"))
-        qty = int(row.get("quantity",1))
-        unit_price = float(row.get("price",0.0))
-        line_total = float(row.get("line_total", unit_price*qty))
+        k = int(keep.sum())
+        oids = reserve_ids("orders", "order_id", k, start=1) + pd.RangeIndex(k)
+        oi_ids = reserve_ids("order_items", "order_item_id", k, start=1) + pd.RangeIndex(k)
 
-        new_orders.append({
-            "order_id": oid,
-            "customer_id": cid,
-            "branch_id": branch_id,
-            "order_ts": ts_iso,
+        new_orders = pd.DataFrame({
+            "order_id": oids,
+            "customer_id": cids[keep].to_numpy(),
+            "branch_id": [branches_pool[(offset + i) % len(branches_pool)] for i in range(n) if keep[i]],
+            "order_ts": ts[keep].fillna(pd.Timestamp(datetime.utcnow())).to_numpy(),
             "status": "PAID",
-            "payment_method": payment,
-            "total_amount": line_total,
+            "payment_method": payment[keep].to_numpy(),
+            "total_amount": line_total[keep].to_numpy(),
             "is_synthetic": 0
         })
-        new_items.append({
-            "order_item_id": oi_id_start + i,
-            "order_id": oid,
-            "product_id": pid,
-            "quantity": qty,
-            "unit_price": unit_price,
-            "line_total": line_total
+        new_items = pd.DataFrame({
+            "order_item_id": oi_ids,
+            "order_id": oids,
+            "product_id": pids[keep].astype(int).to_numpy(),
+            "quantity": qty[keep].to_numpy(),
+            "unit_price": unit_price[keep].to_numpy(),
+            "line_total": line_total[keep].to_numpy()
         })
 
-    append_table("orders", pd.DataFrame(new_orders))
-    append_table("order_items", pd.DataFrame(new_items))
+        s.append("orders", new_orders)
+        s.append("order_items", new_items)
+        kpi_cube.append_orders(s, new_orders, new_items)
     return len(new_orders)
 
 def create_order(customer_name: str, branch_id: int, payment_method: str, order_ts: str | None = None) -> int:
@@ -100,45 +246,76 @@ def create_order(customer_name: str, branch_id: int, payment_method: str, order_
     return oid
 
 def add_item(order_id: int, product_id: int, quantity: int):
-    prod = read_table("products")
-    p = prod[pd.to_numeric(prod["product_id"], errors="coerce") == int(product_id)]
-    if p.empty:
+    add_items(order_id, [(product_id, quantity)])
+
+def add_items(order_id: int, lines: list[tuple[int, int]], session: Session | None = None) -> pd.DataFrame:
+    # todas las líneas en una pasada: stock validado contra inventory de la sucursal
+    # (menos lo que ya tiene el pedido abierto), un solo append a order_items y
+    # total = total actual + nuevas líneas (sin re-escanear)
+    if session is None:
+        with Session() as s:
+            return add_items(order_id, lines, session=s)
+    s = session
+
+    order = s.row("orders", order_id=int(order_id))
+    if order is None:
+        raise ValueError("Order not found")
+    new = pd.DataFrame(lines, columns=["product_id", "quantity"]).astype({"product_id": int, "quantity": int})
+    if new.empty:
+        return new
+
+    products = s.table("products")[["product_id", "sale_price"]]
+    new = new.merge(products, on="product_id", how="left")
+    if new["sale_price"].isna().any():
         raise ValueError("Product not found")
-    unit_price = float(p["sale_price"].iloc[0])
-    line_total = unit_price * int(quantity)
 
-    item_id = next_id("order_items","order_item_id",start=1)
-    append_table("order_items", pd.DataFrame([{
-        "order_item_id": item_id,
+    need = new.groupby("product_id", as_index=False)["quantity"].sum()
+    inv = s.rows("inventory", branch_id=int(order["branch_id"]))[["product_id", "stock_on_hand"]]
+    need = need.merge(inv, on="product_id", how="left")
+    if need["stock_on_hand"].isna().any():
+        raise ValueError("No inventory for product in branch")
+    # el stock se descuenta en checkout: las líneas ya cargadas en el pedido cuentan
+    held = s.rows("order_items", order_id=int(order_id)).groupby("product_id")["quantity"].sum()
+    need["available"] = need["stock_on_hand"] - need["product_id"].map(held).fillna(0)
+    short = need[need["available"] < need["quantity"]]
+    if not short.empty:
+        detail = ", ".join(f"{int(r.product_id)} (available {max(int(r.available), 0)})" for r in short.itertuples())
+        raise ValueError(f"Insufficient stock for products {detail}")
+
+    start = reserve_ids("order_items", "order_item_id", len(new), start=1)
+    items = pd.DataFrame({
+        "order_item_id": start + pd.RangeIndex(len(new)),
         "order_id": int(order_id),
-        "product_id": int(product_id),
-        "quantity": int(quantity),
-        "unit_price": unit_price,
-        "line_total": float(line_total)
-    }]))
+        "product_id": new["product_id"],
+        "quantity": new["quantity"],
+        "unit_price": new["sale_price"].astype(float),
+        "line_total": new["sale_price"].astype(float) * new["quantity"]
+    })
+    s.append("order_items", items)
 
-    orders = read_table("orders")
-    items = read_table("order_items")
-    items["order_id"] = pd.to_numeric(items["order_id"], errors="coerce")
-    total = float(items[items["order_id"] == int(order_id)]["line_total"].sum())
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    orders.loc[orders["order_id"] == int(order_id), "total_amount"] = total
-    write_table("orders", orders)
-
-def checkout(order_id: int) -> dict:
-    orders = read_table("orders")
-    orders["order_id"] = pd.to_numeric(orders["order_id"], errors="coerce")
-    mask = orders["order_id"] == int(order_id)
-    if not mask.any():
-        raise ValueError("Order not found")
+    total = float(order["total_amount"] or 0.0) + float(items["line_total"].sum())
+    s.update("orders", {"order_id": int(order_id)}, {"total_amount": total})
+    return items
 
-    orders.loc[mask, "status"] = "PAID"
-    write_table("orders", orders)
+def checkout(order_id: int, async_post: bool | None = None) -> dict:
+    # una sola sesión: cada tabla se lee una vez y se escribe una vez al final
+    if async_post is None:
+        async_post = ASYNC_POSTING
+    with Session() as s:
+        order = s.row("orders", order_id=int(order_id))
+        if order is None:
+            raise ValueError("Order not found")
+        s.update("orders", {"order_id": int(order_id)}, {"status": "PAID"})
+        if order["status"] != "PAID":
+            kpi_cube.add_orders([int(order_id)], s)
 
-    # ✅ Integración automática TPS -> ERP + SCM
-    erp.record_sale(int(order_id))
-    scm.apply_sale(int(order_id))
+        if async_post:
+            # ERP + SCM los postea el worker de src/posting.py
+            posting.enqueue_sale(int(order_id), session=s)
+        else:
+            # ✅ Integración automática TPS -> ERP + SCM
+            erp.record_sale(int(order_id), session=s)
+            scm.apply_sale(int(order_id), session=s)
 
-    out = read_table("orders")
-    out["order_id"] = pd.to_numeric(out["order_id"], errors="coerce")
-    return out[out["order_id"] == int(order_id)].iloc[0].to_dict()
+        out = s.row("orders", order_id=int(order_id))
+    return out
@@ -0,0 +1,16 @@
+import pandas as pd
+
+from src.backends import ColumnarBackend
+
+
+def test_appends_never_compact_and_compact_keeps_the_rows(tmp_path):
+    be = ColumnarBackend(tmp_path)
+    be.write("orders", pd.DataFrame({"order_id": [1], "status": ["OPEN"]}))
+    for i in range(2, 41):
+        be.append("orders", pd.DataFrame({"order_id": [i], "status": ["OPEN"]}))
+
+    assert len(be.parts("orders")) == 40
+    assert be.compact("orders") == 40
+    assert [p.name for p in be.parts("orders")] == ["part-000000.parquet"]
+    assert be.read("orders")["order_id"].tolist() == list(range(1, 41))
+    assert be.compact("orders") == 0
@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+from src.forecast import forecast_demand
+
+
+def test_series_without_recent_sales_keep_their_level():
+    # 2 unidades al día durante 20 semanas de 2019, y otra serie con una venta en 2026
+    days = pd.date_range("2019-01-07 12:00", periods=140, freq="D")
+    history = pd.DataFrame({
+        "branch_id": [1] * len(days) + [2],
+        "product_id": [5] * len(days) + [9],
+        "order_ts": list(days) + [pd.Timestamp("2026-10-12 12:00")],
+        "quantity": [2] * len(days) + [1],
+    })
+    series, profile, sigma = forecast_demand(history, alpha=0.3)
+
+    stale = int(np.flatnonzero((series["branch_id"] == 1).to_numpy())[0])
+    assert np.isclose(profile[stale].sum(), 14.0)
+    assert sigma[stale] < 1e-3
@@ -0,0 +1,49 @@
+import os
+import shutil
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# TABLE_DIR es relativo al directorio actual: cada escenario corre en un proceso
+# aparte dentro de tmp_path para no tocar tables_csv/ del repo.
+SCRIPT = textwrap.dedent("""
+    import sys
+    from src import tps
+    from src.storage import read_table
+    from src.seed_master import seed_and_save
+    from src.etl import iter_orders_csv, profile_orders, merge_profiles
+
+    path, chunksize = sys.argv[1], int(sys.argv[2])
+    tps.init_tables()
+    seed_and_save(profile=merge_profiles(profile_orders(c) for c in iter_orders_csv(path, 1000, progress=None)))
+    first = tps.import_real_file(path, chunksize, progress=None)
+    again = tps.import_real_file(path, chunksize, progress=None)
+    orders = read_table("orders")
+    print(first, again, int((orders["is_synthetic"] == 0).sum()))
+""")
+
+
+def run_import(tmp_path: Path, csv: Path, chunksize: int) -> list[int]:
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "STORAGE_BACKEND": "csv", "MPLBACKEND": "Agg"}
+    out = subprocess.run([sys.executable, "-c", SCRIPT, str(csv), str(chunksize)],
+                         cwd=tmp_path, env=env, capture_output=True, text=True, check=True)
+    return [int(v) for v in out.stdout.split()[-3:]]
+
+
+def test_unsorted_export_with_small_chunks_imports_every_row(tmp_path):
+    raw = pd.read_csv(ROOT / "restaurant_orders.csv")
+    ts = pd.to_datetime(raw["Order Time"], format="%d/%m/%Y %H:%M")
+    assert not ts.is_monotonic_increasing  # el export real no viene ordenado
+
+    csv = tmp_path / "orders.csv"
+    shutil.copy(ROOT / "restaurant_orders.csv", csv)
+    first, again, real = run_import(tmp_path, csv, chunksize=100)
+
+    assert first == len(raw)
+    assert again == 0
+    assert real == len(raw)
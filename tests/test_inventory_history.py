@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Igual que test_import: proceso aparte dentro de tmp_path (TABLE_DIR es relativo).
+SCRIPT = textwrap.dedent("""
+    from src import tps, inventory_history
+    from src.storage import read_table, update_rows
+    from src.seed_master import seed_and_save
+    from src.etl import iter_orders_csv, profile_orders, merge_profiles
+
+    tps.init_tables()
+    profile = merge_profiles(profile_orders(c) for c in iter_orders_csv("restaurant_orders.csv", 1000, progress=None))
+    seed_and_save(profile=profile)
+    pid = int(read_table("inventory")["product_id"].iloc[0])
+    oid = tps.create_order("X", 1, "Card")
+    tps.add_items(oid, [(pid, 2)])
+    tps.checkout(oid)
+    clean = len(inventory_history.verify())
+    seed_and_save(profile=profile)  # resiembra sobre el inventario ya vendido
+    reseeded = len(inventory_history.verify())
+
+    # cambio de stock sin movimiento, y después un checkpoint que ya lo incluye
+    update_rows("inventory", {"branch_id": 1, "product_id": pid}, {"stock_on_hand": 999})
+    inventory_history.take_snapshot()
+    drift = inventory_history.verify()
+    print(clean, reseeded, len(drift), int(drift["drift"].iloc[0]) if len(drift) else 0)
+""")
+
+
+def test_verify_replays_from_the_baseline_checkpoint(tmp_path):
+    (tmp_path / "restaurant_orders.csv").write_bytes((ROOT / "restaurant_orders.csv").read_bytes())
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "STORAGE_BACKEND": "csv", "MPLBACKEND": "Agg"}
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", SCRIPT], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True)
+    clean, reseeded, rows, drift = [int(v) for v in out.stdout.split()[-4:]]
+
+    assert clean == 0
+    assert reseeded == 0
+    assert rows == 1
+    assert drift > 0
@@ -0,0 +1,54 @@
+import pandas as pd
+
+from src.backends import CsvBackend, MatrixInventoryBackend
+from src.inventory_store import InventoryMatrix
+
+KEYS = ["branch_id", "product_id"]
+INV = pd.DataFrame({
+    "branch_id": [1, 1, 2, 3],
+    "product_id": [5, 7, 5, 9],
+    "stock_on_hand": [10, 2, 3, 4],
+    "stock_min": [2, 0, 9, 0],
+    "reorder_qty": [5, 5, 5, 5],
+})
+
+
+def backend(tmp_path):
+    be = MatrixInventoryBackend(tmp_path, CsvBackend(tmp_path))
+    be.write("inventory", INV)
+    return be
+
+
+def test_keyed_ops_and_appends_inside_the_axes_are_written_in_place(tmp_path):
+    be = backend(tmp_path)
+    ino = be.bin.stat().st_ino
+
+    be.commit({}, {"inventory": pd.DataFrame({"branch_id": [2], "product_id": [9], "stock_on_hand": [6],
+                                              "stock_min": [1], "reorder_qty": [2]})}, {}, {"inventory": [
+        ("add", KEYS, pd.DataFrame({"branch_id": [1, 1, 4], "product_id": [5, 5, 5], "stock_on_hand": [-3, -2, -1]})),
+        ("set", KEYS, pd.DataFrame({"branch_id": [3], "product_id": [9], "stock_min": [8]})),
+    ]})
+
+    assert be.bin.stat().st_ino == ino
+    inv = be.read("inventory").set_index(KEYS)
+    assert inv.loc[(1, 5), "stock_on_hand"] == 5
+    assert inv.loc[(3, 9), "stock_min"] == 8
+    assert inv.loc[(2, 9)].tolist() == [6, 1, 2]
+    assert len(inv) == 5
+
+
+def test_append_outside_the_axes_rewrites_the_file(tmp_path):
+    be = backend(tmp_path)
+    be.append("inventory", pd.DataFrame({"branch_id": [4], "product_id": [5], "stock_on_hand": [1],
+                                         "stock_min": [0], "reorder_qty": [0]}))
+    m = InventoryMatrix.load(be.bin)
+    assert m.branch_ids.tolist() == [1, 2, 3, 4]
+    assert m.get(4, 5)["stock_on_hand"] == 1
+
+
+def test_lookup_and_below_min_read_only_the_cells(tmp_path):
+    be = backend(tmp_path)
+    got = be.lookup("inventory", KEYS, pd.DataFrame({"branch_id": [2, 1, 9], "product_id": [5, 7, 5]}))
+    assert got[KEYS].values.tolist() == [[2, 5], [1, 7]]
+    assert be.below_min("inventory")[KEYS].values.tolist() == [[2, 5]]
+    assert InventoryMatrix.load(be.bin).select(branch_id=1)["product_id"].tolist() == [5, 7]
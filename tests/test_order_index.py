@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Igual que test_import: proceso aparte dentro de tmp_path (TABLE_DIR es relativo).
+SCRIPT = textwrap.dedent("""
+    from src import tps, order_index, storage
+    from src.storage import read_table, update_rows, write_table
+    from src.seed_master import seed_and_save
+    from src.etl import iter_orders_csv, profile_orders, merge_profiles
+
+    tps.init_tables()
+    seed_and_save(profile=merge_profiles(profile_orders(c) for c in iter_orders_csv("restaurant_orders.csv", 1000, progress=None)))
+    tps.import_real_file("restaurant_orders.csv", 1000, progress=None)
+    order_index.bounds()
+
+    reads = []
+    order_index.read_table = lambda name: reads.append(name) or storage.read_table(name)
+    oid = tps.create_order("X", 1, "Card")
+    update_rows("orders", {"order_id": oid}, {"status": "CANCELLED"})
+    indexed = oid in order_index.window_order_ids()
+    after_append_and_update = (len(reads), indexed)
+
+    orders = read_table("orders")
+    write_table("orders", orders[orders["order_id"] != oid])
+    indexed = oid in order_index.window_order_ids()
+    after_rewrite = (len(reads), indexed)
+    print(*after_append_and_update, *after_rewrite, len(order_index.window_order_ids()) == len(orders) - 1)
+""")
+
+
+def test_index_merges_appends_and_ignores_status_updates(tmp_path):
+    (tmp_path / "restaurant_orders.csv").write_bytes((ROOT / "restaurant_orders.csv").read_bytes())
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "STORAGE_BACKEND": "csv", "MPLBACKEND": "Agg"}
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", SCRIPT], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True)
+    reads, indexed, reads_rewrite, still_indexed, matches = out.stdout.split()[-5:]
+
+    assert (reads, indexed) == ("0", "True")
+    assert (reads_rewrite, still_indexed, matches) == ("1", "False", "True")
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Igual que test_import: proceso aparte dentro de tmp_path (TABLE_DIR es relativo).
+SCRIPT = textwrap.dedent("""
+    import pandas as pd
+    from src import tps, scm
+    from src.storage import append_table, read_table
+    from src.seed_master import seed_and_save
+    from src.etl import iter_orders_csv, profile_orders, merge_profiles
+
+    tps.init_tables()
+    seed_and_save(profile=merge_profiles(profile_orders(c) for c in iter_orders_csv("restaurant_orders.csv", 1000, progress=None)))
+    pid = int(read_table("inventory")["product_id"].iloc[0])
+    append_table("purchase_orders", pd.DataFrame({"po_id": [1, 2], "po_ts": pd.Timestamp("2024-01-01"), "supplier_id": 1,
+                                                  "branch_id": 1, "status": "CREATED", "expected_date": pd.Timestamp("2024-01-03")}))
+    append_table("purchase_order_items", pd.DataFrame({"po_item_id": [1], "po_id": [1], "product_id": [pid],
+                                                       "qty_ordered": [4], "unit_cost_est": [1.0]}))
+    scm.receive_pos([1, 2])
+    po = read_table("purchase_orders").sort_values("po_id")
+    print(",".join(po["status"]), int(po["received_ts"].notna().sum()))
+""")
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_receive_marks_every_selected_po_even_without_items(tmp_path, backend):
+    (tmp_path / "restaurant_orders.csv").write_bytes((ROOT / "restaurant_orders.csv").read_bytes())
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "STORAGE_BACKEND": backend, "MPLBACKEND": "Agg"}
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", SCRIPT], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True)
+    status, received = out.stdout.split()[-2:]
+
+    assert status == "RECEIVED,RECEIVED"
+    assert received == "2"
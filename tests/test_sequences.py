@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Igual que test_import: procesos aparte dentro de tmp_path (TABLE_DIR es relativo).
+SCRIPT = textwrap.dedent("""
+    from src.storage import next_id
+    print(*[next_id("orders", "order_id") for _ in range(100)])
+""")
+
+
+def test_processes_never_reserve_the_same_id(tmp_path):
+    (tmp_path / "tables_csv").mkdir()
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "STORAGE_BACKEND": "csv", "MPLBACKEND": "Agg"}
+    procs = [subprocess.Popen([sys.executable, "-W", "ignore", "-c", SCRIPT], cwd=tmp_path, env=env,
+                              stdout=subprocess.PIPE, text=True) for _ in range(4)]
+    ids = [int(v) for p in procs for v in p.communicate()[0].split()]
+
+    assert all(p.returncode == 0 for p in procs)
+    assert sorted(ids) == list(range(1, 401))
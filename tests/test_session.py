@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Igual que test_import: proceso aparte dentro de tmp_path (TABLE_DIR es relativo).
+SCRIPT = textwrap.dedent("""
+    import pandas as pd
+    from src import tps, scm, posting
+    from src.session import Session
+    from src.storage import read_table
+    from src.seed_master import seed_and_save
+    from src.etl import iter_orders_csv, profile_orders, merge_profiles
+
+    tps.init_tables()
+    seed_and_save(profile=merge_profiles(profile_orders(c) for c in iter_orders_csv("restaurant_orders.csv", 1000, progress=None)))
+    inv = read_table("inventory")
+    pid = int(inv["product_id"].iloc[0])
+    soh = lambda b: int(read_table("inventory").query("branch_id == @b and product_id == @pid")["stock_on_hand"].iloc[0])
+
+    oid = tps.create_order("X", 1, "Card")
+    tps.add_items(oid, [(pid, 5)])
+    tps.checkout(oid, async_post=True)
+    before = soh(1)
+    with Session() as s:
+        s.table("inventory")   # la UI lee inventory...
+        posting.drain()        # ...el worker descuenta la venta...
+        scm.set_stock(pd.DataFrame([{"branch_id": 2, "product_id": pid, "stock_on_hand": 99}]), session=s)
+    print(before, soh(1), soh(2))
+""")
+
+
+def test_worker_posting_survives_an_interleaved_session_commit(tmp_path):
+    (tmp_path / "restaurant_orders.csv").write_bytes((ROOT / "restaurant_orders.csv").read_bytes())
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "STORAGE_BACKEND": "csv", "MPLBACKEND": "Agg"}
+    out = subprocess.run([sys.executable, "-c", SCRIPT], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True)
+    before, after, other = [int(v) for v in out.stdout.split()[-3:]]
+
+    assert after == before - 5
+    assert other == 99
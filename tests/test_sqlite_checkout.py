@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Igual que test_import: proceso aparte dentro de tmp_path (TABLE_DIR es relativo).
+SCRIPT = textwrap.dedent("""
+    from src import tps
+    from src.backends import SqliteBackend
+    from src.storage import get_row, read_table
+    from src.seed_master import seed_and_save
+    from src.etl import iter_orders_csv, profile_orders, merge_profiles
+
+    tps.init_tables()
+    seed_and_save(profile=merge_profiles(profile_orders(c) for c in iter_orders_csv("restaurant_orders.csv", 1000, progress=None)))
+    tps.import_real_file("restaurant_orders.csv", 1000, progress=None)
+    pid = int(read_table("inventory")["product_id"].iloc[0])
+    before = int(get_row("inventory", branch_id=1, product_id=pid)["stock_on_hand"])
+    oid = tps.create_order("X", 1, "Card")
+    tps.add_items(oid, [(pid, 2)])
+
+    staged, reads = [], []
+    stage, read = SqliteBackend.stage, SqliteBackend.read
+    SqliteBackend.stage = lambda self, plan, frames, *a, **k: staged.extend(frames) or stage(self, plan, frames, *a, **k)
+    SqliteBackend.read = lambda self, name: reads.append(name) or read(self, name)
+    tps.checkout(oid)
+    after = int(get_row("inventory", branch_id=1, product_id=pid)["stock_on_hand"])
+    print(",".join(staged) or "-", ",".join(reads) or "-", before - after)
+""")
+
+
+def test_checkout_updates_inventory_in_place_without_full_reads(tmp_path):
+    (tmp_path / "restaurant_orders.csv").write_bytes((ROOT / "restaurant_orders.csv").read_bytes())
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "STORAGE_BACKEND": "sqlite", "MPLBACKEND": "Agg"}
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", SCRIPT], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True)
+    staged, reads, sold = out.stdout.split()[-3:]
+
+    assert "inventory" not in staged.split(",")
+    assert not {"orders", "order_items", "inventory"} & set(reads.split(","))
+    assert sold == "2"